@@ -0,0 +1,150 @@
+# ai_executor.py
+"""
+Исполнитель ходов ИИ вне event loop.
+
+Режимы (AI_EXECUTOR_MODE):
+    inline  — ход считается прямо в обработчике (для отладки);
+    thread  — пул потоков;
+    process — пул процессов с прогретыми воркерами (таблица 3x3 строится при старте воркера).
+
+Если в пуле уже AI_MAX_PENDING задач или вычисление не уложилось в
+AI_MOVE_TIMEOUT_SECONDS, ИИ ходит по дешёвой эвристике game_ai.quick_move,
+чтобы тяжёлые партии против ИИ не задерживали остальные чаты. Задача с
+истёкшим таймаутом считается занимающей воркер, пока действительно не
+закончится (её нельзя прервать в пуле).
+"""
+import logging
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+import game_ai
+from config import (
+    AI_EXECUTOR_MODE, AI_EXECUTOR_WORKERS, AI_MOVE_TIMEOUT_SECONDS, AI_MAX_PENDING
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AIExecutor:
+    """Пул для вычисления ходов ИИ с таймаутами, запасной эвристикой и метриками"""
+
+    def __init__(self, mode: str, workers: int, timeout: float, max_pending: int) -> None:
+        if mode not in ("inline", "thread", "process"):
+            logger.warning(f"Неизвестный AI_EXECUTOR_MODE={mode!r}, используется thread")
+            mode = "thread"
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._pool: Optional[Executor] = None
+        # Метрики
+        self.pending = 0
+        self.max_pending_seen = 0
+        self.completed = 0
+        self.fallbacks = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.compute_time_total = 0.0
+        self.compute_time_max = 0.0
+
+    def start(self) -> None:
+        """Создаёт пул и прогревает воркеры"""
+        if self.mode == "inline" or self._pool is not None:
+            game_ai.build_table()
+            return
+        if self.mode == "process":
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=game_ai.build_table)
+            # Запускаем все процессы сразу, а не при первом ходе
+            for _ in range(self.workers):
+                self._pool.submit(game_ai.build_table)
+        else:
+            game_ai.build_table()
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ai")
+        logger.info(f"AI executor started: mode={self.mode}, workers={self.workers}")
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _record(self, elapsed: float) -> None:
+        self.completed += 1
+        self.compute_time_total += elapsed
+        self.compute_time_max = max(self.compute_time_max, elapsed)
+
+    async def compute_move(self, board: list, ai_symbol: str, human_symbol: str,
+                           win_length: Optional[int] = None) -> Optional[int]:
+        """Вычисляет ход ИИ, не блокируя event loop"""
+        board = list(board)
+        if self._pool is None:
+            if self.mode != "inline":
+                self.start()
+            if self._pool is None:
+                started = time.monotonic()
+                move = game_ai.best_move(board, ai_symbol, human_symbol, win_length)
+                self._record(time.monotonic() - started)
+                return move
+
+        if self.pending >= self.max_pending:
+            self.fallbacks += 1
+            logger.warning(f"AI executor saturated ({self.pending} pending), using heuristic move")
+            return game_ai.quick_move(board, ai_symbol, human_symbol, win_length)
+
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        started = time.monotonic()
+        try:
+            job = self._pool.submit(game_ai.best_move, board, ai_symbol, human_symbol, win_length)
+        except Exception as e:
+            self.pending -= 1
+            self.errors += 1
+            self.fallbacks += 1
+            logger.error(f"AI move failed: {e}, using heuristic move")
+            return game_ai.quick_move(board, ai_symbol, human_symbol, win_length)
+        # Воркер занят, пока вычисление не закончится — даже если ждать его перестали по таймауту
+        job.add_done_callback(lambda _: self._release_soon(loop))
+        try:
+            move = await asyncio.wait_for(asyncio.wrap_future(job), timeout=self.timeout)
+            self._record(time.monotonic() - started)
+            return move
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.fallbacks += 1
+            logger.warning(f"AI move timed out after {self.timeout}s, using heuristic move")
+        except Exception as e:
+            self.errors += 1
+            self.fallbacks += 1
+            logger.error(f"AI move failed: {e}, using heuristic move")
+        return game_ai.quick_move(board, ai_symbol, human_symbol, win_length)
+
+    def _release_soon(self, loop: asyncio.AbstractEventLoop) -> None:
+        # Вызывается из потока пула
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # Event loop уже закрыт (остановка бота)
+            pass
+
+    def _release(self) -> None:
+        self.pending -= 1
+
+    def stats(self) -> dict:
+        """Метрики исполнителя: глубина очереди и время вычисления ходов"""
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending_seen": self.max_pending_seen,
+            "completed": self.completed,
+            "fallbacks": self.fallbacks,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "compute_ms_avg": round(self.compute_time_total / self.completed * 1000, 2) if self.completed else 0.0,
+            "compute_ms_max": round(self.compute_time_max * 1000, 2),
+        }
+
+
+ai_executor = AIExecutor(AI_EXECUTOR_MODE, AI_EXECUTOR_WORKERS, AI_MOVE_TIMEOUT_SECONDS, AI_MAX_PENDING)
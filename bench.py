@@ -0,0 +1,234 @@
+# bench.py
+"""
+Бенчмарк движка ИИ без Telegram: партии ИИ против случайного игрока и ИИ против ИИ.
+
+Примеры:
+    python bench.py --games 500 --output bench_baseline.json
+    python bench.py --size 4 --games 20 --budget 0.2
+    python bench.py --games 500 --compare bench_baseline.json
+
+Печатает позиций/сек (вызовы check_winner), ходов/сек, задержку хода p50/p99 и
+пиковую память, результаты сохраняет в JSON (--output), чтобы сравнивать прогоны.
+
+Время меряется --repeats раз, в отчёт идёт медиана повторов, а разброс повторов
+(noise) — отдельно. Память — отдельным прогоном под tracemalloc: трассировка
+замедляет каждое выделение памяти и исказила бы время. Позиции для замера
+check_winner собираются в первом повторе по времени, вне трассировки, — иначе
+их список и был бы пиком памяти.
+
+При сравнении (--compare) регрессией считается ухудшение больше --threshold
+или суммарного разброса двух прогонов, если он больше: шум не выдаётся за
+регрессию.
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import game_ai
+from game_logic import check_winner, win_length_for
+
+# Метрики, у которых «больше — лучше»; у остальных лучше меньше
+HIGHER_IS_BETTER = ("positions_per_sec", "moves_per_sec")
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def play_game(size: int, ai_players: str, budget: Optional[float], rng: random.Random,
+              latencies: List[float], positions: Optional[List[list]]) -> str:
+    """Играет одну партию. ai_players — символы, за которые ходит ИИ ('X', 'O' или 'XO')."""
+    win_length = win_length_for(size)
+    board = list(range(1, size * size + 1))
+    symbol = rng.choice("XO")
+    while True:
+        other = "O" if symbol == "X" else "X"
+        if symbol in ai_players:
+            started = time.perf_counter()
+            move = game_ai.best_move(board, symbol, other, win_length, budget)
+            latencies.append(time.perf_counter() - started)
+        else:
+            move = rng.choice([i for i, cell in enumerate(board) if isinstance(cell, int)])
+        board[move] = symbol
+        if positions is not None:
+            positions.append(list(board))
+        winner, _ = check_winner(board, win_length)
+        if winner:
+            return winner
+        symbol = other
+
+
+def play_games(mode: str, games: int, size: int, budget: Optional[float], seed: int,
+               latencies: List[float], positions: Optional[List[list]] = None) -> Dict[str, int]:
+    """Играет games партий с одним и тем же seed; возвращает исходы"""
+    rng = random.Random(seed)
+    random.seed(seed)
+    outcomes: Dict[str, int] = {}
+    ai_players = "XO" if mode == "ai-vs-ai" else "O"
+    for _ in range(games):
+        winner = play_game(size, ai_players, budget, rng, latencies, positions)
+        outcomes[winner] = outcomes.get(winner, 0) + 1
+    return outcomes
+
+
+def _timing_pass(mode: str, games: int, size: int, budget: Optional[float], seed: int,
+                 positions: Optional[List[list]]) -> Dict[str, float]:
+    latencies: List[float] = []
+    started = time.perf_counter()
+    outcomes = play_games(mode, games, size, budget, seed, latencies, positions)
+    elapsed = time.perf_counter() - started
+    return {
+        "outcomes": outcomes,
+        "moves": len(latencies),
+        "elapsed_sec": elapsed,
+        "moves_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "move_latency_p50_ms": _percentile(latencies, 50) * 1000,
+        "move_latency_p99_ms": _percentile(latencies, 99) * 1000,
+    }
+
+
+def _check_pass(positions: List[list], size: int) -> float:
+    """Позиций/сек для check_winner на всех встреченных позициях"""
+    win_length = win_length_for(size)
+    rounds = max(1, 200_000 // max(1, len(positions)))
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for board in positions:
+            check_winner(board, win_length)
+    elapsed = time.perf_counter() - started
+    return rounds * len(positions) / elapsed if elapsed else 0.0
+
+
+def _memory_pass(mode: str, games: int, size: int, budget: Optional[float], seed: int) -> float:
+    """Пиковая память партий (КБ) — отдельный прогон, время в нём не меряется"""
+    tracemalloc.start()
+    try:
+        play_games(mode, games, size, budget, seed, [])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+def _noise(values: List[float]) -> float:
+    """Разброс повторов: (max - min) / медиана"""
+    middle = statistics.median(values)
+    return (max(values) - min(values)) / middle if middle else 0.0
+
+
+def run_mode(mode: str, games: int, size: int, budget: Optional[float], seed: int,
+             repeats: int = 5) -> Dict[str, float]:
+    positions: List[list] = []
+    passes = [_timing_pass(mode, games, size, budget, seed, positions if i == 0 else None)
+              for i in range(max(1, repeats))]
+    checks = [_check_pass(positions, size) for _ in range(max(1, repeats))]
+    peak_kb = _memory_pass(mode, games, size, budget, seed)
+
+    timed = ("elapsed_sec", "moves_per_sec", "move_latency_p50_ms", "move_latency_p99_ms")
+    series = {name: [p[name] for p in passes] for name in timed}
+    series["positions_per_sec"] = checks
+    result = {
+        "games": games,
+        "repeats": len(passes),
+        "moves": passes[0]["moves"],
+        "outcomes": passes[0]["outcomes"],
+    }
+    for name in ("elapsed_sec", "moves_per_sec", "positions_per_sec", "move_latency_p50_ms", "move_latency_p99_ms"):
+        result[name] = round(statistics.median(series[name]), 4)
+    result["peak_memory_kb"] = round(peak_kb, 1)
+    result["noise"] = {name: round(_noise(values), 4) for name, values in series.items()}
+    return result
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """Список регрессий относительно baseline: ухудшение больше threshold (доля) и шума прогонов"""
+    regressions = []
+    for mode, metrics in current["results"].items():
+        base = baseline.get("results", {}).get(mode)
+        if not base:
+            continue
+        for name, value in metrics.items():
+            old = base.get(name)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            change = (value - old) / old
+            worse = -change if name in HIGHER_IS_BETTER else change
+            # Базы без повторов шума не знают — для них только threshold
+            noise = metrics.get("noise", {}).get(name, 0.0) + base.get("noise", {}).get(name, 0.0)
+            marker = ""
+            if name in HIGHER_IS_BETTER or name.endswith(("_ms", "_kb")):
+                if worse > max(threshold, noise):
+                    marker = "  <-- регрессия"
+                    regressions.append(f"{mode}.{name}: {old} -> {value} ({change:+.1%})")
+                print(f"  {mode}.{name}: {old} -> {value} ({change:+.1%}){marker}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк game_ai.best_move и game_logic.check_winner")
+    parser.add_argument("--games", type=int, default=200, help="партий на режим")
+    parser.add_argument("--size", type=int, default=3, help="сторона поля")
+    parser.add_argument("--budget", type=float, default=None, help="бюджет времени на ход для полей больше 3x3, сек")
+    parser.add_argument("--mode", choices=("ai-vs-random", "ai-vs-ai", "all"), default="all")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeats", type=int, default=5, help="повторов замера времени (в отчёте медиана)")
+    parser.add_argument("--output", default=None, help="куда сохранить результаты (JSON)")
+    parser.add_argument("--compare", default=None, help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.10, help="допустимое ухудшение (доля)")
+    args = parser.parse_args(argv)
+
+    # Базу читаем заранее: --output может указывать на тот же файл
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    # Таблица 3x3 строится один раз при старте бота — не включаем её в замеры
+    table_started = time.perf_counter()
+    table_size = game_ai.build_table()
+    table_ms = (time.perf_counter() - table_started) * 1000
+
+    modes = ("ai-vs-random", "ai-vs-ai") if args.mode == "all" else (args.mode,)
+    results = {}
+    for mode in modes:
+        results[mode] = run_mode(mode, args.games, args.size, args.budget, args.seed, args.repeats)
+        print(f"[{mode}] size={args.size}")
+        for name, value in results[mode].items():
+            print(f"  {name}: {value}")
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "size": args.size,
+        "budget": args.budget,
+        "table_positions": table_size,
+        "table_build_ms": round(table_ms, 2),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+    if baseline is not None:
+        print(f"Сравнение с {args.compare}:")
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print("Найдены регрессии:\n" + "\n".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+# bitboard.py
+"""
+Компактное представление доски: две битовые маски (клетки X и клетки O).
+
+Бит i соответствует клетке с индексом i (построчно). Выигрышные линии
+заранее переведены в маски, ничья определяется подсчётом занятых битов.
+Классическое поле 3x3 описано константами модуля, поля NxN с победой
+при k в ряд — объектами Geometry (см. geometry()).
+Для совместимости есть адаптеры из/в списочный формат game_logic
+(int — пустая клетка, 'X'/'O' — занятая).
+"""
+from functools import lru_cache
+from math import isqrt
+from typing import Iterator, List, Optional, Tuple, Union
+
+SIZE = 3
+CELLS = SIZE * SIZE
+FULL_MASK = (1 << CELLS) - 1
+DRAW = "Ничья"
+
+WIN_LINES: Tuple[Tuple[int, int, int], ...] = (
+    (0, 1, 2), (3, 4, 5), (6, 7, 8),  # горизонтали
+    (0, 3, 6), (1, 4, 7), (2, 5, 8),  # вертикали
+    (0, 4, 8), (2, 4, 6),             # диагонали
+)
+WIN_MASKS: Tuple[int, ...] = tuple(sum(1 << i for i in line) for line in WIN_LINES)
+
+# Перестановки клеток для 8 симметрий доски:
+# клетка i преобразованной доски берётся из клетки perm[i] исходной
+SYMMETRIES: Tuple[Tuple[int, ...], ...] = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8),  # тождественная
+    (6, 3, 0, 7, 4, 1, 8, 5, 2),  # поворот на 90°
+    (8, 7, 6, 5, 4, 3, 2, 1, 0),  # поворот на 180°
+    (2, 5, 8, 1, 4, 7, 0, 3, 6),  # поворот на 270°
+    (2, 1, 0, 5, 4, 3, 8, 7, 6),  # отражение по вертикали
+    (6, 7, 8, 3, 4, 5, 0, 1, 2),  # отражение по горизонтали
+    (0, 3, 6, 1, 4, 7, 2, 5, 8),  # главная диагональ
+    (8, 5, 2, 7, 4, 1, 6, 3, 0),  # побочная диагональ
+)
+
+
+def _permute_mask(mask: int, perm: Tuple[int, ...]) -> int:
+    result = 0
+    for i, src in enumerate(perm):
+        if mask >> src & 1:
+            result |= 1 << i
+    return result
+
+
+# SYMMETRY_TABLES[s][mask] — маска после применения симметрии s
+SYMMETRY_TABLES: Tuple[Tuple[int, ...], ...] = tuple(
+    tuple(_permute_mask(mask, perm) for mask in range(FULL_MASK + 1)) for perm in SYMMETRIES
+)
+
+
+class Geometry:
+    """Предвычисленные маски для поля size x size с победой при win_length в ряд"""
+
+    __slots__ = ("size", "win_length", "cells", "full_mask", "win_lines", "win_masks",
+                 "lines_through", "neighbors")
+
+    def __init__(self, size: int, win_length: int) -> None:
+        self.size = size
+        self.win_length = win_length
+        self.cells = size * size
+        self.full_mask = (1 << self.cells) - 1
+        lines = []
+        for row in range(size):
+            for col in range(size):
+                for d_row, d_col in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    end_row = row + d_row * (win_length - 1)
+                    end_col = col + d_col * (win_length - 1)
+                    if 0 <= end_row < size and 0 <= end_col < size:
+                        lines.append(tuple(
+                            (row + d_row * step) * size + col + d_col * step
+                            for step in range(win_length)
+                        ))
+        self.win_lines: Tuple[Tuple[int, ...], ...] = tuple(lines)
+        self.win_masks: Tuple[int, ...] = tuple(sum(1 << i for i in line) for line in lines)
+        # Для каждой клетки — номера линий, проходящих через неё
+        through: List[List[int]] = [[] for _ in range(self.cells)]
+        for n, line in enumerate(lines):
+            for i in line:
+                through[i].append(n)
+        self.lines_through: Tuple[Tuple[int, ...], ...] = tuple(tuple(t) for t in through)
+        # Маска соседей на расстоянии до 2 клеток (кандидаты ходов на больших полях)
+        neighbors = []
+        for i in range(self.cells):
+            row, col = divmod(i, size)
+            mask = 0
+            for r in range(max(0, row - 2), min(size, row + 3)):
+                for c in range(max(0, col - 2), min(size, col + 3)):
+                    mask |= 1 << (r * size + c)
+            neighbors.append(mask & ~(1 << i))
+        self.neighbors: Tuple[int, ...] = tuple(neighbors)
+
+    def winning_line(self, mask: int, cell: Optional[int] = None) -> Optional[Tuple[int, ...]]:
+        """Выигрышная линия, целиком занятая маской (только через cell, если задана)"""
+        indices = range(len(self.win_masks)) if cell is None else self.lines_through[cell]
+        for n in indices:
+            win = self.win_masks[n]
+            if mask & win == win:
+                return self.win_lines[n]
+        return None
+
+
+class WinTracker:
+    """Инкрементальная проверка победы/ничьей по последнему ходу.
+
+    Хранит число символов каждой стороны на каждой линии и число занятых клеток;
+    после хода проверяются только линии, проходящие через клетку хода.
+    """
+
+    __slots__ = ("geo", "x_counts", "o_counts", "filled", "result")
+
+    def __init__(self, geo: Geometry) -> None:
+        self.geo = geo
+        self.x_counts = bytearray(len(geo.win_lines))
+        self.o_counts = bytearray(len(geo.win_lines))
+        self.filled = 0
+        self.result: Tuple[Optional[str], Optional[List[int]]] = (None, None)
+
+    @classmethod
+    def from_board(cls, board: List[Union[int, str]], win_length: Optional[int] = None) -> "WinTracker":
+        """Строит трекер по уже заполненной доске-списку"""
+        tracker = cls(geometry(size_of(board), win_length))
+        for cell, symbol in enumerate(board):
+            if symbol in ("X", "O"):
+                tracker.apply(cell, symbol)
+        return tracker
+
+    def apply(self, cell: int, symbol: str) -> Tuple[Optional[str], Optional[List[int]]]:
+        """Учитывает ход и возвращает результат в контракте check_winner"""
+        counts = self.x_counts if symbol == "X" else self.o_counts
+        need = self.geo.win_length
+        self.filled += 1
+        for n in self.geo.lines_through[cell]:
+            counts[n] += 1
+            if counts[n] == need and self.result[0] is None:
+                self.result = (symbol, list(self.geo.win_lines[n]))
+        if self.result[0] is None and self.filled == self.geo.cells:
+            self.result = (DRAW, None)
+        return self.result
+
+
+@lru_cache(maxsize=None)
+def geometry(size: int, win_length: Optional[int] = None) -> Geometry:
+    """Геометрия поля (кэшируется). По умолчанию — победа при size в ряд."""
+    return Geometry(size, win_length or size)
+
+
+def size_of(board: List[Union[int, str]]) -> int:
+    """Сторона квадратной доски-списка"""
+    return isqrt(len(board))
+
+
+def from_list(board: List[Union[int, str]]) -> Tuple[int, int]:
+    """Переводит доску-список в пару масок (x_mask, o_mask)"""
+    x_mask = o_mask = 0
+    for i, cell in enumerate(board):
+        if cell == "X":
+            x_mask |= 1 << i
+        elif cell == "O":
+            o_mask |= 1 << i
+    return x_mask, o_mask
+
+
+def to_list(x_mask: int, o_mask: int, cells: int = CELLS) -> List[Union[int, str]]:
+    """Переводит пару масок обратно в доску-список (пустые клетки — номера 1..cells)"""
+    return [
+        "X" if x_mask >> i & 1 else "O" if o_mask >> i & 1 else i + 1
+        for i in range(cells)
+    ]
+
+
+def empty_cells(x_mask: int, o_mask: int, full_mask: int = FULL_MASK) -> Iterator[int]:
+    """Индексы пустых клеток по возрастанию"""
+    free = ~(x_mask | o_mask) & full_mask
+    while free:
+        low = free & -free
+        yield low.bit_length() - 1
+        free ^= low
+
+
+def winning_line(mask: int) -> Optional[Tuple[int, int, int]]:
+    """Выигрышная линия, целиком занятая маской, или None"""
+    for line, win in zip(WIN_LINES, WIN_MASKS):
+        if mask & win == win:
+            return line
+    return None
+
+
+def check(x_mask: int, o_mask: int, geo: Optional[Geometry] = None) -> Tuple[Optional[str], Optional[List[int]]]:
+    """Победитель в том же контракте, что и game_logic.check_winner (по умолчанию поле 3x3)"""
+    find_line = geo.winning_line if geo else winning_line
+    line = find_line(x_mask)
+    if line:
+        return "X", list(line)
+    line = find_line(o_mask)
+    if line:
+        return "O", list(line)
+    if (x_mask | o_mask).bit_count() == (geo.cells if geo else CELLS):
+        return DRAW, None
+    return None, None
+
+
+def canonical(x_mask: int, o_mask: int) -> Tuple[int, int]:
+    """Каноническая форма позиции относительно 8 симметрий.
+
+    Returns:
+        Tuple:
+            - key: (x << 9) | o для минимальной из симметричных позиций.
+            - symmetry: индекс симметрии в SYMMETRIES, дающей этот ключ.
+    """
+    best_key, best_sym = -1, 0
+    for s, table in enumerate(SYMMETRY_TABLES):
+        key = table[x_mask] << CELLS | table[o_mask]
+        if best_key < 0 or key < best_key:
+            best_key, best_sym = key, s
+    return best_key, best_sym
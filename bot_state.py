@@ -1,11 +1,15 @@
 """
 Модуль для хранения списка чатов, в которых бот активен (для рассылок).
 """
+from storage import storage
+
 all_chats: set[int] = set()
 
 def add_chat(chat_id: int) -> None:
     """Добавляет идентификатор чата в список"""
-    all_chats.add(chat_id)
+    if chat_id not in all_chats:
+        all_chats.add(chat_id)
+        storage.save_chat(chat_id)
 
 def get_all_chats() -> set[int]:
     """Возвращает множество всех известных чатов"""
@@ -0,0 +1,174 @@
+# broadcast.py
+"""
+Фоновые рассылки админ-панели.
+
+Рассылка — это задание со снимком списка чатов и курсором. Сообщения
+отправляются параллельно (BROADCAST_CONCURRENCY) с фоновым приоритетом
+rate_limiter, прогресс показывается правкой сообщения админ-панели.
+Состояние (курсор и счётчики) периодически сохраняется в BROADCAST_STATE_FILE,
+поэтому прерванная перезапуском рассылка продолжается с места остановки
+(см. resume в main.py). Чаты, отказавшиеся принимать сообщения (бот заблокирован,
+удалён из группы, чат не найден), запоминаются и пропускаются в следующих рассылках.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Iterable, Optional, Set
+
+import telegram
+from telegram import Bot
+
+import message_editor
+from config import BROADCAST_CONCURRENCY, BROADCAST_PROGRESS_INTERVAL, BROADCAST_STATE_FILE
+from rate_limiter import PRIORITY_BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+# Текущее задание (или None) и чаты, отказавшиеся от доставки
+job: Optional[dict] = None
+blocked_chats: Set[int] = set()
+_running = False
+
+
+def load_state() -> None:
+    """Загружает незавершённое задание и список недоступных чатов"""
+    global job
+    if not os.path.exists(BROADCAST_STATE_FILE):
+        return
+    try:
+        with open(BROADCAST_STATE_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Не удалось прочитать состояние рассылки: {e}")
+        return
+    blocked_chats.update(data.get('blocked_chats', []))
+    job = data.get('job')
+
+
+def _write_state(data: dict) -> None:
+    tmp_path = f"{BROADCAST_STATE_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, BROADCAST_STATE_FILE)
+
+
+async def save_state() -> None:
+    """Сохраняет состояние вне event loop (атомарно, через временный файл)"""
+    data = {'job': dict(job) if job else None, 'blocked_chats': sorted(blocked_chats)}
+    await asyncio.to_thread(_write_state, data)
+
+
+def is_running() -> bool:
+    return _running
+
+
+def create_job(text: str, chats: Iterable[int], admin_chat_id: int, admin_message_id: int) -> dict:
+    """Создаёт новое задание рассылки (недоступные чаты сразу исключаются)"""
+    global job
+    targets = sorted(chat_id for chat_id in chats if chat_id not in blocked_chats)
+    job = {
+        'text': text,
+        'chats': targets,
+        'cursor': 0,
+        'sent': 0,
+        'failed': 0,
+        'blocked': 0,
+        'admin_chat_id': admin_chat_id,
+        'admin_message_id': admin_message_id,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    return job
+
+
+def progress_text(finished: bool = False) -> str:
+    if not job:
+        return "Нет активной рассылки."
+    total = len(job['chats'])
+    head = "✅ Рассылка завершена" if finished else "📬 Рассылка идёт"
+    return (
+        f"{head}: {job['cursor']}/{total}\n"
+        f"Доставлено: {job['sent']}\n"
+        f"Недоступны: {job['blocked']}\n"
+        f"Ошибки: {job['failed']}"
+    )
+
+
+async def _send_one(bot: Bot, chat_id: int, text: str) -> str:
+    try:
+        await bot.send_message(chat_id=chat_id, text=text, rate_limit_args=PRIORITY_BACKGROUND)
+        return 'sent'
+    except telegram.error.Forbidden:
+        return 'blocked'
+    except telegram.error.BadRequest as e:
+        if "chat not found" in str(e).lower():
+            return 'blocked'
+        logger.warning(f"Не удалось отправить в чат {chat_id}: {e}")
+        return 'failed'
+    except Exception as e:
+        logger.warning(f"Не удалось отправить в чат {chat_id}: {e}")
+        return 'failed'
+
+
+async def run(bot: Bot) -> None:
+    """Выполняет текущее задание с позиции курсора до конца"""
+    global _running, job
+    if _running or not job:
+        return
+    _running = True
+    try:
+        chats = job['chats']
+        next_index = job['cursor']
+        done: Set[int] = set()
+        last_progress = 0.0
+        lock = asyncio.Lock()
+
+        async def worker() -> None:
+            nonlocal next_index, last_progress
+            while True:
+                async with lock:
+                    if next_index >= len(chats):
+                        return
+                    index = next_index
+                    next_index += 1
+                chat_id = chats[index]
+                if chat_id in blocked_chats:
+                    result = 'blocked'
+                else:
+                    result = await _send_one(bot, chat_id, job['text'])
+                if result == 'blocked':
+                    blocked_chats.add(chat_id)
+                job[result] += 1
+                # Курсор — граница, до которой все чаты уже обработаны
+                done.add(index)
+                while job['cursor'] in done:
+                    done.discard(job['cursor'])
+                    job['cursor'] += 1
+                now = time.monotonic()
+                if now - last_progress >= BROADCAST_PROGRESS_INTERVAL:
+                    last_progress = now
+                    await save_state()
+                    await message_editor.edit(bot, job['admin_chat_id'], job['admin_message_id'], progress_text())
+
+        await asyncio.gather(*(worker() for _ in range(max(1, BROADCAST_CONCURRENCY))))
+        logger.info(f"Рассылка завершена: {progress_text(finished=True)!r}")
+        await message_editor.edit(bot, job['admin_chat_id'], job['admin_message_id'], progress_text(finished=True))
+        job = None
+        await save_state()
+    except (Exception, asyncio.CancelledError):
+        # Состояние с курсором сохранено — рассылка продолжится после перезапуска
+        await save_state()
+        raise
+    finally:
+        _running = False
+
+
+def stats() -> dict:
+    return {
+        'running': _running,
+        'cursor': job['cursor'] if job else None,
+        'total': len(job['chats']) if job else None,
+        'blocked_chats': len(blocked_chats),
+    }
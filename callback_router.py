@@ -0,0 +1,114 @@
+# callback_router.py
+"""
+Маршрутизация callback-запросов по префиксу.
+
+Вместо цепочки CallbackQueryHandler с регулярными выражениями регистрируется
+один обработчик: callback_data разбирается один раз и маршрут ищется в словаре,
+поэтому стоимость разбора не растёт с числом режимов и меню.
+
+Схема callback_data — «префикс:аргумент» (аргумент необязателен):
+    n           — пустая клетка / кадр анимации (ничего не делает)
+    g:<cell>    — ход в клетку, g:new — новая игра
+    t:<key>     — выбор темы в меню /themes
+    ti:<key>    — выбор темы во время игры
+    tp, tc      — меню смены темы в игре и возврат к игре
+    a:<action>  — кнопки админ-панели
+    lb:<scope>[:<победы>:<имя>] — страницы рейтинга (/top, /chatstats)
+Старые кнопки (noop, 4, new_game, theme_select_..., admin_...) на уже
+отправленных сообщениях разбираются в те же маршруты.
+
+Обработчик маршрута вызывается как callback(update, context, arg).
+"""
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Tuple
+
+from telegram import Update
+from telegram.ext import CallbackQueryHandler, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+RouteCallback = Callable[[Update, ContextTypes.DEFAULT_TYPE, str], Awaitable[None]]
+
+# Маршруты без аргумента, которые могут прийти без двоеточия
+_BARE_ROUTES = frozenset({"n", "tp", "tc"})
+# Старые форматы callback_data
+_LEGACY_EXACT = {
+    "noop": ("n", ""),
+    "new_game": ("g", "new"),
+    "change_theme_prompt": ("tp", ""),
+    "cancel_theme_change": ("tc", ""),
+}
+_LEGACY_PREFIXES = (
+    ("theme_select_ingame_", "ti"),
+    ("theme_select_", "t"),
+    ("admin_", "a"),
+)
+
+
+def parse(data: str) -> Tuple[str, str]:
+    """Разбирает callback_data в (маршрут, аргумент); неизвестное — ("", data)"""
+    route, sep, arg = data.partition(":")
+    if sep or route in _BARE_ROUTES:
+        return route, arg
+    legacy = _LEGACY_EXACT.get(data)
+    if legacy is not None:
+        return legacy
+    if data.isdigit():
+        return "g", data
+    for prefix, route in _LEGACY_PREFIXES:
+        if data.startswith(prefix):
+            return route, data[len(prefix):]
+    return "", data
+
+
+class CallbackRouter:
+    """Таблица маршрутов callback-запросов с замером времени обработки"""
+
+    def __init__(self) -> None:
+        self._routes: Dict[str, RouteCallback] = {}
+        # маршрут -> [вызовов, ошибок, суммарное время, максимальное время]
+        self._timings: Dict[str, list] = {}
+        self.unknown = 0
+        self.handler = CallbackQueryHandler(self.dispatch)
+
+    def add(self, route: str, callback: RouteCallback) -> None:
+        self._routes[route] = callback
+        self._timings[route] = [0, 0, 0.0, 0.0]
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        query = update.callback_query
+        route, arg = parse(query.data or "")
+        callback = self._routes.get(route)
+        if callback is None:
+            self.unknown += 1
+            logger.debug("Unknown callback data %r", query.data)
+            await query.answer()
+            return
+        timing = self._timings[route]
+        started = time.perf_counter()
+        try:
+            await callback(update, context, arg)
+        except Exception:
+            timing[1] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            timing[0] += 1
+            timing[2] += elapsed
+            timing[3] = max(timing[3], elapsed)
+
+    def stats(self) -> dict:
+        """Число вызовов, ошибок и время обработки по маршрутам"""
+        routes = {}
+        for route, (calls, errors, total, longest) in self._timings.items():
+            routes[route] = {
+                "calls": calls,
+                "errors": errors,
+                "ms_avg": round(total / calls * 1000, 2) if calls else 0.0,
+                "ms_max": round(longest * 1000, 2),
+            }
+        return {"routes": routes, "unknown": self.unknown}
+
+
+callback_router = CallbackRouter()
@@ -1,10 +1,10 @@
 import logging
 import os
 
-# Настройка логирования
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.DEBUG
-)
+from log_setup import setup_logging
+
+# Настройка логирования (уровни, JSON, асинхронный вывод — см. log_setup.py)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # --- Константы и темы ---
@@ -77,6 +77,138 @@ PORT = int(os.getenv("PORT", "8080"))
 WEBHOOK_PATH = "/webhook"
 # Полный URL для установки вебхука (формируется здесь для ясности)
 WEBHOOK_ENDPOINT_URL = f"{WEBHOOK_URL}{WEBHOOK_PATH}" if WEBHOOK_URL else None
+# Секрет вебхука: Telegram присылает его в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN") or None
+# Токен для /metrics (заголовок X-Metrics-Token); по умолчанию — секрет вебхука.
+# Без обоих /metrics отвечает только на запросы с localhost
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") or WEBHOOK_SECRET_TOKEN
 
 # Таймаут ожидания второго игрока
-GAME_TIMEOUT_SECONDS = 90 
\ No newline at end of file
+GAME_TIMEOUT_SECONDS = 90 
+# Таймаут на ход: игрок, не сходивший вовремя, проигрывает (0 — без таймаута)
+MOVE_TIMEOUT_SECONDS = float(os.getenv("MOVE_TIMEOUT_SECONDS", "300"))
+
+# --- Колесо таймеров (см. timing_wheel.py) ---
+TIMEOUT_TICK_SECONDS = float(os.getenv("TIMEOUT_TICK_SECONDS", "1"))
+TIMEOUT_WHEEL_SLOTS = int(os.getenv("TIMEOUT_WHEEL_SLOTS", "512"))
+TIMEOUT_WORKERS = int(os.getenv("TIMEOUT_WORKERS", "4"))
+TIMEOUT_QUEUE_MAX = int(os.getenv("TIMEOUT_QUEUE_MAX", "1000"))
+
+# --- Очистка состояния игр (см. GameStore в game_state.py) ---
+# Сколько хранить завершённую игру (кнопки итогового сообщения продолжают работать)
+GAME_FINISHED_TTL_SECONDS = float(os.getenv("GAME_FINISHED_TTL_SECONDS", "600"))
+# Через сколько удалять незавершённую игру без ходов
+GAME_IDLE_TTL_SECONDS = float(os.getenv("GAME_IDLE_TTL_SECONDS", "3600"))
+# Максимум игр в памяти; сверх него вытесняются игры с самой давней активностью.
+# Незавершённая игра при этом остаётся в хранилище (DB_PATH, STATE_BACKEND) и поднимется
+# при следующем ходе. Без сохранения вытеснить её некуда: сначала вытесняются
+# завершённые игры, а если их нет — самая давняя незавершённая удаляется совсем
+MAX_LIVE_GAMES = int(os.getenv("MAX_LIVE_GAMES", "10000"))
+GAME_SWEEP_INTERVAL_SECONDS = float(os.getenv("GAME_SWEEP_INTERVAL_SECONDS", "60"))
+
+# --- Размеры поля ---
+# Сторона поля -> сколько символов в ряд нужно для победы
+BOARD_SIZES = {
+    3: 3,
+    4: 4,
+    5: 4,
+    15: 5,  # гомоку: только движок, в inline-клавиатуру Telegram не помещается
+}
+DEFAULT_BOARD_SIZE = 3
+# Telegram разрешает не более 8 кнопок в ряду inline-клавиатуры
+MAX_KEYBOARD_BOARD_SIZE = 8
+
+# Бюджет времени на поиск хода ИИ на полях больше 3x3 (секунды)
+AI_TIME_BUDGET_SECONDS = float(os.getenv("AI_TIME_BUDGET_SECONDS", "1.0"))
+
+# --- Исполнитель ходов ИИ ---
+# inline — прямо в обработчике, thread — пул потоков, process — пул процессов
+AI_EXECUTOR_MODE = os.getenv("AI_EXECUTOR_MODE", "process")
+AI_EXECUTOR_WORKERS = int(os.getenv("AI_EXECUTOR_WORKERS", "2"))
+# Таймаут на вычисление одного хода (с запасом сверх бюджета поиска)
+AI_MOVE_TIMEOUT_SECONDS = float(os.getenv("AI_MOVE_TIMEOUT_SECONDS", str(AI_TIME_BUDGET_SECONDS + 2)))
+# Сколько ходов может ждать в пуле, прежде чем ИИ перейдёт на эвристику
+AI_MAX_PENDING = int(os.getenv("AI_MAX_PENDING", "32"))
+
+# Сколько готовых клавиатур/текстов игровых сообщений держать в LRU-кэше
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "4096"))
+
+# --- Журнал завершённых игр и свёртки (см. event_log.py) ---
+# Пустое значение отключает журнал
+EVENT_LOG_PATH = os.getenv("EVENT_LOG_PATH", os.path.join(os.path.dirname(__file__), "games.log.jsonl"))
+EVENT_LOG_FLUSH_SECONDS = float(os.getenv("EVENT_LOG_FLUSH_SECONDS", "2"))
+EVENT_LOG_BUFFER = int(os.getenv("EVENT_LOG_BUFFER", "1000"))
+EVENT_ROLLUP_PATH = os.getenv("EVENT_ROLLUP_PATH", os.path.join(os.path.dirname(__file__), "games_rollup.json"))
+EVENT_ROLLUP_INTERVAL_SECONDS = float(os.getenv("EVENT_ROLLUP_INTERVAL_SECONDS", "300"))
+
+# Строк на странице рейтингов (/top, /chatstats)
+LEADERBOARD_PAGE_SIZE = int(os.getenv("LEADERBOARD_PAGE_SIZE", "10"))
+
+# --- Рейтинг Эло (см. ratings.py) ---
+ELO_K = float(os.getenv("ELO_K", "32"))
+ELO_INITIAL = float(os.getenv("ELO_INITIAL", "1000"))
+# Пустое значение — рейтинги не сохраняются (пересчитываются по журналу при старте)
+RATINGS_PATH = os.getenv("RATINGS_PATH", os.path.join(os.path.dirname(__file__), "ratings.json"))
+RATINGS_SAVE_INTERVAL_SECONDS = float(os.getenv("RATINGS_SAVE_INTERVAL_SECONDS", "60"))
+
+# Анимация хода: full (два кадра), single (один кадр), off (без анимации)
+ANIMATION_MODE = os.getenv("ANIMATION_MODE", "full")
+ANIMATION_FRAME_DELAY = float(os.getenv("ANIMATION_FRAME_DELAY", "0.1"))
+
+# --- Ограничение исходящих запросов к Bot API (см. rate_limiter.py) ---
+RATE_LIMIT_GLOBAL_PER_SECOND = float(os.getenv("RATE_LIMIT_GLOBAL_PER_SECOND", "30"))
+RATE_LIMIT_PRIVATE_PER_SECOND = float(os.getenv("RATE_LIMIT_PRIVATE_PER_SECOND", "1"))
+# Запас запросов личного чата: кадры анимации хода уходят сразу, без ожидания ведра
+RATE_LIMIT_PRIVATE_BURST = float(os.getenv("RATE_LIMIT_PRIVATE_BURST", "4"))
+RATE_LIMIT_GROUP_PER_MINUTE = float(os.getenv("RATE_LIMIT_GROUP_PER_MINUTE", "20"))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "3"))
+
+# --- Рассылки (см. broadcast.py) ---
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+# Как часто обновлять прогресс в админ-панели и сохранять курсор (секунды)
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+BROADCAST_STATE_FILE = os.getenv(
+    "BROADCAST_STATE_FILE", os.path.join(os.path.dirname(__file__), "broadcast_state.json")
+)
+
+# --- VIP-данные (см. vip.py) ---
+VIP_DATA_FILE = os.getenv("VIP_DATA_FILE", os.path.join(os.path.dirname(__file__), "vip_data.json"))
+# Изменения сохраняются снимком не раньше чем через столько секунд после первого
+VIP_SAVE_DELAY_SECONDS = float(os.getenv("VIP_SAVE_DELAY_SECONDS", "1.0"))
+# Журнал изменений между снимками (VIP_DATA_FILE.journal): 0 — без журнала
+VIP_JOURNAL = os.getenv("VIP_JOURNAL", "1") == "1"
+
+# --- Обработка обновлений (см. update_dispatcher.py) ---
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+UPDATE_QUEUE_MAX = int(os.getenv("UPDATE_QUEUE_MAX", "5000"))
+# Сколько секунд при остановке дообрабатывать уже принятые обновления
+UPDATE_DRAIN_TIMEOUT_SECONDS = float(os.getenv("UPDATE_DRAIN_TIMEOUT_SECONDS", "10"))
+
+# --- HTTP-клиент Bot API (см. transport.py) ---
+BOT_API_POOL_SIZE = int(os.getenv("BOT_API_POOL_SIZE", "64"))
+BOT_API_BACKGROUND_POOL_SIZE = int(os.getenv("BOT_API_BACKGROUND_POOL_SIZE", "8"))
+BOT_API_KEEPALIVE_CONNECTIONS = int(os.getenv("BOT_API_KEEPALIVE_CONNECTIONS", "32"))
+BOT_API_KEEPALIVE_EXPIRY = float(os.getenv("BOT_API_KEEPALIVE_EXPIRY", "60"))
+BOT_API_HTTP2 = os.getenv("BOT_API_HTTP2", "0") == "1"
+BOT_API_CONNECT_TIMEOUT = float(os.getenv("BOT_API_CONNECT_TIMEOUT", "5"))
+BOT_API_READ_TIMEOUT = float(os.getenv("BOT_API_READ_TIMEOUT", "5"))
+BOT_API_WRITE_TIMEOUT = float(os.getenv("BOT_API_WRITE_TIMEOUT", "5"))
+BOT_API_POOL_TIMEOUT = float(os.getenv("BOT_API_POOL_TIMEOUT", "3"))
+# Таймауты чтения по методам: "метод=секунды,..."
+BOT_API_METHOD_TIMEOUTS = os.getenv(
+    "BOT_API_METHOD_TIMEOUTS", "answerCallbackQuery=2,editMessageText=5,editMessageReplyMarkup=5,sendMessage=10"
+)
+
+# --- Хранилище состояния (см. storage.py) ---
+# Пустое значение отключает сохранение
+DB_PATH = os.getenv("DB_PATH", os.path.join(os.path.dirname(__file__), "bot_state.db"))
+STORAGE_FLUSH_INTERVAL_SECONDS = float(os.getenv("STORAGE_FLUSH_INTERVAL_SECONDS", "1.0"))
+STORAGE_BATCH_SIZE = int(os.getenv("STORAGE_BATCH_SIZE", "500"))
+# local — файл DB_PATH для одного процесса; memory — без сохранения;
+# sqlite — общий файл для нескольких процессов; redis — сервер REDIS_URL (см. state_backend.py)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "local").lower()
+STATE_SQLITE_PATH = os.getenv("STATE_SQLITE_PATH", "")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "tictactoe:")
+# Как часто процесс перечитывает баны и чаты из общего хранилища
+STATE_SYNC_INTERVAL_SECONDS = float(os.getenv("STATE_SYNC_INTERVAL_SECONDS", "10"))
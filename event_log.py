@@ -0,0 +1,289 @@
+# event_log.py
+"""
+Журнал завершённых игр и свёртки для аналитики.
+
+Каждая завершённая игра (ход в moves.py, таймаут в expire_game) добавляет
+компактную запись — JSON-строку — в буфер; фоновая задача раз в
+EVENT_LOG_FLUSH_SECONDS (или при EVENT_LOG_BUFFER записях) дописывает буфер
+в конец файла EVENT_LOG_PATH одним вызовом в отдельном потоке. Файл только
+дописывается.
+
+Запись: t — время окончания (unix), c — чат, p — игроки [[user_id, имя, символ]],
+s — размер поля, m — число ходов, th — тема, d — длительность (сек),
+ai — символ ИИ или null, w — символ победителя или null,
+r — исход: win, draw, timeout (не сходил вовремя), cancelled (соперник не пришёл).
+
+Свёртка (rollup) раз в EVENT_ROLLUP_INTERVAL_SECONDS читает только новые строки
+журнала (с сохранённого смещения) и добавляет их в агрегаты по дням, чатам
+и пользователям в EVENT_ROLLUP_PATH. Запросы аналитики (summary) читают
+только эти агрегаты.
+
+Несколько процессов бота (STATE_BACKEND=sqlite/redis) пишут в один журнал:
+буфер дописывается одним вызовом write в режиме дозаписи (O_APPEND), поэтому
+строки разных процессов не перемешиваются. Свёртка общая: на время свёртки
+процесс берёт блокировку файла EVENT_ROLLUP_PATH.lock (flock), поэтому
+процессы сворачивают по очереди, и каждый продолжает со смещения, сохранённого
+предыдущим, — записи не считаются дважды и агрегаты не перезаписываются.
+Без fcntl (Windows) блокировки нет — там поддерживается только один процесс.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from config import (
+    EVENT_LOG_PATH, EVENT_LOG_FLUSH_SECONDS, EVENT_LOG_BUFFER, EVENT_ROLLUP_PATH
+)
+from game import Game
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def make_record(chat_id: int, game: Game, reason: str, winner: Optional[str]) -> dict:
+    now = time.time()
+    return {
+        "t": int(now),
+        "c": chat_id,
+        "p": [[p.user_id, p.username, p.symbol] for p in game.players],
+        "s": game.size,
+        "m": game.moves_made,
+        "th": game.theme,
+        "d": round(now - game.started_at, 1) if game.started_at else None,
+        "ai": game.ai_symbol,
+        "w": winner,
+        "r": reason,
+    }
+
+
+# --- Свёртки ---
+
+def _empty_rollup() -> dict:
+    return {"offset": 0, "daily": {}, "chats": {}, "users": {}}
+
+
+def _bump(bucket: dict, key: str, amount: float = 1) -> None:
+    bucket[key] = bucket.get(key, 0) + amount
+
+
+def fold(rollup: dict, record: dict) -> None:
+    """Добавляет запись журнала в агрегаты"""
+    day = datetime.fromtimestamp(record["t"], timezone.utc).strftime("%Y-%m-%d")
+    winner = record["w"]
+    ai = record["ai"]
+    duration = record["d"] or 0
+    for bucket in (rollup["daily"].setdefault(day, {}), rollup["chats"].setdefault(str(record["c"]), {})):
+        _bump(bucket, "games")
+        _bump(bucket, record["r"])
+        _bump(bucket, "moves", record["m"])
+        _bump(bucket, "duration", duration)
+    daily = rollup["daily"][day]
+    if ai:
+        # Доля побед ИИ по темам
+        theme = daily.setdefault("themes", {}).setdefault(record["th"], {})
+        _bump(theme, "ai_games")
+        if winner == ai:
+            _bump(theme, "ai_wins")
+    for user_id, _name, symbol in record["p"]:
+        if symbol == ai:
+            continue
+        user = rollup["users"].setdefault(str(user_id), {})
+        _bump(user, "games")
+        if winner is None:
+            _bump(user, "draws" if record["r"] == "draw" else "cancelled")
+        else:
+            _bump(user, "wins" if winner == symbol else "losses")
+        if ai:
+            _bump(user, "ai_games")
+            if winner == symbol:
+                _bump(user, "ai_wins")
+
+
+def _load_rollup(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return _empty_rollup()
+    except (OSError, ValueError) as e:
+        logger.error(f"Не удалось прочитать свёртки {path}: {e}; пересчёт с начала журнала")
+        return _empty_rollup()
+
+
+def _roll(log_path: str, rollup_path: str) -> dict:
+    """Сворачивает новые строки журнала под блокировкой (вне event loop); возвращает агрегаты"""
+    with open(rollup_path + ".lock", "a") as lock:
+        if fcntl is not None:
+            # Снимается при закрытии файла, в том числе если процесс упал
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        return _roll_locked(log_path, rollup_path)
+
+
+def _roll_locked(log_path: str, rollup_path: str) -> dict:
+    rollup = _load_rollup(rollup_path)
+    try:
+        with open(log_path, "rb") as f:
+            f.seek(rollup["offset"])
+            chunk = f.read()
+    except FileNotFoundError:
+        return rollup
+    # Неполная последняя строка (дописывается прямо сейчас) — до следующей свёртки
+    end = chunk.rfind(b"\n") + 1
+    for line in chunk[:end].splitlines():
+        try:
+            fold(rollup, json.loads(line))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Пропущена некорректная запись журнала: {e}")
+    rollup["offset"] += end
+    tmp_path = rollup_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(rollup, f, ensure_ascii=False)
+    os.replace(tmp_path, rollup_path)
+    return rollup
+
+
+class EventLog:
+    """Буферизованный журнал с дозаписью и свёртками"""
+
+    def __init__(self, path: str, rollup_path: str, flush_interval: float, buffer_size: int) -> None:
+        self.path = path
+        self.rollup_path = rollup_path
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self._buffer: List[str] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._rollup: Optional[dict] = None
+        # Дозаписи по очереди: после flush() в файле всё, что было в буфере до вызова
+        self._flush_lock = asyncio.Lock()
+        # Метрики
+        self.appended = 0
+        self.written = 0
+        self.errors = 0
+        self.rollups = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    @property
+    def buffered(self) -> int:
+        """Записей, ещё не дописанных в файл"""
+        return len(self._buffer)
+
+    def append(self, record: dict) -> None:
+        if not self.enabled:
+            return
+        self._buffer.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        self.appended += 1
+        if len(self._buffer) >= self.buffer_size and self._wake is not None:
+            self._wake.set()
+
+    def record_game(self, chat_id: int, game: Game, reason: str, winner: Optional[str] = None) -> dict:
+        """Записывает завершённую игру; возвращает запись"""
+        record = make_record(chat_id, game, reason, winner)
+        self.append(record)
+        return record
+
+    # --- Запись ---
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def _write(self, lines: List[str]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            lines, self._buffer = self._buffer, []
+            try:
+                await asyncio.to_thread(self._write, lines)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Не удалось дописать {len(lines)} записей в журнал игр: {e}")
+                self._buffer[:0] = lines
+                return
+            self.written += len(lines)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    # --- Свёртки ---
+
+    async def rollup(self) -> None:
+        """Дописывает буфер и сворачивает новые записи журнала"""
+        if not self.enabled:
+            return
+        await self.flush()
+        try:
+            self._rollup = await asyncio.to_thread(_roll, self.path, self.rollup_path)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Не удалось свернуть журнал игр: {e}")
+            return
+        self.rollups += 1
+
+    def summary(self, days: int = 7) -> Optional[dict]:
+        """Последние агрегаты: игры по дням, средняя длина игры, доля побед ИИ по темам"""
+        rollup = self._rollup
+        if rollup is None:
+            return None
+        recent = sorted(rollup["daily"].items())[-days:]
+        themes: dict = {}
+        for _, daily in recent:
+            for theme, counts in daily.get("themes", {}).items():
+                bucket = themes.setdefault(theme, {})
+                _bump(bucket, "ai_games", counts.get("ai_games", 0))
+                _bump(bucket, "ai_wins", counts.get("ai_wins", 0))
+        games = sum(daily["games"] for _, daily in recent)
+        return {
+            "games_per_day": {day: daily["games"] for day, daily in recent},
+            "avg_moves": round(sum(daily["moves"] for _, daily in recent) / games, 1) if games else 0.0,
+            "avg_duration": round(sum(daily["duration"] for _, daily in recent) / games, 1) if games else 0.0,
+            "ai_win_rate": {theme: round(c["ai_wins"] / c["ai_games"], 3)
+                            for theme, c in themes.items() if c["ai_games"]},
+            "chats": len(rollup["chats"]),
+            "users": len(rollup["users"]),
+        }
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "buffered": self.buffered,
+            "appended": self.appended,
+            "written": self.written,
+            "errors": self.errors,
+            "rollups": self.rollups,
+            "rollup_offset": self._rollup["offset"] if self._rollup else 0,
+        }
+
+
+event_log = EventLog(EVENT_LOG_PATH, EVENT_ROLLUP_PATH, EVENT_LOG_FLUSH_SECONDS, EVENT_LOG_BUFFER)
@@ -0,0 +1,173 @@
+# game.py
+"""
+Состояние одной партии.
+
+Game и Player используют __slots__: поле хранится двумя битовыми масками,
+тема — ключом THEMES плюс необязательные замены символов (VIP), игроки — кортежем
+в порядке подключения. Это в разы компактнее прежнего словаря со вложенными
+словарями и копией темы. to_dict()/from_dict() дают компактное представление
+для сохранения.
+"""
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+import bitboard
+from config import THEMES, DEFAULT_THEME_KEY
+
+# user_id игрока-ИИ (у пользователей Telegram id всегда положительный)
+AI_USER_ID = 0
+AI_USERNAME = "🤖 ИИ"
+
+
+class Player:
+    """Участник партии"""
+
+    __slots__ = ("user_id", "username", "symbol")
+
+    def __init__(self, user_id: int, username: str, symbol: str) -> None:
+        self.user_id = user_id
+        self.username = username
+        self.symbol = symbol
+
+    @property
+    def is_ai(self) -> bool:
+        return self.user_id == AI_USER_ID
+
+
+class Game:
+    """Партия в чате: поле, игроки, тема, чей ход и служебные ссылки"""
+
+    __slots__ = (
+        "size", "win_length", "x_mask", "o_mask", "tracker", "current_player", "game_over",
+        "players", "theme", "overrides", "message_id", "ai_symbol", "last_move", "version", "started_at",
+    )
+
+    def __init__(self, size: int, win_length: int, first_player: str = "X",
+                 theme: str = DEFAULT_THEME_KEY, ai_symbol: Optional[str] = None) -> None:
+        self.size = size
+        self.win_length = win_length
+        self.x_mask = 0
+        self.o_mask = 0
+        self.tracker = bitboard.WinTracker(bitboard.geometry(size, win_length))
+        self.current_player = first_player
+        self.game_over = False
+        self.players: Tuple[Player, ...] = ()
+        self.theme = theme if theme in THEMES else DEFAULT_THEME_KEY
+        # Замены эмодзи темы для отдельных символов (VIP-символы игроков)
+        self.overrides: Optional[Dict[str, str]] = None
+        self.message_id: Optional[int] = None
+        self.ai_symbol = ai_symbol
+        self.last_move: Optional[int] = None
+        # Номер изменения: растёт при каждой записи (GameStore.save), хранится вне to_dict()
+        self.version = 0
+        # Время начала (unix) — для длительности игры в журнале (event_log.py)
+        self.started_at = time.time()
+
+    # --- Игроки ---
+
+    @property
+    def vs_ai(self) -> bool:
+        return self.ai_symbol is not None
+
+    def add_player(self, user_id: int, username: str, symbol: str) -> Player:
+        player = Player(user_id, username, symbol)
+        self.players += (player,)
+        return player
+
+    def player(self, symbol: str) -> Optional[Player]:
+        """Игрок, играющий символом symbol"""
+        for player in self.players:
+            if player.symbol == symbol:
+                return player
+        return None
+
+    def symbol_of(self, user_id: int) -> Optional[str]:
+        for player in self.players:
+            if player.user_id == user_id:
+                return player.symbol
+        return None
+
+    # --- Тема ---
+
+    @property
+    def emojis(self) -> Dict[str, str]:
+        """Эмодзи темы с учётом замен (без замен — общий словарь THEMES, не изменять)"""
+        base = THEMES[self.theme]
+        if not self.overrides:
+            return base
+        return {**base, **self.overrides}
+
+    def set_theme(self, theme: str) -> None:
+        """Меняет тему; замены символов сохраняются"""
+        self.theme = theme if theme in THEMES else DEFAULT_THEME_KEY
+
+    def override_symbol(self, symbol: str, emoji: str) -> None:
+        if self.overrides is None:
+            self.overrides = {}
+        self.overrides[symbol] = emoji
+
+    # --- Поле ---
+
+    @property
+    def cells(self) -> int:
+        return self.size * self.size
+
+    @property
+    def board(self) -> List[Union[int, str]]:
+        """Поле списком ('X', 'O' или номер клетки 1..n) — для ИИ и отладки"""
+        return bitboard.to_list(self.x_mask, self.o_mask, self.cells)
+
+    @property
+    def moves_made(self) -> int:
+        return (self.x_mask | self.o_mask).bit_count()
+
+    def is_free(self, cell: int) -> bool:
+        return 0 <= cell < self.cells and not (self.x_mask | self.o_mask) >> cell & 1
+
+    def apply_move(self, cell: int, symbol: str) -> Tuple[Optional[str], Optional[List[int]]]:
+        """Ставит символ в клетку; результат — (победитель или ничья, выигрышная линия).
+
+        Победа проверяется инкрементально по линиям через эту клетку.
+        """
+        if symbol == "X":
+            self.x_mask |= 1 << cell
+        else:
+            self.o_mask |= 1 << cell
+        # Индекс последнего хода для подсветки
+        self.last_move = cell
+        return self.tracker.apply(cell, symbol)
+
+    # --- Сериализация ---
+
+    def to_dict(self) -> dict:
+        """Компактное представление без служебного поля version"""
+        return {
+            "s": self.size,
+            "k": self.win_length,
+            "x": self.x_mask,
+            "o": self.o_mask,
+            "c": self.current_player,
+            "e": self.game_over,
+            "p": [[p.user_id, p.username, p.symbol] for p in self.players],
+            "t": self.theme,
+            "v": dict(self.overrides) if self.overrides else self.overrides,
+            "m": self.message_id,
+            "a": self.ai_symbol,
+            "l": self.last_move,
+            "st": self.started_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Game":
+        game = cls(data["s"], data["k"], data["c"], data["t"], data["a"])
+        game.x_mask = data["x"]
+        game.o_mask = data["o"]
+        game.tracker = bitboard.WinTracker.from_board(game.board, game.win_length)
+        game.game_over = data["e"]
+        game.players = tuple(Player(*p) for p in data["p"])
+        game.overrides = data["v"]
+        game.message_id = data["m"]
+        game.last_move = data["l"]
+        # Игры, сохранённые до появления времени начала, — без длительности
+        game.started_at = data.get("st", 0.0)
+        return game
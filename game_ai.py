@@ -1,43 +1,356 @@
 # game_ai.py
 """
-Модуль AI для игры крестики-нолики: алгоритм Minimax для выбора оптимального хода
+Модуль AI для игры крестики-нолики.
+
+Все достижимые позиции 3x3 решаются один раз (при старте или при первом ходе ИИ)
+и складываются в таблицу, ключом которой служит каноническая форма позиции
+относительно 8 симметрий доски. Выбор хода ИИ — поиск в этой таблице.
+Позиции хранятся битбордами (см. bitboard.py).
+
+Для полей больше 3x3 (k в ряд) используется поиск: альфа-бета с упорядочиванием
+ходов, таблицей транспозиций на хэшах Зобриста и итеративным углублением,
+которое останавливается по бюджету времени на ход.
 """
-from game_logic import check_winner
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+import bitboard
+from bitboard import CELLS, FULL_MASK, SYMMETRIES, Geometry
+from config import AI_TIME_BUDGET_SECONDS, BOARD_SIZES
+
+# Таблица решённых позиций: (канонический ключ, ходит ли X) -> (оценка, лучшие ходы)
+# Оценка дана с точки зрения ходящего: >0 — выигрыш (чем быстрее, тем больше), 0 — ничья.
+_solved: Dict[Tuple[int, bool], Tuple[int, Tuple[int, ...]]] = {}
+
+
+def _solve(key: int, x_to_move: bool) -> int:
+    """Решает каноническую позицию и заносит её в таблицу. Возвращает оценку."""
+    entry = _solved.get((key, x_to_move))
+    if entry is not None:
+        return entry[0]
+    x_mask, o_mask = key >> CELLS, key & FULL_MASK
+    empties = CELLS - (x_mask | o_mask).bit_count()
+    best_score, best_moves = -100, []
+    for i in bitboard.empty_cells(x_mask, o_mask):
+        bit = 1 << i
+        own = (x_mask if x_to_move else o_mask) | bit
+        if bitboard.winning_line(own):
+            score = empties  # быстрый выигрыш ценнее
+        elif empties == 1:
+            score = 0
+        else:
+            child_x, child_o = (own, o_mask) if x_to_move else (x_mask, own)
+            child_key, _ = bitboard.canonical(child_x, child_o)
+            score = -_solve(child_key, not x_to_move)
+        if score > best_score:
+            best_score, best_moves = score, [i]
+        elif score == best_score:
+            best_moves.append(i)
+    _solved[(key, x_to_move)] = (best_score, tuple(best_moves))
+    return best_score
+
+
+def build_table() -> int:
+    """Строит таблицу решённых позиций (идемпотентно). Возвращает её размер."""
+    if not _solved:
+        _solve(0, True)
+        _solve(0, False)
+    return len(_solved)
+
+
+def _lookup(x_mask: int, o_mask: int, to_move: str) -> Tuple[int, List[int]]:
+    """Оценка и лучшие ходы (в координатах исходной доски) для ходящего"""
+    build_table()
+    key, sym = bitboard.canonical(x_mask, o_mask)
+    x_to_move = to_move == "X"
+    entry = _solved.get((key, x_to_move))
+    if entry is None:
+        # Позиция недостижима из пустой доски (например, отредактирована вручную)
+        _solve(key, x_to_move)
+        entry = _solved[(key, x_to_move)]
+    score, moves = entry
+    perm = SYMMETRIES[sym]
+    return score, [perm[i] for i in moves]
 
 
 def minimax(board: list, is_maximizing: bool, ai_symbol: str, human_symbol: str) -> dict:
-    """Рекурсивная функция Minimax"""
-    winner, combo = check_winner(board)
+    """Оценка позиции в старом формате Minimax ({"score": -1|0|1, "index": ход}) через таблицу"""
+    x_mask, o_mask = bitboard.from_list(board)
+    winner, _ = bitboard.check(x_mask, o_mask)
     if winner:
         if winner == human_symbol:
             return {"score": -1}
         elif winner == ai_symbol:
             return {"score": 1}
+        return {"score": 0}
+    to_move = ai_symbol if is_maximizing else human_symbol
+    score, moves = _lookup(x_mask, o_mask, to_move)
+    sign = 1 if is_maximizing else -1
+    return {"score": sign * ((score > 0) - (score < 0)), "index": moves[0] if moves else None}
+
+
+# --- Поиск для полей NxN ---
+
+WIN_SCORE = 1_000_000
+# Вес окна из k клеток, в котором у стороны n камней и нет камней соперника
+_WINDOW_WEIGHTS = (0,) + tuple(8 ** n for n in range(16))
+# Как часто (в узлах) проверять дедлайн
+_DEADLINE_CHECK_NODES = 512
+
+# Ключи Зобриста по геометрии: [сторона][клетка]
+_zobrist: Dict[int, Tuple[Tuple[int, ...], Tuple[int, ...]]] = {}
+
+# Флаги записей таблицы транспозиций
+_EXACT, _LOWER, _UPPER = 0, 1, 2
+
+
+class _Timeout(Exception):
+    """Бюджет времени на ход исчерпан"""
+
+
+def _center(geo: Geometry) -> int:
+    """Центральная клетка (на чётных полях — одна из четырёх центральных)"""
+    return (geo.size // 2) * geo.size + geo.size // 2
+
+
+def _zobrist_keys(cells: int) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    keys = _zobrist.get(cells)
+    if keys is None:
+        rng = random.Random(cells)
+        keys = (
+            tuple(rng.getrandbits(64) for _ in range(cells)),
+            tuple(rng.getrandbits(64) for _ in range(cells)),
+        )
+        _zobrist[cells] = keys
+    return keys
+
+
+class _Search:
+    """Один поиск хода: альфа-бета + таблица транспозиций + дедлайн"""
+
+    def __init__(self, geo: Geometry, deadline: float) -> None:
+        self.geo = geo
+        self.deadline = deadline
+        self.keys = _zobrist_keys(geo.cells)
+        self.table: Dict[int, Tuple[int, int, int, Optional[int]]] = {}
+        self.nodes = 0
+
+    def evaluate(self, own: int, opp: int) -> int:
+        """Статическая оценка с точки зрения ходящего (own)"""
+        score = 0
+        weights = _WINDOW_WEIGHTS
+        for win in self.geo.win_masks:
+            mine = own & win
+            theirs = opp & win
+            if mine and not theirs:
+                score += weights[mine.bit_count()]
+            elif theirs and not mine:
+                score -= weights[theirs.bit_count()]
+        return score
+
+    def candidates(self, own: int, opp: int) -> List[int]:
+        """Кандидаты ходов: на больших полях — только клетки рядом с занятыми"""
+        geo = self.geo
+        occupied = own | opp
+        if not occupied:
+            return [_center(geo)]
+        if geo.size <= 5:
+            return list(bitboard.empty_cells(own, opp, geo.full_mask))
+        near = 0
+        rest = occupied
+        while rest:
+            low = rest & -rest
+            near |= geo.neighbors[low.bit_length() - 1]
+            rest ^= low
+        return list(bitboard.empty_cells(own, opp, near))
+
+    def order(self, moves: List[int], own: int, opp: int, first: Optional[int]) -> List[int]:
+        """Сортирует ходы: ход из таблицы, затем по вкладу в линии обеих сторон"""
+        geo = self.geo
+        weights = _WINDOW_WEIGHTS
+
+        def cell_score(cell: int) -> int:
+            score = 0
+            for n in geo.lines_through[cell]:
+                win = geo.win_masks[n]
+                mine = own & win
+                theirs = opp & win
+                if not theirs:
+                    score += weights[mine.bit_count() + 1]
+                if not mine:
+                    score += weights[theirs.bit_count() + 1]
+            return score
+
+        moves.sort(key=cell_score, reverse=True)
+        if first is not None and first in moves:
+            moves.remove(first)
+            moves.insert(0, first)
+        return moves
+
+    def negamax(self, own: int, opp: int, side: int, key: int, depth: int,
+                alpha: int, beta: int, ply: int) -> int:
+        self.nodes += 1
+        if self.nodes % _DEADLINE_CHECK_NODES == 0 and time.monotonic() > self.deadline:
+            raise _Timeout()
+
+        alpha_orig = alpha
+        entry = self.table.get(key)
+        tt_move = None
+        if entry is not None:
+            e_depth, e_flag, e_score, tt_move = entry
+            if e_depth >= depth:
+                if e_flag == _EXACT:
+                    return e_score
+                if e_flag == _LOWER:
+                    alpha = max(alpha, e_score)
+                else:
+                    beta = min(beta, e_score)
+                if alpha >= beta:
+                    return e_score
+
+        moves = self.candidates(own, opp)
+        if not moves:
+            return 0  # доска заполнена — ничья
+        if depth == 0:
+            return self.evaluate(own, opp)
+
+        geo = self.geo
+        side_keys = self.keys[side]
+        best_score, best = -WIN_SCORE * 2, None
+        deadline = self.deadline
+        for cell in self.order(moves, own, opp, tt_move):
+            # На больших полях узел с оценкой детей дорог — проверка по числу узлов запаздывает
+            if time.monotonic() > deadline:
+                raise _Timeout()
+            new_own = own | 1 << cell
+            if geo.winning_line(new_own, cell):
+                score = WIN_SCORE - ply
+            else:
+                score = -self.negamax(opp, new_own, 1 - side, key ^ side_keys[cell],
+                                      depth - 1, -beta, -alpha, ply + 1)
+            if score > best_score:
+                best_score, best = score, cell
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        if best_score <= alpha_orig:
+            flag = _UPPER
+        elif best_score >= beta:
+            flag = _LOWER
         else:
-            return {"score": 0}
-    if is_maximizing:
-        best = {"score": -2, "index": None}
-        for i, cell in enumerate(board):
-            if isinstance(cell, int):
-                board_copy = board.copy()
-                board_copy[i] = ai_symbol
-                sim = minimax(board_copy, False, ai_symbol, human_symbol)
-                if sim["score"] > best["score"]:
-                    best = {"score": sim["score"], "index": i}
-        return best
-    else:
-        best = {"score": 2, "index": None}
-        for i, cell in enumerate(board):
-            if isinstance(cell, int):
-                board_copy = board.copy()
-                board_copy[i] = human_symbol
-                sim = minimax(board_copy, True, ai_symbol, human_symbol)
-                if sim["score"] < best["score"]:
-                    best = {"score": sim["score"], "index": i}
-        return best
-
-
-def best_move(board: list, ai_symbol: str, human_symbol: str) -> int:
-    """Возвращает индекс лучшего хода для AI"""
-    result = minimax(board, True, ai_symbol, human_symbol)
-    return result.get("index") 
\ No newline at end of file
+            flag = _EXACT
+        self.table[key] = (depth, flag, best_score, best)
+        return best_score
+
+    def root(self, own: int, opp: int, side: int, key: int, depth: int) -> Tuple[int, Optional[int]]:
+        entry = self.table.get(key)
+        moves = self.order(self.candidates(own, opp), own, opp, entry[3] if entry else None)
+        alpha, beta = -WIN_SCORE * 2, WIN_SCORE * 2
+        best = moves[0] if moves else None
+        for cell in moves:
+            if time.monotonic() > self.deadline:
+                raise _Timeout()
+            new_own = own | 1 << cell
+            if self.geo.winning_line(new_own, cell):
+                return WIN_SCORE, cell
+            score = -self.negamax(opp, new_own, 1 - side, key ^ self.keys[side][cell],
+                                  depth - 1, -beta, -alpha, 1)
+            if score > alpha:
+                alpha, best = score, cell
+        self.table[key] = (depth, _EXACT, alpha, best)
+        return alpha, best
+
+
+def search_move(board: list, ai_symbol: str, win_length: Optional[int] = None,
+                time_budget: Optional[float] = None) -> Optional[int]:
+    """Ищет ход на поле NxN итеративным углублением в пределах бюджета времени.
+
+    Args:
+        board: доска-список из size*size элементов.
+        ai_symbol: символ, за который ходит ИИ.
+        win_length: сколько в ряд нужно для победы (по умолчанию из BOARD_SIZES).
+        time_budget: бюджет времени в секундах (по умолчанию AI_TIME_BUDGET_SECONDS).
+    Returns:
+        Индекс клетки или None, если ходов нет.
+    """
+    size = bitboard.size_of(board)
+    geo = bitboard.geometry(size, win_length or BOARD_SIZES.get(size, size))
+    x_mask, o_mask = bitboard.from_list(board)
+    winner, _ = bitboard.check(x_mask, o_mask, geo)
+    if winner:
+        return None
+    own, opp = (x_mask, o_mask) if ai_symbol == "X" else (o_mask, x_mask)
+    side = 0 if ai_symbol == "X" else 1
+    x_keys, o_keys = _zobrist_keys(geo.cells)
+    key = 0
+    for i in bitboard.empty_cells(0, 0, x_mask):
+        key ^= x_keys[i]
+    for i in bitboard.empty_cells(0, 0, o_mask):
+        key ^= o_keys[i]
+
+    budget = AI_TIME_BUDGET_SECONDS if time_budget is None else time_budget
+    search = _Search(geo, time.monotonic() + budget)
+    moves = search.candidates(own, opp)
+    if len(moves) <= 1:
+        # Выбора нет (пустое поле — центр, последняя клетка): искать незачем
+        return moves[0] if moves else None
+    empties = geo.cells - (x_mask | o_mask).bit_count()
+    best = None
+    for depth in range(1, empties + 1):
+        try:
+            score, move = search.root(own, opp, side, key, depth)
+        except _Timeout:
+            break
+        if move is not None:
+            best = move
+        if abs(score) >= WIN_SCORE - geo.cells:
+            break  # исход форсирован, глубже искать незачем
+        if time.monotonic() > search.deadline:
+            break
+    if best is None:
+        best = moves[0]
+    return best
+
+
+def quick_move(board: list, ai_symbol: str, human_symbol: str,
+               win_length: Optional[int] = None) -> Optional[int]:
+    """Дешёвый эвристический ход без поиска: выиграть, заблокировать, центр, соседняя клетка.
+
+    Используется как запасной вариант, когда поиск недоступен (пул занят, таймаут).
+    """
+    size = bitboard.size_of(board)
+    geo = bitboard.geometry(size, win_length or BOARD_SIZES.get(size, size))
+    x_mask, o_mask = bitboard.from_list(board)
+    if bitboard.check(x_mask, o_mask, geo)[0]:
+        return None
+    own, opp = (x_mask, o_mask) if ai_symbol == "X" else (o_mask, x_mask)
+    empties = list(bitboard.empty_cells(x_mask, o_mask, geo.full_mask))
+    for mask in (own, opp):
+        for cell in empties:
+            if geo.winning_line(mask | 1 << cell, cell):
+                return cell
+    center = _center(geo)
+    if center in empties:
+        return center
+    search = _Search(geo, deadline=float("inf"))
+    moves = search.order(search.candidates(own, opp), own, opp, None)
+    return moves[0] if moves else None
+
+
+def best_move(board: list, ai_symbol: str, human_symbol: str,
+              win_length: Optional[int] = None, time_budget: Optional[float] = None) -> Optional[int]:
+    """Возвращает индекс лучшего хода для AI.
+
+    На поле 3x3 — поиск в таблице решённых позиций (случайный среди равноценных),
+    на больших полях — search_move с бюджетом времени.
+    """
+    if len(board) != CELLS or (win_length and win_length != bitboard.SIZE):
+        return search_move(board, ai_symbol, win_length, time_budget)
+    x_mask, o_mask = bitboard.from_list(board)
+    winner, _ = bitboard.check(x_mask, o_mask)
+    if winner:
+        return None
+    _, moves = _lookup(x_mask, o_mask, ai_symbol)
+    return random.choice(moves) if moves else None
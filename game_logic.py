@@ -1,10 +1,29 @@
 import logging
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.helpers import escape_markdown
 from typing import Dict, List, Optional, Tuple, Union
 
 # Импортируем необходимые элементы из других модулей
-from config import THEMES, DEFAULT_THEME_KEY, EMPTY_CELL_SYMBOL, logger
+import bitboard
+from config import EMPTY_CELL_SYMBOL, BOARD_SIZES, DEFAULT_BOARD_SIZE, MAX_KEYBOARD_BOARD_SIZE, RENDER_CACHE_SIZE
 from game_state import games
+from render_cache import LRUCache
+from vip import get_avatar
+
+logger = logging.getLogger(__name__)
+
+# Готовые клавиатуры по (доска, тема, последний ход, выигрышная линия, конец игры)
+keyboard_cache = LRUCache(RENDER_CACHE_SIZE)
+# Готовые тексты статуса по (игроки, тема, чей ход, смена темы)
+status_cache = LRUCache(RENDER_CACHE_SIZE)
+
+
+def theme_key(theme_emojis: Dict[str, str]) -> Tuple[str, ...]:
+    """Идентичность темы для ключа кэша: только эмодзи, влияющие на отрисовку"""
+    return (
+        theme_emojis.get("X", ""), theme_emojis.get("O", ""), theme_emojis.get(EMPTY_CELL_SYMBOL, ""),
+        theme_emojis.get("X_win", ""), theme_emojis.get("O_win", ""),
+    )
 
 def get_symbol_emoji(symbol: Union[str, int], game_theme_emojis: Dict[str, str]) -> str:
     """Возвращает эмодзи для заданного символа в теме.
@@ -41,75 +60,133 @@ def get_keyboard(chat_id: int, winning_indices: Optional[List[int]] = None) -> O
         logger.warning(f"get_keyboard called for non-existent game in chat {chat_id}")
         return None
 
-    game_data = games[chat_id]
-    board = game_data["board"]
-    is_game_over = game_data["game_over"]
-    theme_emojis = game_data.get("theme_emojis", THEMES[DEFAULT_THEME_KEY])
+    game = games[chat_id]
+    is_game_over = game.game_over
+    theme_emojis = game.emojis
     # Индекс последнего хода
-    last_move = game_data.get("last_move", None)
-    keyboard = []
-    logger.debug(f"[get_keyboard chat={chat_id}] Board: {board}, Theme: {theme_emojis.get('name', 'Unknown')}, Winning: {winning_indices}")
+    last_move = game.last_move
+    size = game.size
+    x_mask, o_mask = game.x_mask, game.o_mask
+    win_mask = sum(1 << i for i in winning_indices) if is_game_over and winning_indices else 0
 
-    for i in range(0, 9, 3):
+    cache_key = (size, x_mask, o_mask, theme_key(theme_emojis), last_move, win_mask, is_game_over)
+    markup = keyboard_cache.get(cache_key)
+    if markup is not None:
+        return markup
+
+    keyboard = []
+    # Отладочные строки форматируются только при включённом DEBUG для game_logic
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("[get_keyboard chat=%s] Board: %s, Theme: %s, Winning: %s",
+                     chat_id, game.board, theme_emojis.get('name', 'Unknown'), winning_indices)
+    for i in range(0, size * size, size):
         row = []
-        for j in range(3):
+        for j in range(size):
             cell_index = i + j
-            cell = board[cell_index]
-            cell_text = ""
-            callback_data = "noop"
+            bit = 1 << cell_index
+            callback_data = "n"
 
-            if isinstance(cell, int):
-                cell_text = get_symbol_emoji(cell, theme_emojis)
-                if not is_game_over:
-                    callback_data = str(cell_index)
-            else:
-                if is_game_over and winning_indices and cell_index in winning_indices:
-                    win_symbol_key = f"{cell}_win"
+            if x_mask & bit or o_mask & bit:
+                symbol = "X" if x_mask & bit else "O"
+                if win_mask & bit:
                     # Используем get_symbol_emoji для получения символа выигрыша с фоллбэком
-                    cell_text = get_symbol_emoji(win_symbol_key, theme_emojis)
+                    cell_text = get_symbol_emoji(f"{symbol}_win", theme_emojis)
                 else:
-                    cell_text = get_symbol_emoji(cell, theme_emojis)
+                    cell_text = get_symbol_emoji(symbol, theme_emojis)
+            else:
+                cell_text = get_symbol_emoji(cell_index, theme_emojis)
+                if not is_game_over:
+                    callback_data = f"g:{cell_index}"
 
             # Подсветка последнего хода
             if last_move == cell_index:
                 cell_text = f"🟩{cell_text}🟩"
 
-            logger.debug(f"[get_keyboard chat={chat_id}] Cell[{cell_index}]: {repr(cell)} -> Emoji: {repr(cell_text)}, Callback: {callback_data}")
+            if debug:
+                logger.debug("[get_keyboard chat=%s] Cell[%s] -> Emoji: %r, Callback: %s",
+                             chat_id, cell_index, cell_text, callback_data)
             row.append(InlineKeyboardButton(cell_text, callback_data=callback_data))
         keyboard.append(row)
 
     control_row = []
     if is_game_over:
-        control_row.append(InlineKeyboardButton("🔄 Новая игра", callback_data="new_game"))
+        control_row.append(InlineKeyboardButton("🔄 Новая игра", callback_data="g:new"))
     else:
-        control_row.append(InlineKeyboardButton("🎨 Сменить тему", callback_data="change_theme_prompt"))
+        control_row.append(InlineKeyboardButton("🎨 Сменить тему", callback_data="tp"))
 
     if control_row:
         keyboard.append(control_row)
 
-    return InlineKeyboardMarkup(keyboard)
+    markup = InlineKeyboardMarkup(keyboard)
+    keyboard_cache.put(cache_key, markup)
+    return markup
+
+
+def get_status_text(chat_id: int, theme_changed: bool = False) -> str:
+    """Текст сообщения об идущей игре: игроки с VIP-аватарами и чей ход (кэшируется)"""
+    game = games[chat_id]
+    emojis = game.emojis
+    # Игроки-люди в порядке подключения: (аватар, символ, имя)
+    players = tuple(
+        (get_avatar(player.user_id), player.symbol, player.username)
+        for player in game.players if not player.is_ai
+    )
+    current = game.current_player
+    cache_key = (players, theme_key(emojis), current, theme_changed)
+    text = status_cache.get(cache_key)
+    if text is not None:
+        return text
+
+    title = "🎨 Тема изменена! 🎨\n\n" if theme_changed else ""
+    lines = [
+        f"👤 {avatar} {get_symbol_emoji(sym, emojis)}: <i>{escape_markdown(name, version=1)}</i>"
+        for avatar, sym, name in players
+    ]
+    current_emoji = get_symbol_emoji(current, emojis)
+    text = (
+        f"{title}<b>🔄 ИГРА В ПРОЦЕССЕ</b> 🔄\n"
+        "────────────────\n"
+        + "\n".join(lines) + "\n"
+        "────────────────\n"
+        f"➡️ <b>Ходит: {current_emoji}</b>"
+    )
+    status_cache.put(cache_key, text)
+    return text
+
+def win_length_for(size: int) -> int:
+    """Сколько символов в ряд нужно для победы на поле size x size"""
+    return BOARD_SIZES.get(size, size)
+
+
+def playable_sizes() -> List[int]:
+    """Размеры поля, которые помещаются в inline-клавиатуру Telegram"""
+    return [size for size in BOARD_SIZES if size <= MAX_KEYBOARD_BOARD_SIZE]
+
+
+def parse_board_size(args: Optional[List[str]], default: int = DEFAULT_BOARD_SIZE) -> Optional[int]:
+    """Размер поля из аргументов команды ('4' или '4x4'); None, если размер не поддерживается"""
+    if not args:
+        return default
+    raw = args[0].lower().split("x")[0]
+    if not raw.isdigit() or int(raw) not in playable_sizes():
+        return None
+    return int(raw)
+
 
-def check_winner(board: List[Union[int, str]]) -> Tuple[Optional[str], Optional[List[int]]]:
+def check_winner(board: List[Union[int, str]], win_length: Optional[int] = None) -> Tuple[Optional[str], Optional[List[int]]]:
     """Проверяет победителя или ничью на доске.
 
     Args:
-        board: список из 9 элементов (int или символ).
+        board: список из size*size элементов (int или символ); проверка идёт по битбордам.
+        win_length: сколько в ряд нужно для победы (по умолчанию из BOARD_SIZES).
     Returns:
         Tuple:
             - winner_symbol: 'X', 'O' или 'Ничья', или None.
             - winning_indices: список индексов выигрышной линии или None.
     """
-    win_combinations = [
-        [0, 1, 2], [3, 4, 5], [6, 7, 8],  # горизонтали
-        [0, 3, 6], [1, 4, 7], [2, 5, 8],  # вертикали
-        [0, 4, 8], [2, 4, 6]              # диагонали
-    ]
-
-    for combo in win_combinations:
-        if board[combo[0]] == board[combo[1]] == board[combo[2]] and not isinstance(board[combo[0]], int):
-            return board[combo[0]], combo
-
-    if not any(isinstance(cell, int) for cell in board):
-        return "Ничья", None
-
-    return None, None 
\ No newline at end of file
+    x_mask, o_mask = bitboard.from_list(board)
+    size = bitboard.size_of(board)
+    if size == bitboard.SIZE and not win_length:
+        return bitboard.check(x_mask, o_mask)
+    return bitboard.check(x_mask, o_mask, bitboard.geometry(size, win_length or win_length_for(size)))
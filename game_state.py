@@ -1,9 +1,358 @@
-# Словарь для хранения состояния игр {chat_id: game_data}
-games: dict[int, dict] = {} 
+import asyncio
+import functools
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import GAME_FINISHED_TTL_SECONDS, GAME_IDLE_TTL_SECONDS, MAX_LIVE_GAMES
+from game import Game
+from leaderboard import Leaderboard
+from state_backend import StaleGameError, count_result, new_chat_stats
+from timing_wheel import game_timeouts
+
+logger = logging.getLogger(__name__)
+
+
+class GameStore(dict):
+    """Словарь игр {chat_id: Game} с учётом последней активности.
+
+    Завершённые игры удаляются через GAME_FINISHED_TTL_SECONDS, брошенные
+    незавершённые — после GAME_IDLE_TTL_SECONDS без ходов (см. sweep()).
+    Живых игр не больше MAX_LIVE_GAMES: при переполнении вытесняется игра
+    с самой давней активностью. Без надёжного хранилища (durable) вытеснять
+    незавершённую игру некуда, поэтому сначала вытесняются завершённые, и
+    только если их нет — незавершённая удаляется совсем.
+
+    Если подключено хранилище (attach), изменения игр отправляются в него
+    (save() после изменения игры на месте), а незавершённые игры, которых нет
+    в памяти (после перезапуска или вытеснения), поднимаются из него при
+    первом обращении.
+
+    У каждой игры есть версия хранилища: save() записывает игру, только если
+    её не изменил другой процесс (иначе StaleGameError и копия в памяти
+    отбрасывается). С общим хранилищем (store.shared) игра читается из него
+    только в refresh() — один раз перед каждым обновлением чата, вне event
+    loop. До следующего refresh() память считается верной, в том числе
+    отсутствие игры: обращения к games сетевых запросов не делают.
+
+    Запись в общее хранилище тоже идёт вне event loop: save() сразу повышает
+    версию в памяти и ставит снимок игры в очередь потока хранилища, а
+    committed() ждёт результата. Если запись не прошла, копия игры в памяти
+    отбрасывается, и следующие записи той же игры тоже отклоняются.
+    """
+
+    def __init__(self, max_games: int, finished_ttl: float, idle_ttl: float) -> None:
+        super().__init__()
+        self.max_games = max_games
+        self.finished_ttl = finished_ttl
+        self.idle_ttl = idle_ttl
+        # chat_id -> момент последней активности, от давних к свежим
+        self._activity: "OrderedDict[int, float]" = OrderedDict()
+        self.evicted = {"finished": 0, "idle": 0, "cap": 0}
+        self.store = None
+        # Незавершённые игры, которые есть в хранилище, но не в памяти
+        self.dormant: set = set()
+        self.conflicts = 0
+        # chat_id -> последняя отправленная запись игры в общее хранилище
+        self._writes: dict = {}
+
+    def attach(self, store, dormant) -> None:
+        """Подключает хранилище (см. storage.py) и список игр в нём"""
+        self.store = store
+        self.dormant.update(dormant)
+
+    def _rehydrate(self, chat_id: int) -> bool:
+        self.dormant.discard(chat_id)
+        loaded = self.store.load_game(chat_id) if self.store is not None else None
+        if loaded is None:
+            return False
+        game, game.version = loaded
+        super().__setitem__(chat_id, game)
+        self.touch(chat_id)
+        self._enforce_cap()
+        return True
+
+    def _in_store(self, chat_id: int) -> bool:
+        """Может ли игра, которой нет в памяти, быть в (локальном) хранилище"""
+        return chat_id in self.dormant
+
+    @property
+    def shared(self) -> bool:
+        return self.store is not None and self.store.shared
+
+    @property
+    def durable(self) -> bool:
+        return self.store is not None and self.store.durable
+
+    def __contains__(self, chat_id) -> bool:
+        return super().__contains__(chat_id) or (self._in_store(chat_id) and self._rehydrate(chat_id))
+
+    def __getitem__(self, chat_id: int) -> Game:
+        try:
+            return super().__getitem__(chat_id)
+        except KeyError:
+            if self._in_store(chat_id) and self._rehydrate(chat_id):
+                return super().__getitem__(chat_id)
+            raise
+
+    def get(self, chat_id: int, default=None):
+        return self[chat_id] if chat_id in self else default
+
+    def __setitem__(self, chat_id: int, game: Game) -> None:
+        previous = super().get(chat_id)
+        if previous is not None and previous is not game:
+            # Новая игра заменяет запись прежней — сравнение версий идёт с её версией
+            game.version = previous.version
+        super().__setitem__(chat_id, game)
+        self.dormant.discard(chat_id)
+        self.save(chat_id)
+        self._enforce_cap()
+
+    def _enforce_cap(self) -> None:
+        while len(self) > self.max_games:
+            self._evict(self._cap_victim(), "cap")
+
+    def _cap_victim(self) -> int:
+        """Игра для вытеснения по лимиту: самая давняя, без хранилища — самая давняя завершённая"""
+        if not self.durable:
+            for chat_id in self._activity:
+                if super().__getitem__(chat_id).game_over:
+                    return chat_id
+            oldest = next(iter(self._activity))
+            logger.warning(f"Лимит игр {self.max_games}: незавершённая игра чата {oldest} удалена")
+            return oldest
+        return next(iter(self._activity))
+
+    def __delitem__(self, chat_id: int) -> None:
+        super().__delitem__(chat_id)
+        self._forget(chat_id)
+
+    def pop(self, chat_id: int, *default):
+        self._forget(chat_id)
+        return super().pop(chat_id, *default)
+
+    def _forget(self, chat_id: int) -> None:
+        self._activity.pop(chat_id, None)
+        self.dormant.discard(chat_id)
+        game_timeouts.cancel(chat_id)
+        if self.store is not None:
+            self.store.delete_game(chat_id)
+
+    def clear(self) -> None:
+        for chat_id in list(self):
+            self._forget(chat_id)
+        super().clear()
+
+    def touch(self, chat_id: int) -> None:
+        """Отмечает активность в игре чата"""
+        if super().__contains__(chat_id):
+            self._activity[chat_id] = time.monotonic()
+            self._activity.move_to_end(chat_id)
+
+    def save(self, chat_id: int) -> None:
+        """Отмечает активность и записывает изменение игры в хранилище.
+
+        Если игру уже изменил другой процесс, бросает StaleGameError
+        (с общим хранилищем — committed()).
+        """
+        self.touch(chat_id)
+        if not super().__contains__(chat_id):
+            return
+        game = super().__getitem__(chat_id)
+        if self.store is None:
+            game.version += 1
+            return
+        if self.store.shared:
+            self._submit_save(chat_id, game)
+            return
+        try:
+            game.version = self.store.save_game(chat_id, game, game.version)
+        except StaleGameError:
+            self.conflicts += 1
+            self._drop(chat_id)
+            raise
+
+    def _submit_save(self, chat_id: int, game: Game) -> None:
+        version = game.version
+        game.version += 1
+        # Поток хранилища пишет копию: игру в памяти дальше меняют обработчики
+        snapshot = Game.from_dict(game.to_dict())
+        future = self.store.submit(self._write, chat_id, snapshot, version, self._writes.get(chat_id))
+        write = asyncio.wrap_future(future)
+        self._writes[chat_id] = (future, write)
+        write.add_done_callback(functools.partial(self._written, chat_id, game))
+
+    def _write(self, chat_id: int, snapshot: Game, version: int, previous) -> int:
+        """Запись в потоке хранилища; previous — предыдущая запись этой игры"""
+        if previous is not None and previous[0].exception() is not None:
+            # Предыдущее изменение не записано — это строилось на нём
+            raise StaleGameError(chat_id)
+        return self.store.save_game(chat_id, snapshot, version)
+
+    def _written(self, chat_id: int, game: Game, write: asyncio.Future) -> None:
+        if self._writes.get(chat_id, (None, None))[1] is write:
+            del self._writes[chat_id]
+        if write.cancelled():
+            return
+        error = write.exception()
+        if error is None:
+            return
+        if isinstance(error, StaleGameError):
+            self.conflicts += 1
+        else:
+            logger.error(f"Не удалось записать игру чата {chat_id}: {error}")
+        # Копия в памяти новее хранилища — следующий refresh() прочитает актуальную
+        if super().get(chat_id) is game:
+            self._drop(chat_id)
+
+    async def committed(self, chat_id: int) -> None:
+        """Ждёт записи изменений игры в общее хранилище; StaleGameError — не записаны"""
+        pending = self._writes.get(chat_id)
+        if pending is not None:
+            await pending[1]
+
+    async def refresh(self, chat_id: int) -> None:
+        """С общим хранилищем — перечитывает игру чата (в потоке хранилища)"""
+        if not self.shared:
+            return
+        pending = self._writes.get(chat_id)
+        if pending is not None:
+            # Неудачная запись отбрасывает копию в памяти — сначала её дожидаемся
+            await asyncio.wait([pending[1]])
+        before = super().get(chat_id)
+        before_version = before.version if before is not None else None
+        loaded = await self.store.call(self.store.load_game, chat_id)
+        current = super().get(chat_id)
+        if current is not before or (current is not None and current.version != before_version):
+            # Пока шло чтение, игру изменили в этом процессе — копия в памяти не старее
+            return
+        if loaded is None:
+            self._drop(chat_id)
+            return
+        game, game.version = loaded
+        super().__setitem__(chat_id, game)
+        self.touch(chat_id)
+        self._enforce_cap()
+
+    def _drop(self, chat_id: int) -> None:
+        """Убирает игру из памяти, не трогая хранилище"""
+        super().pop(chat_id, None)
+        self._activity.pop(chat_id, None)
+
+    def _evict(self, chat_id: int, reason: str) -> None:
+        game = super().pop(chat_id)
+        self._activity.pop(chat_id, None)
+        self.evicted[reason] += 1
+        if self.store is not None and not self.store.shared:
+            # Общее хранилище чистит устаревшие игры само (purge): другой процесс
+            # мог уже начать в этом чате новую игру
+            if reason == "cap" and not game.game_over and self.store.durable:
+                # Незавершённая игра остаётся в хранилище и поднимется при следующем ходе
+                self.dormant.add(chat_id)
+            else:
+                self.store.delete_game(chat_id)
+        if reason != "cap" or game.game_over or not self.durable:
+            # Таймаут вытесненной незавершённой игры остаётся: обработчик поднимет её из хранилища
+            game_timeouts.cancel(chat_id)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Удаляет завершённые и брошенные игры. Возвращает число удалённых."""
+        now = time.monotonic() if now is None else now
+        expired = []
+        # Обход от давних к свежим: дальше порога бездействия можно не смотреть
+        for chat_id, last_active in self._activity.items():
+            idle = now - last_active
+            if idle < self.finished_ttl and idle < self.idle_ttl:
+                break
+            if super().__getitem__(chat_id).game_over:
+                if idle >= self.finished_ttl:
+                    expired.append((chat_id, "finished"))
+            elif idle >= self.idle_ttl:
+                expired.append((chat_id, "idle"))
+        for chat_id, reason in expired:
+            self._evict(chat_id, reason)
+        return len(expired)
+
+    async def purge(self) -> None:
+        """Общее хранилище: удаляет в нём устаревшие игры (в потоке хранилища)"""
+        if self.shared:
+            await self.store.call(self.store.purge, self.finished_ttl, self.idle_ttl)
+
+    def stats(self) -> dict:
+        return {"size": len(self), "max": self.max_games, "dormant": len(self.dormant),
+                "evicted": dict(self.evicted), "conflicts": self.conflicts}
+
+
+# Словарь для хранения состояния игр {chat_id: Game}
+games: GameStore = GameStore(MAX_LIVE_GAMES, GAME_FINISHED_TTL_SECONDS, GAME_IDLE_TTL_SECONDS)
 
 # Словарь для хранения забаненных пользователей (по username или user_id)
 banned_users: set[str] = set()
 
 # Словарь для хранения статистики по чатам
 # Формат: {chat_id: {"games": int, "wins": int, "draws": int, "top_players": dict}}
-chat_stats: dict[int, dict] = {} 
\ No newline at end of file
+chat_stats: dict[int, dict] = {}
+
+# Рейтинги по победам: по чатам и общий по всем чатам (см. leaderboard.py);
+# строятся из top_players статистики и обновляются в record_result
+chat_leaderboards: dict[int, Leaderboard] = {}
+global_leaderboard = Leaderboard()
+
+
+def _sync_leaderboard(chat_id: int, top_players: dict) -> None:
+    """Приводит рейтинг чата к top_players, перенося разницу в общий рейтинг"""
+    board = chat_leaderboards.setdefault(chat_id, Leaderboard())
+    for name in set(top_players).union(name for name, _ in board.items()):
+        wins = top_players.get(name, 0)
+        delta = wins - board.score(name)
+        if delta:
+            board.set(name, wins)
+            global_leaderboard.add(name, delta)
+
+
+def rebuild_leaderboards() -> None:
+    """Строит рейтинги по загруженной статистике (при старте)"""
+    for chat_id, stats in chat_stats.items():
+        _sync_leaderboard(chat_id, stats.get("top_players", {}))
+
+
+def chat_leaderboard(chat_id: int) -> Leaderboard:
+    return chat_leaderboards.get(chat_id) or Leaderboard()
+
+
+# Фоновые обновления статистики в общем хранилище
+_shared_stats_tasks: set = set()
+
+
+def record_result(chat_id: int, winner_name: Optional[str]) -> None:
+    """Учитывает завершённую партию в статистике и рейтингах (winner_name=None — ничья)"""
+    store = games.store
+    if store is not None and store.shared:
+        # Статистику обновляют и другие процессы: прибавка атомарна в хранилище, в фоне
+        task = asyncio.get_running_loop().create_task(_record_shared_result(store, chat_id, winner_name))
+        _shared_stats_tasks.add(task)
+        task.add_done_callback(_shared_stats_tasks.discard)
+        return
+    stats = _count_result(chat_id, winner_name)
+    if store is not None:
+        store.save_chat_stats(chat_id, stats)
+
+
+async def _record_shared_result(store, chat_id: int, winner_name: Optional[str]) -> None:
+    try:
+        stats = await store.call(store.add_chat_result, chat_id, winner_name)
+    except Exception as e:
+        logger.error(f"Не удалось обновить статистику чата {chat_id}: {e}")
+        return
+    # Вместе с этой партией приходят и партии других процессов
+    chat_stats[chat_id] = stats
+    _sync_leaderboard(chat_id, stats.get("top_players", {}))
+
+
+def _count_result(chat_id: int, winner_name: Optional[str]) -> dict:
+    stats = count_result(chat_stats.setdefault(chat_id, new_chat_stats()), winner_name)
+    if winner_name is not None:
+        chat_leaderboards.setdefault(chat_id, Leaderboard()).add(winner_name)
+        global_leaderboard.add(winner_name)
+    return stats
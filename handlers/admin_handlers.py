@@ -1,13 +1,20 @@
 """
-Handlers for admin commands: reset, ban, unban, chat stats
+Handlers for admin commands: reset, ban, unban, chat stats, analytics, rating recompute
 """
+import logging
 import telegram
 from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler
 
-from config import logger
+from config import THEMES
 from game_state import games, banned_users, chat_stats
-from vip import is_vip_by_username, VIP_ICON, is_vip
+from vip import is_vip
+from handlers.leaderboard_handlers import leaderboard_message
+from event_log import event_log
+from ratings import ratings
+from storage import storage
+
+logger = logging.getLogger(__name__)
 
 async def reset_game(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
@@ -18,7 +25,7 @@ async def reset_game(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     if chat_id in games:
         del games[chat_id]
         await update.message.reply_text('♻️ Игра в этом чате сброшена.')
-        logger.info(f'Reset game in chat {chat_id}')
+        logger.info('Reset game in chat %s', chat_id)
     else:
         await update.message.reply_text('В этом чате нет активной игры.')
 
@@ -37,8 +44,9 @@ async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text('Использование: /ban <@username или user_id> или ответ на сообщение пользователя')
         return
     banned_users.add(target)
+    storage.save_ban(target, True)
     await update.message.reply_text(f'Пользователь {target} забанен.')
-    logger.info(f'User {target} banned')
+    logger.info('User %s banned', target)
 
 async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
@@ -56,8 +64,9 @@ async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         return
     if target in banned_users:
         banned_users.remove(target)
+        storage.save_ban(target, False)
         await update.message.reply_text(f'Пользователь {target} разбанен.')
-        logger.info(f'User {target} unbanned')
+        logger.info('User %s unbanned', target)
     else:
         await update.message.reply_text(f'Пользователь {target} не был забанен.')
 
@@ -66,25 +75,53 @@ async def chat_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text('⛔ Только владелец может использовать эту команду.')
         return
     chat_id = update.effective_chat.id
-    stats = chat_stats.get(chat_id)
-    if not stats:
+    if not chat_stats.get(chat_id):
         await update.message.reply_text('В этом чате нет статистики.')
         return
-    text = [f'📊 Статистика для чата {chat_id}:']
-    text.append(f"Всего игр: {stats.get('games', 0)}")
-    text.append(f"Побед: {stats.get('wins', 0)}")
-    text.append(f"Ничьих: {stats.get('draws', 0)}")
-    top = stats.get('top_players', {})
-    if top:
-        text.append('Топ по победам:')
-        for user, count in sorted(top.items(), key=lambda x: -x[1]):
-            vip_marker = VIP_ICON if is_vip_by_username(user) else ""
-            text.append(f"- {user}{vip_marker}: {count}")
+    # Первая страница рейтинга чата; дальше — кнопками (см. leaderboard_handlers.py)
+    text, markup = leaderboard_message("c", chat_id)
+    await update.message.reply_text(text, reply_markup=markup)
+
+async def analytics_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Аналитика по свёрткам журнала игр (event_log.py) за последние 7 дней"""
+    if update.effective_user.username != 'sadea12':
+        await update.message.reply_text('⛔ Только владелец может использовать эту команду.')
+        return
+    summary = event_log.summary()
+    if not summary or not summary['games_per_day']:
+        await update.message.reply_text('Журнал игр пока пуст.')
+        return
+    text = ['📈 Аналитика за 7 дней:', 'Игр по дням:']
+    text.extend(f"- {day}: {count}" for day, count in summary['games_per_day'].items())
+    text.append(f"Средняя игра: {summary['avg_moves']} ходов, {summary['avg_duration']} сек")
+    if summary['ai_win_rate']:
+        text.append('Доля побед ИИ по темам:')
+        text.extend(f"- {THEMES[key]['name'] if key in THEMES else key}: {rate:.0%}"
+                    for key, rate in summary['ai_win_rate'].items())
+    text.append(f"Чатов: {summary['chats']}, игроков: {summary['users']}")
     await update.message.reply_text("\n".join(text))
 
+async def rerate_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Полный пересчёт рейтингов Эло по журналу игр (например, после смены ELO_K)"""
+    if update.effective_user.username != 'sadea12':
+        await update.message.reply_text('⛔ Только владелец может использовать эту команду.')
+        return
+    await update.message.reply_text('⏳ Пересчитываю рейтинги по журналу игр...')
+    try:
+        players = await ratings.recompute()
+    except Exception as e:
+        logger.error(f'Rating recompute failed: {e}')
+        await update.message.reply_text('❌ Не удалось пересчитать рейтинги.')
+        return
+    await ratings.save()
+    await update.message.reply_text(
+        f'✅ Рейтинги пересчитаны: {players} игроков за {ratings.recompute_seconds:.2f} сек.')
+
 # Handler objects
 reset_game_handler = CommandHandler('resetgame', reset_game)
 reset_handler = CommandHandler('reset', reset_game)
 ban_user_handler = CommandHandler('ban', ban_user)
 unban_user_handler = CommandHandler('unban', unban_user)
-chat_stats_handler = CommandHandler('chatstats', chat_stats_command) 
\ No newline at end of file
+chat_stats_handler = CommandHandler('chatstats', chat_stats_command)
+analytics_handler = CommandHandler('analytics', analytics_command)
+rerate_handler = CommandHandler('rerate', rerate_command) 
\ No newline at end of file
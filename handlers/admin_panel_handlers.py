@@ -1,10 +1,13 @@
+import logging
 from datetime import datetime
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
-from config import logger
+from telegram.ext import ContextTypes, CommandHandler
 from bot_state import get_all_chats
+import broadcast
 from vip import vip_users, subscriptions, vip_user_map
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_BROADCAST_TEXT = (
     "🎉 Привет! Это CrackNolikBot с важной новостью! 🎉\n\n"
     "💎 У нас появилась VIP‑подписка! Она дарит:\n"
@@ -30,29 +33,32 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await update.message.reply_text('ℹ️ Админ‑панель доступна только в личном чате с ботом.')
         return
     keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton('📬 Рассылка', callback_data='admin_broadcast')],
-        [InlineKeyboardButton('💎 Статус VIP', callback_data='admin_vip_status')]
+        [InlineKeyboardButton('📬 Рассылка', callback_data='a:broadcast')],
+        [InlineKeyboardButton('💎 Статус VIP', callback_data='a:vip_status')]
     ])
     await update.message.reply_text('👑 Панель администратора:', reply_markup=keyboard)
 
-async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str) -> None:
     """Обработка нажатий в админ‑панели"""
     query = update.callback_query
     await query.answer()
-    data = query.data
-    if data == 'admin_broadcast':
-        # Отправляем рассылку с текстом по умолчанию
-        chats = get_all_chats()
-        count = 0
-        for chat_id in chats:
-            try:
-                await context.bot.send_message(chat_id=chat_id, text=DEFAULT_BROADCAST_TEXT)
-                count += 1
-            except Exception as e:
-                logger.warning(f"Не удалось отправить в чат {chat_id}: {e}")
-        await query.edit_message_text(f'✅ Рассылка отправлена в {count} чатов.')
+    if action == 'broadcast':
+        # Рассылка идёт фоновым заданием: параллельно, с прогрессом и возобновлением после перезапуска
+        if broadcast.is_running():
+            await query.edit_message_text(broadcast.progress_text())
+            return
+        if broadcast.job:
+            await query.edit_message_text('⏳ Продолжаем прерванную рассылку...')
+        else:
+            broadcast.create_job(DEFAULT_BROADCAST_TEXT, get_all_chats(), query.message.chat_id, query.message.message_id)
+            await query.edit_message_text(f"📬 Рассылка запущена: {len(broadcast.job['chats'])} чатов.")
+        broadcast.job['admin_chat_id'] = query.message.chat_id
+        broadcast.job['admin_message_id'] = query.message.message_id
+        await broadcast.save_state()
+        # Рассылка идёт через отдельный пул соединений (см. transport.py)
+        context.application.create_task(broadcast.run(context.bot_data.get('background_bot', context.bot)))
         return
-    elif data == 'admin_vip_status':
+    elif action == 'vip_status':
         # Формируем статус VIP
         lines = ['📊 Статус VIP:']
         for user_id in vip_users:
@@ -65,4 +71,7 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 # Handler objects
 admin_panel_handler = CommandHandler('admin', admin_command)
-admin_callback_handler = CallbackQueryHandler(admin_callback, pattern=r'^admin_') 
\ No newline at end of file
+# Callback-маршруты (см. callback_router.py)
+callback_routes = {
+    'a': admin_callback,
+} 
\ No newline at end of file
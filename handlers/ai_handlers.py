@@ -3,14 +3,16 @@
 """
 import asyncio
 import telegram
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler
 from telegram.helpers import escape_markdown
 
-from config import THEMES, DEFAULT_THEME_KEY
-from game_state import games, chat_stats
-from game_logic import get_symbol_emoji, get_keyboard, check_winner
-from game_ai import best_move
+from config import DEFAULT_THEME_KEY
+from game_state import games
+from game import Game, AI_USER_ID, AI_USERNAME
+from game_logic import get_symbol_emoji, get_keyboard, parse_board_size, playable_sizes, win_length_for
+from ai_executor import ai_executor
+import moves
 
 async def play_ai(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Начать игру пользователя против ИИ"""
@@ -21,41 +23,40 @@ async def play_ai(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.effective_message or update.message
 
     # Проверка активной игры
-    if chat_id in games and not games[chat_id].get('game_over', True):
+    if chat_id in games and not games[chat_id].game_over:
         await message.reply_text("⏳ В этом чате уже идет игра. Сначала завершите ее.")
         return
 
+    # Размер поля из аргумента команды: /play_ai 4
+    size = parse_board_size(context.args)
+    if size is None:
+        sizes = ", ".join(str(s) for s in playable_sizes())
+        await message.reply_text(f"Использование: /play_ai [размер поля: {sizes}]")
+        return
+    win_length = win_length_for(size)
+
     # Сброс предыдущей игры
     if chat_id in games:
         del games[chat_id]
 
     # Инициализация
     chosen_key = context.user_data.get('chosen_theme', DEFAULT_THEME_KEY)
-    theme_emojis = THEMES.get(chosen_key, THEMES[DEFAULT_THEME_KEY])
     # Пользователь всегда X, ИИ всегда O
     user_symbol = 'X'
     ai_symbol = 'O'
-    board = list(range(1, 10))
-    game_data = {
-        'board': board,
-        'current_player': user_symbol,
-        'game_over': False,
-        'players': {user_symbol: user_id, ai_symbol: "AI"},
-        'user_symbols': {user_id: user_symbol},
-        'usernames': {user_id: username, 'AI': '🤖 ИИ'},
-        'theme_emojis': theme_emojis,
-        'vs_ai': True,
-        'ai_symbol': ai_symbol,
-        'last_move': None
-    }
-    games[chat_id] = game_data
+    game = Game(size, win_length, user_symbol, chosen_key, ai_symbol=ai_symbol)
+    game.add_player(user_id, username, user_symbol)
+    game.add_player(AI_USER_ID, AI_USERNAME, ai_symbol)
+    games[chat_id] = game
+    await games.committed(chat_id)
 
     # Отправка стартового сообщения
-    user_emoji = get_symbol_emoji(user_symbol, theme_emojis)
+    user_emoji = get_symbol_emoji(user_symbol, game.emojis)
     text = (
         f"<b>🤖 Игра против ИИ</b>\n"
         "────────────────\n"
         f"👤 {user_emoji}: <i>{escape_markdown(username, version=1)}</i>\n"
+        f"📐 Поле: {size}x{size}, для победы {win_length} в ряд\n"
         "────────────────\n"
         "<i>Ваш ход! Нажмите на клетку.</i>"
     )
@@ -64,75 +65,33 @@ async def play_ai(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         reply_markup=get_keyboard(chat_id),
         parse_mode="HTML"
     )
-    game_data['message_id'] = sent.message_id
+    game.message_id = sent.message_id
+    games.save(chat_id)
+    await games.committed(chat_id)
+    moves.arm_timeout(chat_id, game)
 
-async def ai_move(query: telegram.CallbackQuery, context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
-    """Выполняет ход ИИ и обновляет сообщение"""
-    # Задержка перед ходом ИИ для эффекта мышления
-    await asyncio.sleep(0.5)
-    game_data = games[chat_id]
-    board = game_data['board']
-    ai_symbol = game_data['ai_symbol']
+async def ai_move(query: telegram.CallbackQuery, context: ContextTypes.DEFAULT_TYPE, chat_id: int,
+                  version: int) -> None:
+    """Вычисляет и записывает ход ИИ для версии игры version, затем отрисовывает его"""
+    game = games[chat_id]
+    ai_symbol = game.ai_symbol
     human_symbol = 'X' if ai_symbol == 'O' else 'O'
 
-    # Вычисляем лучший ход
-    move = best_move(board, ai_symbol, human_symbol)
+    # Вычисляем лучший ход в пуле (ai_executor), не блокируя остальные чаты;
+    # на полях больше 3x3 поиск ограничен бюджетом времени AI_TIME_BUDGET_SECONDS
+    move_task = asyncio.create_task(ai_executor.compute_move(game.board, ai_symbol, human_symbol, game.win_length))
+    # Задержка перед ходом ИИ для эффекта мышления (идёт параллельно с вычислением)
+    await asyncio.sleep(0.5)
+    cell = await move_task
+    if cell is None:
+        return
+    # Ход записывается, только если игра не изменилась, пока ИИ думал
+    move = await moves.commit_ai_move(chat_id, cell, version)
     if move is None:
         return
-    # Анимация хода ИИ: два кадра с обработкой флад контроля
-    keyboard = get_keyboard(chat_id)
-    row, col = divmod(move, 3)
-    frames = ["⏳", "⌛️"]
-    for frame in frames:
-        animated_keyboard = []
-        for r_i, row_buttons in enumerate(keyboard.inline_keyboard):
-            new_row = []
-            for c_i, btn in enumerate(row_buttons):
-                if r_i == row and c_i == col:
-                    new_row.append(InlineKeyboardButton(frame, callback_data="noop"))
-                else:
-                    new_row.append(btn)
-            animated_keyboard.append(new_row)
-        try:
-            await query.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(animated_keyboard))
-        except telegram.error.RetryAfter as e:
-            await asyncio.sleep(e.retry_after)
-        except Exception:
-            pass
-        await asyncio.sleep(0.1)
-    # Устанавливаем символ в ячейку после анимации
-    board[move] = ai_symbol
-    # Сохраняем индекс последнего хода для подсветки
-    game_data['last_move'] = move
-    winner, combo = check_winner(board)
-    # Завершаем или продолжаем игру
-    if winner:
-        game_data['game_over'] = True
-        # Обновляем статистику чата
-        stats = chat_stats.setdefault(chat_id, {"games": 0, "wins": 0, "draws": 0, "top_players": {}})
-        stats["games"] += 1
-        if winner == "Ничья":
-            stats["draws"] += 1
-            text = "🤝 Ничья!"
-            keyboard = get_keyboard(chat_id)
-            await query.edit_message_text(text, reply_markup=keyboard, parse_mode="HTML")
-        else:
-            stats["wins"] += 1
-            # Имя победителя
-            winner_id = game_data['players'][winner]
-            winner_name = game_data['usernames'].get(winner_id, str(winner_id))
-            stats["top_players"][winner_name] = stats["top_players"].get(winner_name, 0) + 1
-            theme_emojis = game_data['theme_emojis']
-            winner_emoji = get_symbol_emoji(f"{winner}_win", theme_emojis)
-            text = f"🏆 Победитель: {escape_markdown(winner_name, version=1)} {winner_emoji}! Поздравляем!"
-            keyboard = get_keyboard(chat_id, combo)
-            await query.edit_message_text(text, reply_markup=keyboard, parse_mode="HTML")
-    else:
-        # Переключаем ход на пользователя и обновляем сообщение
-        game_data['current_player'] = human_symbol
-        # Локальный импорт, чтобы избежать кругового импорта
-        from handlers.game_handlers import _restore_game_message
-        await _restore_game_message(query, context, chat_id, theme_changed=False)
+    # Локальный импорт, чтобы избежать кругового импорта
+    from handlers.game_handlers import render_move
+    await render_move(context, chat_id, move)
 
 # Создаем handler для команды /play_ai
 play_ai_handler = CommandHandler("play_ai", play_ai) 
\ No newline at end of file
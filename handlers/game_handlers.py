@@ -2,21 +2,28 @@
 """
 Handlers for game commands and callbacks.
 """
+import logging
 import random
-import asyncio
-from datetime import timedelta
 import telegram
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+from telegram.ext import ContextTypes, CommandHandler
 from telegram.helpers import escape_markdown
-from typing import Optional, List, Tuple
+from typing import Optional, Tuple
 
-from config import logger, GAME_TIMEOUT_SECONDS, THEMES, DEFAULT_THEME_KEY
-from game_state import games, banned_users, chat_stats
-from game_logic import get_symbol_emoji, get_keyboard, check_winner
+from config import GAME_TIMEOUT_SECONDS, MOVE_TIMEOUT_SECONDS, DEFAULT_THEME_KEY, DEFAULT_BOARD_SIZE
+from game_state import games, banned_users, record_result
+from game import Game
+from game_logic import get_symbol_emoji, get_keyboard, get_status_text, parse_board_size, playable_sizes, win_length_for
 from handlers.ai_handlers import ai_move
 from vip import get_avatar, get_signature, DEFAULT_AVATAR, get_symbol
 from bot_state import add_chat
+import message_editor
+import moves
+from event_log import event_log
+from ratings import ratings
+from state_backend import StaleGameError
+
+logger = logging.getLogger(__name__)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /start"""
@@ -45,259 +52,208 @@ async def new_game(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     # Проверка на активную игру
-    if chat_id in games and not games[chat_id].get('game_over', True):
+    if chat_id in games and not games[chat_id].game_over:
         await message.reply_text(
             "⏳ В этом чате уже идет игра! Дождитесь ее завершения или отмены.",
-            reply_to_message_id=games[chat_id].get('message_id')
+            reply_to_message_id=games[chat_id].message_id
         )
         logger.warning(f"Пытались начать игру в чате {chat_id}, где уже есть активная игра.")
         return
 
-    # Отмена старого таймера и удаление старой игры
+    # Размер поля: из аргумента команды или как в предыдущей игре (кнопка "Новая игра")
+    previous_size = games[chat_id].size if chat_id in games else DEFAULT_BOARD_SIZE
+    size = parse_board_size(context.args, default=previous_size)
+    if size is None:
+        sizes = ", ".join(str(s) for s in playable_sizes())
+        await message.reply_text(f"Использование: /newgame [размер поля: {sizes}]")
+        return
+    win_length = win_length_for(size)
+
+    # Удаление старой игры (вместе с её таймаутом)
     if chat_id in games:
-        old_job = games[chat_id].get('timeout_job')
-        if old_job:
-            try:
-                old_job.schedule_removal()
-                logger.info(f"Removed previous timeout job for chat {chat_id}.")
-            except Exception as e:
-                logger.warning(f"Could not remove timeout job for chat {chat_id}: {e}")
         del games[chat_id]
 
     # Инициализация новой игры
     first_player = random.choice(["X", "O"])
-    second_player = "O" if first_player == "X" else "X"
     chosen_key = context.user_data.get('chosen_theme', DEFAULT_THEME_KEY)
-    theme_emojis = THEMES.get(chosen_key, THEMES[DEFAULT_THEME_KEY]).copy()
-    game_data = {
-        "board": list(range(1, 10)),
-        "current_player": first_player,
-        "game_over": False,
-        "players": {first_player: user_id, second_player: None},
-        "user_symbols": {user_id: first_player},
-        "usernames": {user_id: username},
-        "message_id": None,
-        "timeout_job": None,
-        "theme_emojis": theme_emojis
-    }
+    game = Game(size, win_length, first_player, chosen_key)
+    game.add_player(user_id, username, first_player)
     # Override symbols for VIP users if they have custom symbol
-    for uid, sym in game_data['user_symbols'].items():
-        custom = get_symbol(uid)
-        if custom:
-            theme_emojis[sym] = custom
-    games[chat_id] = game_data
+    custom = get_symbol(user_id)
+    if custom:
+        game.override_symbol(first_player, custom)
+    games[chat_id] = game
+    # Другой процесс мог уже начать игру в этом чате — тогда сообщение не отправляем
+    await games.committed(chat_id)
 
     # Отправка начального сообщения
     avatar = get_avatar(user_id)
     signature = get_signature(user_id)
     signature_block = f"{signature}\n" if signature else ""
-    first_emoji = get_symbol_emoji(first_player, game_data['theme_emojis'])
+    move_timeout_line = f"⏱️ Время на ход: {int(MOVE_TIMEOUT_SECONDS)} сек\n" if MOVE_TIMEOUT_SECONDS > 0 else ""
+    first_emoji = get_symbol_emoji(first_player, game.emojis)
     sent_message = await message.reply_text(
         "<b>🕹️ НОВАЯ ИГРА НАЧАЛАСЬ! 🕹️</b>\n"
         f"{signature_block}"
         "───────────────\n"
         f"👤 Игрок: {avatar} <i>{escape_markdown(username, version=1)}</i>\n"
         f"🎭 Символ: {first_emoji}\n"
-        f"⏱️ Таймаут на ход: {GAME_TIMEOUT_SECONDS} сек\n"
+        f"📐 Поле: {size}x{size}, для победы {win_length} в ряд\n"
+        f"⏱️ Ожидание соперника: {GAME_TIMEOUT_SECONDS} сек\n"
+        f"{move_timeout_line}"
         "───────────────\n"
         "<i>Ждём второго игрока...</i>",
         reply_markup=get_keyboard(chat_id),
         parse_mode="HTML"
     )
-    game_data['message_id'] = sent_message.message_id
+    game.message_id = sent_message.message_id
+    games.save(chat_id)
+    await games.committed(chat_id)
+    # Таймаут ожидания второго игрока (см. timing_wheel.py)
+    moves.arm_timeout(chat_id, game)
 
-    # Планируем таймаут ожидания второго игрока
-    job_context = {'chat_id': chat_id, 'message_id': sent_message.message_id}
-    timeout_job = context.job_queue.run_once(
-        game_timeout,
-        when=timedelta(seconds=GAME_TIMEOUT_SECONDS),
-        data=job_context,
-        name=f"game_timeout_{chat_id}"
-    )
-    game_data['timeout_job'] = timeout_job
+async def noop_click(update: Update, context: ContextTypes.DEFAULT_TYPE, _arg: str) -> None:
+    """Нажатие на занятую клетку или кадр анимации: только ответ на callback."""
+    try:
+        await update.callback_query.answer()
+    except telegram.error.BadRequest:
+        pass
 
-async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик нажатия на кнопки игрового поля или управления игрой."""
+async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str) -> None:
+    """Обработчик нажатия на кнопки игрового поля (action — номер клетки) или «Новая игра» (action == "new")."""
     query = update.callback_query
     user = update.effective_user
     chat_id = update.effective_chat.id
-    data = query.data
 
     # Блокировка забаненных пользователей
     if str(user.id) in banned_users or user.username in banned_users:
         await query.answer("⛔ Вы забанены и не можете играть.", show_alert=True)
         return
 
-    # Ответ на callback
-    try:
-        await query.answer()
-    except telegram.error.BadRequest:
-        pass
-
-    # Проверка наличия игры
+    # Проверка наличия игры (завершённые и брошенные игры удаляет sweep_games)
     if chat_id not in games:
-        await query.answer("Игра не найдена.", show_alert=True)
+        if action == 'new':
+            await _answer(query)
+            await new_game(update, context)
+            return
+        await _answer(query, "Игра не найдена.", show_alert=True)
         return
 
-    game_data = games[chat_id]
+    game = games[chat_id]
+    games.touch(chat_id)
     message_id = query.message.message_id if query.message else None
     # Проверка на актуальность сообщения
-    if message_id and message_id != game_data.get('message_id'):
-        await query.answer("Старая игра. Начните новую.", show_alert=True)
-        try:
-            await context.bot.edit_message_reply_markup(chat_id, message_id, reply_markup=None)
-        except Exception:
-            pass
+    if message_id and message_id != game.message_id:
+        await _answer(query, "Старая игра. Начните новую.", show_alert=True)
+        await message_editor.edit(context.bot, chat_id, message_id, reply_markup=None)
         return
 
-    # Обработка noop и new_game и ходов
-    if data == 'noop':
-        return
-    if data == 'new_game':
+    # Обработка новой игры и ходов
+    if action == 'new':
         # При нажатии "Новая игра" запускаем новую игру от имени пользователя
+        await _answer(query)
         await new_game(update, context)
         return
-    if data.isdigit():
-        cell = int(data)
-        # логика присоединения и хода, проверка победы
-        board = game_data['board']
-        if isinstance(board[cell], int):
-            symbol = game_data['current_player']
-            user_id = update.effective_user.id
-            # Логика регистрации второго игрока
-            if game_data['players'][symbol] is None:
-                other_symbol = 'O' if symbol == 'X' else 'X'
-                # Запрещаем одному пользователю играть за обе стороны
-                if game_data['players'][other_symbol] == user_id:
-                    await query.answer("Вы уже играете за другую сторону", show_alert=True)
-                    return
-                # Регистрация второго игрока и отмена таймаута ожидания второго игрока
-                game_data['players'][symbol] = user_id
-                game_data['user_symbols'][user_id] = symbol
-                # Override custom symbol for VIP second player
-                custom = get_symbol(user_id)
-                if custom:
-                    game_data['theme_emojis'][symbol] = custom
-                # Сохраняем имя второго игрока
-                username = update.effective_user.username or f"player_{user_id}"
-                game_data['usernames'][user_id] = username
-                if game_data.get('timeout_job'):
-                    try:
-                        game_data['timeout_job'].schedule_removal()
-                        logger.info(f"Second player joined for chat {chat_id}, canceled timeout")
-                    except Exception as e:
-                        logger.warning(f"Could not cancel timeout job for chat {chat_id}: {e}")
-                    game_data['timeout_job'] = None
-            elif game_data['players'][symbol] != user_id:
-                await query.answer("Сейчас не ваш ход", show_alert=True)
-                return
-            # Анимация хода: показываем два кадра, обрабатываем фул контрол
-            keyboard = get_keyboard(chat_id)
-            row, col = divmod(cell, 3)
-            frames = ["⏳", "⌛️"]
-            for frame in frames:
-                animated_keyboard = []
-                for r_i, row_buttons in enumerate(keyboard.inline_keyboard):
-                    new_row = []
-                    for c_i, btn in enumerate(row_buttons):
-                        if r_i == row and c_i == col:
-                            new_row.append(InlineKeyboardButton(frame, callback_data="noop"))
-                        else:
-                            new_row.append(btn)
-                    animated_keyboard.append(new_row)
-                try:
-                    await query.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(animated_keyboard))
-                except telegram.error.RetryAfter as e:
-                    await asyncio.sleep(e.retry_after)
-                    await query.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(animated_keyboard))
-                except Exception:
-                    pass
-                await asyncio.sleep(0.1)
-            # Устанавливаем символ в ячейку после анимации
-            board[cell] = symbol
-            # Сохраняем индекс последнего хода для подсветки
-            game_data['last_move'] = cell
-            winner, combo = check_winner(board)
-            if winner:
-                # Завершаем игру и подсчитываем метрики
-                game_data['game_over'] = True
-                # Обновляем статистику чата
-                stats = chat_stats.setdefault(chat_id, {"games": 0, "wins": 0, "draws": 0, "top_players": {}})
-                stats["games"] += 1
-                if winner == "Ничья":
-                    stats["draws"] += 1
-                    # Отображаем сообщение о ничье с финальным полем
-                    theme_emojis = game_data['theme_emojis']
-                    text = "🤝 Ничья!"
-                    keyboard = get_keyboard(chat_id)
-                    await query.edit_message_text(text, reply_markup=keyboard, parse_mode="Markdown")
-                else:
-                    stats["wins"] += 1
-                    # Ваш победитель
-                    winner_id = game_data['players'][winner]
-                    winner_name = game_data['usernames'].get(winner_id, str(winner_id))
-                    stats["top_players"][winner_name] = stats["top_players"].get(winner_name, 0) + 1
-                    # Подготовка текста с именем и эмодзи победителя
-                    theme_emojis = game_data['theme_emojis']
-                    winner_emoji = get_symbol_emoji(f"{winner}_win", theme_emojis)
-                    text = f"🏆 Победитель: {escape_markdown(winner_name, version=1)} {winner_emoji}! Поздравляем!"
-                    keyboard = get_keyboard(chat_id, combo)
-                    await query.edit_message_text(text, reply_markup=keyboard, parse_mode="Markdown")
-            else:
-                game_data['current_player'] = 'O' if symbol == 'X' else 'X'
-                # Если игра против ИИ, выполняем ход ИИ, иначе обновляем сообщение
-                if game_data.get('vs_ai'):
-                    await ai_move(query, context, chat_id)
-                else:
-                    await _restore_game_message(query, context, chat_id, theme_changed=False)
+    if action.isdigit():
+        # Ход проверяется и записывается сразу, до сетевых запросов (см. moves.py)
+        username = user.username or f"player_{user.id}"
+        move = await moves.commit_player_move(chat_id, user.id, username, int(action))
+        if isinstance(move, str):
+            await _answer(query, move, show_alert=True)
+            return
+        await _answer(query)
+        if game.vs_ai and not game.game_over:
+            # Отрисовка хода идёт параллельно с расчётом ответа ИИ
+            context.application.create_task(render_move(context, chat_id, move), update=update)
+            await ai_move(query, context, chat_id, move.version)
+        else:
+            await render_move(context, chat_id, move)
         return
 
-async def game_timeout(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик таймаута ожидания второго игрока."""
-    job = context.job.data
-    chat_id = job['chat_id']
-    if chat_id in games:
-        game_data = games[chat_id]
-        if not game_data.get('game_over') and not game_data['players'].get('O' if game_data['current_player']=='X' else 'X'):
-            await context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=job['message_id'],
-                text="⌛ Время вышло! Игра отменена.",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Новая игра", callback_data="new_game")]])
-            )
-            game_data['game_over'] = True
-            game_data['timeout_job'] = None
+async def _answer(query: telegram.CallbackQuery, text: Optional[str] = None, show_alert: bool = False) -> None:
+    """Ответ на callback (не больше одного на нажатие)"""
+    try:
+        await query.answer(text, show_alert=show_alert)
+    except telegram.error.BadRequest:
+        pass
+
+async def render_move(context: ContextTypes.DEFAULT_TYPE, chat_id: int, move: moves.MoveResult) -> None:
+    """Отрисовывает записанный ход: анимация, затем итоговое сообщение.
+
+    Если после хода игра изменилась, отрисовку продолжит следующий ход.
+    """
+    game = move.game
+    await message_editor.animate_move(context.bot, chat_id, move.message_id, move.keyboard,
+                                      move.cell, game.size, lambda: move.is_current)
+    if not move.is_current:
+        return
+    if move.winner == "Ничья":
+        # Отображаем сообщение о ничье с финальным полем
+        text = "🤝 Ничья!"
+        keyboard = get_keyboard(chat_id)
+        await message_editor.edit(context.bot, chat_id, move.message_id, text, keyboard, parse_mode="Markdown")
+    elif move.winner:
+        # Подготовка текста с именем и эмодзи победителя
+        winner_name = game.player(move.winner).username
+        winner_emoji = get_symbol_emoji(f"{move.winner}_win", game.emojis)
+        text = f"🏆 Победитель: {escape_markdown(winner_name, version=1)} {winner_emoji}! Поздравляем!"
+        keyboard = get_keyboard(chat_id, move.combo)
+        await message_editor.edit(context.bot, chat_id, move.message_id, text, keyboard, parse_mode="Markdown")
+    else:
+        text = get_status_text(chat_id, False)
+        await message_editor.edit(context.bot, chat_id, move.message_id, text, get_keyboard(chat_id), parse_mode="HTML")
+
+async def expire_game(bot: telegram.Bot, chat_id: int, data: Tuple[str, tuple]) -> None:
+    """Истёк таймаут игры (timing_wheel): соперник не пришёл или игрок не сходил вовремя."""
+    kind, token = data
+    await games.refresh(chat_id)
+    game = games.get(chat_id)
+    # Таймаут устарел: игра завершена, заменена или в ней был ход
+    if game is None or game.game_over or moves.timeout_token(game) != token:
+        return
+    game.game_over = True
+    try:
+        games.save(chat_id)
+        await games.committed(chat_id)
+    except StaleGameError:
+        return
+    if kind == "join":
+        event_log.record_game(chat_id, game, "cancelled")
+        text = "⌛ Время вышло! Игра отменена."
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Новая игра", callback_data="g:new")]])
+    else:
+        # Не сходивший вовремя игрок проигрывает
+        loser = game.player(game.current_player)
+        winner = game.player('O' if game.current_player == 'X' else 'X')
+        record_result(chat_id, winner.username)
+        ratings.apply(event_log.record_game(chat_id, game, "timeout", winner.symbol))
+        winner_emoji = get_symbol_emoji(f"{winner.symbol}_win", game.emojis)
+        text = (f"⌛ {escape_markdown(loser.username, version=1)} не сделал ход вовремя.\n"
+                f"🏆 Победитель: {escape_markdown(winner.username, version=1)} {winner_emoji}!")
+        keyboard = get_keyboard(chat_id)
+    logger.info("Timeout (%s) in chat %s", kind, chat_id)
+    await message_editor.edit(bot, chat_id, game.message_id, text, keyboard, parse_mode="Markdown")
+
+async def sweep_games(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Периодическая очистка завершённых и брошенных игр."""
+    removed = games.sweep()
+    if removed:
+        logger.info("Удалено игр: %s, осталось: %s", removed, len(games))
+    await games.purge()
 
 async def _restore_game_message(query: telegram.CallbackQuery, context: ContextTypes.DEFAULT_TYPE, chat_id: int, theme_changed: bool) -> None:
     """Восстанавливает сообщение об игре при смене темы или ходе."""
-    game_data = games[chat_id]
-    emojis = game_data['theme_emojis']
-    title = "🎨 Тема изменена! 🎨\n\n" if theme_changed else ""
-    # Динамическое отображение игроков с VIP-аватарами в порядке подключения
-    lines: List[str] = []
-    for uid, sym in game_data['user_symbols'].items():
-        avatar = get_avatar(uid)
-        name = game_data['usernames'].get(uid, str(uid))
-        sym_emoji = get_symbol_emoji(sym, emojis)
-        lines.append(f"👤 {avatar} {sym_emoji}: <i>{escape_markdown(name, version=1)}</i>")
-    current = game_data['current_player']
-    current_emoji = get_symbol_emoji(current, emojis)
-    text = (
-        f"{title}<b>🔄 ИГРА В ПРОЦЕССЕ</b> 🔄\n"
-        "────────────────\n"
-        + "\n".join(lines) + "\n"
-        "────────────────\n"
-        f"➡️ <b>Ходит: {current_emoji}</b>"
-    )
-    try:
-        await query.edit_message_text(text, reply_markup=get_keyboard(chat_id), parse_mode="HTML")
-    except telegram.error.RetryAfter as e:
-        await asyncio.sleep(e.retry_after)
-        await query.edit_message_text(text, reply_markup=get_keyboard(chat_id), parse_mode="HTML")
-    except Exception:
-        pass
+    # Игроки с VIP-аватарами в порядке подключения; текст и клавиатура берутся из кэша
+    text = get_status_text(chat_id, theme_changed)
+    keyboard = get_keyboard(chat_id)
+    message_id = games[chat_id].message_id or query.message.message_id
+    await message_editor.edit(context.bot, chat_id, message_id, text, keyboard, parse_mode="HTML")
 
 # Handler objects
 start_handler = CommandHandler("start", start)
 new_game_handler = CommandHandler("newgame", new_game)
-button_click_handler = CallbackQueryHandler(button_click, pattern=r"^(noop|[0-8]|new_game)$") 
\ No newline at end of file
+# Callback-маршруты (см. callback_router.py)
+callback_routes = {
+    "n": noop_click,
+    "g": button_click,
+} 
\ No newline at end of file
@@ -0,0 +1,127 @@
+"""
+Рейтинги игроков: общий (/top) и по чату (/chatstats), листание страниц кнопками;
+рейтинг Эло (/rating, см. ratings.py).
+
+Кнопка «Дальше» несёт курсор — счёт и имя последней показанной строки
+(lb:<g|c>:<победы>:<имя>), поэтому страница строится бисекцией без сортировки
+и не съезжает, если счёт игроков выше успел измениться.
+"""
+from typing import List, Optional, Tuple
+
+import telegram
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.ext import ContextTypes, CommandHandler
+
+from config import LEADERBOARD_PAGE_SIZE
+from game_state import chat_stats, chat_leaderboard, global_leaderboard
+from leaderboard import Cursor, Leaderboard
+from ratings import ratings
+from vip import is_vip_by_username, VIP_ICON
+
+# Ограничение Telegram на callback_data
+_CALLBACK_DATA_LIMIT = 64
+
+
+def _page(board: Leaderboard, after: Optional[Cursor]) -> Tuple[List[str], Optional[Cursor]]:
+    """Строки страницы после курсора и курсор следующей страницы (если она есть)"""
+    rows = board.page(LEADERBOARD_PAGE_SIZE + 1, after)
+    more = len(rows) > LEADERBOARD_PAGE_SIZE
+    rows = rows[:LEADERBOARD_PAGE_SIZE]
+    if not rows:
+        return [], None
+    first = board.rank(rows[0][0])
+    lines = []
+    for place, (name, wins) in enumerate(rows, first):
+        vip_marker = VIP_ICON if is_vip_by_username(name) else ""
+        lines.append(f"{place}. {name}{vip_marker}: {wins}")
+    last_name, last_wins = rows[-1]
+    return lines, ((last_wins, last_name) if more else None)
+
+
+def leaderboard_message(scope: str, chat_id: int,
+                        after: Optional[Cursor] = None) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Текст и кнопки страницы рейтинга: scope "g" — общий, "c" — чата chat_id"""
+    if scope == "c":
+        stats = chat_stats.get(chat_id) or {}
+        text = [f'📊 Статистика для чата {chat_id}:',
+                f"Всего игр: {stats.get('games', 0)}",
+                f"Побед: {stats.get('wins', 0)}",
+                f"Ничьих: {stats.get('draws', 0)}"]
+        board = chat_leaderboard(chat_id)
+    else:
+        text = [f"🏆 Общий рейтинг ({len(global_leaderboard)} игроков):"]
+        board = global_leaderboard
+    lines, next_cursor = _page(board, after)
+    if lines:
+        text.append('Топ по победам:')
+        text.extend(lines)
+    elif after is not None:
+        text.append('Дальше никого нет.')
+    buttons = []
+    if after is not None:
+        buttons.append(InlineKeyboardButton("⏮ В начало", callback_data=f"lb:{scope}"))
+    if next_cursor is not None:
+        data = f"lb:{scope}:{next_cursor[0]}:{next_cursor[1]}"
+        if len(data.encode()) <= _CALLBACK_DATA_LIMIT:
+            buttons.append(InlineKeyboardButton("▶️ Дальше", callback_data=data))
+    return "\n".join(text), (InlineKeyboardMarkup([buttons]) if buttons else None)
+
+
+async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /top - общий рейтинг по всем чатам."""
+    text, markup = leaderboard_message("g", update.effective_chat.id)
+    await update.message.reply_text(text, reply_markup=markup)
+
+
+async def rating_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /rating - рейтинг Эло игрока и лучшие по рейтингу."""
+    user_id = update.effective_user.id
+    text = []
+    entry = ratings.players.get(user_id)
+    if entry:
+        text.append(f"⭐ Ваш рейтинг: {entry[0]:.0f} (игр: {entry[1]})")
+    else:
+        text.append(f"⭐ Ваш рейтинг: {ratings.initial:.0f} (ещё нет игр с людьми)")
+    ai_record = ratings.ai_games.get(user_id)
+    if ai_record:
+        played, wins, losses, draws = ai_record
+        text.append(f"🤖 Против ИИ: {played} игр, побед {wins}, поражений {losses}, ничьих {draws}")
+    best = ratings.top(LEADERBOARD_PAGE_SIZE)
+    if best:
+        text.append('Лучшие по рейтингу:')
+        for place, (player_id, rating, played) in enumerate(best, 1):
+            name = ratings.names.get(player_id, str(player_id))
+            vip_marker = VIP_ICON if is_vip_by_username(name) else ""
+            text.append(f"{place}. {name}{vip_marker}: {rating:.0f} ({played})")
+    await update.message.reply_text("\n".join(text))
+
+
+async def leaderboard_page(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str) -> None:
+    """Листание рейтинга: arg — "<g|c>[:<победы>:<имя>]"."""
+    query = update.callback_query
+    scope, _, cursor = arg.partition(":")
+    if scope == "c" and update.effective_user.username != 'sadea12':
+        await query.answer('⛔ Только владелец может использовать эту команду.', show_alert=True)
+        return
+    after = None
+    if cursor:
+        wins, _, name = cursor.partition(":")
+        if not wins.isdigit():
+            await query.answer()
+            return
+        after = (int(wins), name)
+    await query.answer()
+    text, markup = leaderboard_message(scope, update.effective_chat.id, after)
+    try:
+        await query.edit_message_text(text, reply_markup=markup)
+    except telegram.error.BadRequest:
+        pass
+
+
+# Handler objects
+top_handler = CommandHandler('top', top_command)
+rating_handler = CommandHandler('rating', rating_command)
+# Callback-маршруты (см. callback_router.py)
+callback_routes = {
+    "lb": leaderboard_page,
+}
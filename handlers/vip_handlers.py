@@ -1,5 +1,6 @@
 # handlers/vip_handlers.py
 
+import logging
 import os
 import asyncio
 from telegram import Update, Message
@@ -7,7 +8,8 @@ from telegram.ext import ContextTypes, CommandHandler
 from aiosend import CryptoPay
 from aiosend.types import Invoice
 from vip import add_vip, set_avatar, get_avatar, is_vip, set_signature, get_signature, set_symbol, remove_vip
-from config import logger
+
+logger = logging.getLogger(__name__)
 
 # Инициализация CryptoPay
 CRYPTO_TOKEN = os.getenv("CRYPTO_TOKEN")
@@ -0,0 +1,123 @@
+# ingress.py
+"""
+Быстрый разбор входящих вебхуков.
+
+Тело запроса декодируется из байтов (orjson, если установлен, иначе json), и до
+построения полного Update выполняется «подглядывание» в сырой словарь: тип
+обновления, callback_data, chat_id, message_id. Тривиальные нажатия игровых
+кнопок обрабатываются прямо здесь и не доходят до очереди обновлений:
+    - noop на актуальном сообщении игры — только ответ на callback;
+    - нажатие на сообщении старой игры — ответ «Старая игра» и снятие клавиатуры;
+    - нажатие забаненного пользователя — ответ «Вы забанены».
+Ответы уходят фоновыми задачами, вебхук отвечает Telegram сразу.
+
+Если задан WEBHOOK_SECRET_TOKEN, заголовок X-Telegram-Bot-Api-Secret-Token
+проверяется до чтения тела, и посторонние POST-запросы почти ничего не стоят.
+"""
+import hmac
+import json
+from typing import Any, Optional
+
+from telegram.ext import Application
+
+import message_editor
+from callback_router import parse as parse_callback
+from config import WEBHOOK_SECRET_TOKEN, METRICS_TOKEN
+from game_state import games, banned_users
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость
+    orjson = None
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+METRICS_HEADER = "X-Metrics-Token"
+
+# Маршруты игровых кнопок (см. callback_router.py)
+GAME_ROUTES = ("g", "n")
+
+stats = {"received": 0, "bad_secret": 0, "invalid": 0, "noop": 0, "stale": 0, "banned": 0, "metrics_denied": 0}
+
+
+def check_secret(header: Optional[str]) -> bool:
+    """Проверяет секретный токен вебхука (без токена проверка отключена)"""
+    if not WEBHOOK_SECRET_TOKEN:
+        return True
+    if header is not None and hmac.compare_digest(header, WEBHOOK_SECRET_TOKEN):
+        return True
+    stats["bad_secret"] += 1
+    return False
+
+
+def check_metrics(header: Optional[str], client_host: Optional[str]) -> bool:
+    """Доступ к /metrics: по METRICS_TOKEN, а без токена — только с localhost"""
+    if METRICS_TOKEN:
+        allowed = header is not None and hmac.compare_digest(header, METRICS_TOKEN)
+    else:
+        allowed = client_host in ("127.0.0.1", "::1")
+    if not allowed:
+        stats["metrics_denied"] += 1
+    return allowed
+
+
+def decode(body: bytes) -> Optional[dict]:
+    """Декодирует тело вебхука; None — не JSON-объект обновления"""
+    stats["received"] += 1
+    try:
+        data = orjson.loads(body) if orjson is not None else json.loads(body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or "update_id" not in data:
+        stats["invalid"] += 1
+        return None
+    return data
+
+
+def _is_banned(user: dict) -> bool:
+    return str(user.get("id")) in banned_users or user.get("username") in banned_users
+
+
+def _answer(application: Application, query_id: str, text: Optional[str] = None, show_alert: bool = False) -> None:
+    application.create_task(application.bot.answer_callback_query(query_id, text=text, show_alert=show_alert))
+
+
+def handle_early(data: dict, application: Application) -> bool:
+    """Обрабатывает тривиальные обновления без построения Update.
+
+    Возвращает True, если обновление обработано и дальше его передавать не нужно.
+    """
+    query: Any = data.get("callback_query")
+    if not isinstance(query, dict):
+        return False
+    callback_data = query.get("data")
+    message = query.get("message")
+    if not isinstance(callback_data, str) or not isinstance(message, dict):
+        return False
+    route, _ = parse_callback(callback_data)
+    if route not in GAME_ROUTES:
+        return False
+
+    if _is_banned(query.get("from") or {}):
+        stats["banned"] += 1
+        _answer(application, query["id"], "⛔ Вы забанены и не можете играть.", show_alert=True)
+        return True
+
+    # С общим хранилищем игра в памяти может быть устаревшей, а читать хранилище
+    # в запросе вебхука нельзя — такие нажатия идут обычным путём (через очередь)
+    if games.shared:
+        return False
+    chat_id = (message.get("chat") or {}).get("id")
+    game = games.get(chat_id)
+    if game is None:
+        return False
+    message_id = message.get("message_id")
+    if message_id and message_id != game.message_id:
+        stats["stale"] += 1
+        _answer(application, query["id"], "Старая игра. Начните новую.", show_alert=True)
+        application.create_task(message_editor.edit(application.bot, chat_id, message_id, reply_markup=None))
+        return True
+    if route == "n":
+        stats["noop"] += 1
+        _answer(application, query["id"])
+        return True
+    return False
@@ -0,0 +1,70 @@
+# leaderboard.py
+"""
+Рейтинги игроков по числу побед.
+
+Leaderboard хранит счёт игрока в словаре и ключи (-побед, имя) в отсортированном
+списке. Изменение счёта — два поиска bisect (O(log n)) и сдвиг хвоста списка
+(memmove в C, на порядки дешевле полной сортировки); чтение верхних K — срез
+без сортировки. Порядок однозначный: при равном счёте — по имени.
+
+Страницы отдаются по курсору (счёт и имя последней строки предыдущей страницы):
+следующая страница начинается строго после курсора, поэтому изменения счёта
+у игроков выше не сдвигают и не дублируют строки при листании.
+"""
+import bisect
+from typing import Dict, List, Optional, Tuple
+
+Cursor = Tuple[int, str]
+
+
+class Leaderboard:
+    """Игроки, упорядоченные по убыванию побед"""
+
+    __slots__ = ("_scores", "_order")
+
+    def __init__(self) -> None:
+        self._scores: Dict[str, int] = {}
+        self._order: List[Tuple[int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def items(self):
+        """Пары (имя, победы) без порядка"""
+        return self._scores.items()
+
+    def score(self, name: str) -> int:
+        return self._scores.get(name, 0)
+
+    def add(self, name: str, delta: int = 1) -> int:
+        """Меняет счёт игрока на delta; возвращает новый счёт"""
+        return self.set(name, self._scores.get(name, 0) + delta)
+
+    def set(self, name: str, wins: int) -> int:
+        old = self._scores.get(name, 0)
+        if old == wins:
+            return wins
+        if old:
+            index = bisect.bisect_left(self._order, (-old, name))
+            del self._order[index]
+        if wins > 0:
+            self._scores[name] = wins
+            bisect.insort(self._order, (-wins, name))
+        else:
+            self._scores.pop(name, None)
+        return wins
+
+    def top(self, limit: int, offset: int = 0) -> List[Tuple[str, int]]:
+        return [(name, -neg) for neg, name in self._order[offset:offset + limit]]
+
+    def page(self, limit: int, after: Optional[Cursor] = None) -> List[Tuple[str, int]]:
+        """Страница после курсора (wins, name); без курсора — начало рейтинга"""
+        start = 0 if after is None else bisect.bisect_right(self._order, (-after[0], after[1]))
+        return [(name, -neg) for neg, name in self._order[start:start + limit]]
+
+    def rank(self, name: str) -> Optional[int]:
+        """Место игрока (с 1) или None"""
+        wins = self._scores.get(name)
+        if wins is None:
+            return None
+        return bisect.bisect_left(self._order, (-wins, name)) + 1
@@ -0,0 +1,136 @@
+# log_setup.py
+"""
+Настройка логирования из переменных окружения.
+
+    LOG_LEVEL        — уровень корневого логгера (по умолчанию INFO)
+    LOG_LEVELS       — уровни по модулям: "game_logic=DEBUG,handlers=INFO,httpx=WARNING"
+    LOG_JSON         — 1, чтобы писать записи в JSON (по одной на строку)
+    LOG_ASYNC        — 1 (по умолчанию): запись в stdout идёт из отдельного потока
+                       через QueueHandler/QueueListener и не блокирует обработчики
+    LOG_RATE_LIMIT   — сколько записей уровня ниже WARNING пропускать с одного места
+                       вызова за LOG_RATE_INTERVAL секунд (0 — без ограничения)
+
+Модуль не импортирует config, чтобы config мог вызвать setup_logging() первым делом.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from typing import Dict, Optional, Tuple
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            data["suppressed"] = suppressed
+        return json.dumps(data, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """Ограничивает частоту повторяющихся записей ниже WARNING.
+
+    Ключ — место вызова (логгер, файл, строка), а не текст сообщения, поэтому
+    число окон ограничено числом вызовов logger в коде; истёкшие окна
+    удаляются раз в интервал. Сообщения всё равно лучше писать в %-стиле:
+    тогда отброшенная запись не форматируется. Первая пропущенная после окна
+    запись получает атрибут suppressed с числом отброшенных.
+    """
+
+    def __init__(self, limit: int, interval: float) -> None:
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        # ключ -> (начало окна, записей в окне, отброшено)
+        self._windows: Dict[Tuple[str, str, int], Tuple[float, int, int]] = {}
+        self._next_sweep = time.monotonic() + interval
+
+    def _sweep(self, now: float) -> None:
+        self._next_sweep = now + self.interval
+        # Окна с отброшенными записями ждут следующей записи с того же места — для отчёта
+        expired = [key for key, (start, _, dropped) in self._windows.items()
+                   if now - start >= self.interval and not dropped]
+        for key in expired:
+            del self._windows[key]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.limit <= 0:
+            return True
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+        key = (record.name, record.pathname, record.lineno)
+        start, count, dropped = self._windows.get(key, (now, 0, 0))
+        if now - start >= self.interval:
+            if dropped:
+                record.suppressed = dropped
+                record.msg = f"{record.msg} (+{dropped} suppressed)"
+            start, count, dropped = now, 0, 0
+        if count >= self.limit:
+            self._windows[key] = (start, count, dropped + 1)
+            return False
+        self._windows[key] = (start, count + 1, dropped)
+        return True
+
+
+def _parse_levels(spec: str) -> Dict[str, int]:
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.strip().partition("=")
+        if name and level:
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return {name: level for name, level in levels.items() if isinstance(level, int)}
+
+
+def setup_logging() -> None:
+    """Настраивает корневой логгер (идемпотентно)"""
+    global _listener
+    root = logging.getLogger()
+    if getattr(root, "_bot_logging_configured", False):
+        return
+    root._bot_logging_configured = True
+
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    for name, level in _parse_levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
+
+    stream = logging.StreamHandler(sys.stdout)
+    if os.getenv("LOG_JSON", "0") == "1":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    if os.getenv("LOG_ASYNC", "1") == "1":
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        handler: logging.Handler = logging.handlers.QueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+    else:
+        handler = stream
+
+    rate_limit = int(os.getenv("LOG_RATE_LIMIT", "20"))
+    if rate_limit > 0:
+        handler.addFilter(RateLimitFilter(rate_limit, float(os.getenv("LOG_RATE_INTERVAL", "60"))))
+
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
@@ -1,48 +1,125 @@
+import logging
 import asyncio
 import uvicorn
 from fastapi import FastAPI, Request, Response
 from http import HTTPStatus
 
 from telegram import Update, BotCommand
-from telegram.ext import Application, JobQueue, ContextTypes
+from telegram.ext import Application, ExtBot, JobQueue, ContextTypes
 
-from config import TOKEN, WEBHOOK_ENDPOINT_URL, WEBHOOK_PATH, PORT, logger
+from config import (
+    TOKEN, WEBHOOK_ENDPOINT_URL, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN, PORT,
+    BOT_API_POOL_SIZE, BOT_API_BACKGROUND_POOL_SIZE, GAME_SWEEP_INTERVAL_SECONDS, STATE_SYNC_INTERVAL_SECONDS,
+    EVENT_ROLLUP_INTERVAL_SECONDS, RATINGS_SAVE_INTERVAL_SECONDS
+)
 import handlers.game_handlers as game_handlers
 import handlers.theme_handlers as theme_handlers
 import handlers.admin_handlers as admin_handlers
 import handlers.admin_panel_handlers as admin_panel_handlers
 import handlers.ai_handlers as ai_handlers
 import handlers.vip_handlers as vip_handlers
+import handlers.leaderboard_handlers as leaderboard_handlers
+from ai_executor import ai_executor
+from game_logic import keyboard_cache, status_cache
+from game_state import games, banned_users, chat_stats, rebuild_leaderboards
+from bot_state import all_chats
+from storage import storage
+from state_backend import StaleGameError
+import message_editor
+from rate_limiter import rate_limiter
+import broadcast
+from update_dispatcher import update_dispatcher
+import ingress
+import moves
+from timing_wheel import game_timeouts
+from event_log import event_log
+from ratings import ratings
+from vip import vip_writer
+from callback_router import callback_router
+import transport
+
+logger = logging.getLogger(__name__)
 
 fastapi_app = FastAPI()
 
+@fastapi_app.get("/metrics")
+async def metrics(request: Request):
+    """Внутренние метрики бота в JSON (токен METRICS_TOKEN или запрос с localhost)"""
+    client_host = request.client.host if request.client else None
+    if not ingress.check_metrics(request.headers.get(ingress.METRICS_HEADER), client_host):
+        return Response(status_code=HTTPStatus.FORBIDDEN)
+    return {
+        "games": games.stats(),
+        "storage": storage.stats(),
+        "ai_executor": ai_executor.stats(),
+        "render_cache": {"keyboards": keyboard_cache.stats(), "status": status_cache.stats()},
+        "message_edits": message_editor.stats,
+        "rate_limiter": rate_limiter.stats(),
+        "broadcast": broadcast.stats(),
+        "ingress": ingress.stats,
+        "moves": moves.stats,
+        "timeouts": game_timeouts.stats(),
+        "event_log": event_log.stats(),
+        "ratings": ratings.stats(),
+        "vip": vip_writer.stats(),
+        "updates": update_dispatcher.stats(),
+        "callbacks": callback_router.stats(),
+        "bot_api": transport.stats(),
+    }
+
 async def handle_telegram_update(request: Request, application: Application):
-    body = await request.json()
-    update = Update.de_json(body, application.bot)
-    await application.process_update(update)
+    # Посторонние запросы отсекаем до чтения тела
+    if not ingress.check_secret(request.headers.get(ingress.SECRET_HEADER)):
+        return Response(status_code=HTTPStatus.FORBIDDEN)
+    data = ingress.decode(await request.body())
+    if data is None:
+        return Response(status_code=HTTPStatus.BAD_REQUEST)
+    # noop, старые сообщения и забаненные обрабатываются без построения Update
+    if ingress.handle_early(data, application):
+        return Response(status_code=HTTPStatus.OK)
+    update = Update.de_json(data, application.bot)
+    # Отвечаем сразу: обработка идёт в пуле воркеров (по порядку внутри чата)
+    if not update_dispatcher.submit(update):
+        if not update_dispatcher.closing:
+            logger.warning("Очередь обновлений переполнена, Telegram повторит доставку")
+        return Response(status_code=HTTPStatus.SERVICE_UNAVAILABLE)
     return Response(status_code=HTTPStatus.OK)
 
 async def main() -> None:
     if not TOKEN:
         logger.critical("TOKEN не задан")
         return
+    # Состояние из хранилища (STATE_BACKEND): баны, статистика, чаты; игры поднимаются по требованию
+    storage.open()
+    storage.load(games, banned_users, chat_stats, all_chats)
+    rebuild_leaderboards()
+    # Запускаем пул для ходов ИИ; воркеры заранее решают все позиции 3x3
+    ai_executor.start()
     job_queue = JobQueue()
-    app = Application.builder().token(TOKEN).job_queue(job_queue).build()
+    # Все исходящие запросы проходят через общий ограничитель (ведра токенов, RetryAfter)
+    # Отдельные пулы соединений для обработчиков и для фоновых заданий (рассылок)
+    app = (
+        Application.builder().token(TOKEN).job_queue(job_queue).rate_limiter(rate_limiter)
+        .request(transport.build_request("interactive", BOT_API_POOL_SIZE))
+        .build()
+    )
+    background_bot = ExtBot(TOKEN, request=transport.build_request("background", BOT_API_BACKGROUND_POOL_SIZE),
+                            rate_limiter=rate_limiter)
+    app.bot_data['background_bot'] = background_bot
 
     # Регистрируем обработчики
     app.add_handler(game_handlers.start_handler)
     app.add_handler(game_handlers.new_game_handler)
-    app.add_handler(game_handlers.button_click_handler)
     app.add_handler(theme_handlers.themes_handler)
-    app.add_handler(theme_handlers.select_theme_handler)
-    app.add_handler(theme_handlers.change_theme_prompt_handler)
-    app.add_handler(theme_handlers.select_theme_ingame_handler)
-    app.add_handler(theme_handlers.cancel_theme_change_handler)
     app.add_handler(admin_handlers.reset_game_handler)
     app.add_handler(admin_handlers.reset_handler)
     app.add_handler(admin_handlers.ban_user_handler)
     app.add_handler(admin_handlers.unban_user_handler)
     app.add_handler(admin_handlers.chat_stats_handler)
+    app.add_handler(admin_handlers.analytics_handler)
+    app.add_handler(admin_handlers.rerate_handler)
+    app.add_handler(leaderboard_handlers.top_handler)
+    app.add_handler(leaderboard_handlers.rating_handler)
     app.add_handler(ai_handlers.play_ai_handler)
     app.add_handler(vip_handlers.vip_handler)
     app.add_handler(vip_handlers.setavatar_handler)
@@ -52,7 +129,12 @@ async def main() -> None:
     app.add_handler(vip_handlers.setsymbol_handler)
     app.add_handler(vip_handlers.viphelp_handler)
     app.add_handler(admin_panel_handlers.admin_panel_handler)
-    app.add_handler(admin_panel_handlers.admin_callback_handler)
+
+    # Все callback-запросы — один обработчик с таблицей маршрутов по префиксу
+    for module in (game_handlers, theme_handlers, admin_panel_handlers, leaderboard_handlers):
+        for route, callback in module.callback_routes.items():
+            callback_router.add(route, callback)
+    app.add_handler(callback_router.handler)
 
     # Регистрируем команды
     commands = [
@@ -65,6 +147,10 @@ async def main() -> None:
         BotCommand("ban", "🚫 Бан пользователя"),
         BotCommand("unban", "✅ Разбан пользователя"),
         BotCommand("chatstats", "📊 Статистика по чату"),
+        BotCommand("top", "🏆 Общий рейтинг игроков"),
+        BotCommand("rating", "⭐ Рейтинг Эло"),
+        BotCommand("analytics", "📈 Аналитика игр"),
+        BotCommand("rerate", "🔁 Пересчитать рейтинги"),
         BotCommand("vip", "💎 Получить VIP-подписку"),
         BotCommand("setavatar", "👤 Установить аватар VIP"),
         BotCommand("setsignature", "✍️ Установить подпись VIP"),
@@ -75,17 +161,28 @@ async def main() -> None:
         BotCommand("admin", "👑 Открыть админ‑панель"),
     ]
     await app.initialize()
+    await background_bot.initialize()
     await app.bot.set_my_commands(commands)
 
     # Вебхук
     if WEBHOOK_ENDPOINT_URL:
-        await app.bot.set_webhook(url=WEBHOOK_ENDPOINT_URL, allowed_updates=Update.ALL_TYPES)
+        await app.bot.set_webhook(url=WEBHOOK_ENDPOINT_URL, allowed_updates=Update.ALL_TYPES,
+                                  secret_token=WEBHOOK_SECRET_TOKEN)
         async def webhook(request: Request):
             return await handle_telegram_update(request, app)
         fastapi_app.add_api_route(WEBHOOK_PATH, webhook, methods=["POST"])
 
     # Глобальный обработчик ошибок для логирования и уведомления пользователя
     async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if isinstance(context.error, StaleGameError):
+            # Игру одновременно изменил другой процесс бота — ход не записан
+            logger.info("Конфликт версии игры в чате %s", context.error)
+            if isinstance(update, Update) and update.callback_query:
+                try:
+                    await update.callback_query.answer("Игра уже изменилась, попробуйте ещё раз")
+                except Exception:
+                    pass
+            return
         logger.exception("Произошла ошибка при обработке обновления", exc_info=context.error)
         if isinstance(update, Update) and update.effective_message:
             try:
@@ -94,12 +191,55 @@ async def main() -> None:
                 pass
     app.add_error_handler(error_handler)
 
+    # Фоновая очистка завершённых и брошенных игр
+    job_queue.run_repeating(game_handlers.sweep_games, interval=GAME_SWEEP_INTERVAL_SECONDS,
+                            first=GAME_SWEEP_INTERVAL_SECONDS)
+    # Свёртка журнала игр в агрегаты для аналитики (первая — сразу после старта)
+    async def rollup_events(context: ContextTypes.DEFAULT_TYPE) -> None:
+        await event_log.rollup()
+    job_queue.run_repeating(rollup_events, interval=EVENT_ROLLUP_INTERVAL_SECONDS, first=1)
+    # Сохранение рейтингов Эло (только если менялись)
+    async def save_ratings(context: ContextTypes.DEFAULT_TYPE) -> None:
+        await ratings.save()
+    job_queue.run_repeating(save_ratings, interval=RATINGS_SAVE_INTERVAL_SECONDS,
+                            first=RATINGS_SAVE_INTERVAL_SECONDS)
+    if storage.shared:
+        # Баны и чаты, изменённые другими процессами, и их игры в журнале — в рейтинги
+        async def sync_shared_state(context: ContextTypes.DEFAULT_TYPE) -> None:
+            await storage.refresh(banned_users, all_chats)
+            await ratings.follow()
+        job_queue.run_repeating(sync_shared_state, interval=STATE_SYNC_INTERVAL_SECONDS,
+                                first=STATE_SYNC_INTERVAL_SECONDS)
+
     # Запуск сервера
     config = uvicorn.Config(app=fastapi_app, host="0.0.0.0", port=PORT)
     server = uvicorn.Server(config)
     await app.start()
+    update_dispatcher.start(app)
+    # Таймауты ожидания соперника и ходов (см. timing_wheel.py)
+    game_timeouts.start(lambda chat_id, data: game_handlers.expire_game(app.bot, chat_id, data))
+    storage.start()
+    event_log.start()
+    vip_writer.start()
+    ratings.shared = storage.shared
+    # Без сохранённых рейтингов — пересчёт по журналу игр
+    if not ratings.load():
+        app.create_task(ratings.recompute())
+    # Продолжаем рассылку, прерванную перезапуском
+    broadcast.load_state()
+    if broadcast.job:
+        logger.info("Возобновляем прерванную рассылку")
+        app.create_task(broadcast.run(background_bot))
     await server.serve()
+    await update_dispatcher.shutdown()
+    await game_timeouts.shutdown()
     await app.stop()
+    await storage.close()
+    await event_log.close()
+    await ratings.save()
+    await vip_writer.close()
+    await background_bot.shutdown()
+    ai_executor.shutdown()
     
 if __name__ == "__main__":
     try:
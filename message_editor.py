@@ -0,0 +1,130 @@
+# message_editor.py
+"""
+Склейка и дедупликация правок игровых сообщений.
+
+Для каждого сообщения (chat_id, message_id) хранится последнее отправленное
+состояние (текст + клавиатура) и последнее желаемое. Правка, совпадающая с уже
+отправленным, не уходит в Bot API; если правка уже в полёте, новые запросы только
+обновляют желаемое состояние, и после ответа уходит один запрос с последним из них.
+Поэтому все правки игровых сообщений должны идти через edit(), иначе сохранённое
+состояние разойдётся с тем, что видит пользователь.
+
+Анимация хода настраивается через ANIMATION_MODE:
+    full   — два кадра (⏳, ⌛️) с паузой ANIMATION_FRAME_DELAY;
+    single — один кадр без паузы;
+    off    — без анимации, только итоговая правка.
+"""
+import asyncio
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+import telegram
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import ANIMATION_MODE, ANIMATION_FRAME_DELAY, RENDER_CACHE_SIZE
+from render_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+ANIMATION_FRAMES = {
+    "full": ("⏳", "⌛️"),
+    "single": ("⏳",),
+    "off": (),
+}
+
+# Последнее отправленное состояние по сообщению (ограничено, старые вытесняются)
+_last_sent = LRUCache(RENDER_CACHE_SIZE)
+# Желаемое состояние для сообщений, по которым сейчас идёт запрос
+_pending: Dict[Tuple[int, int], Tuple[Optional[str], Optional[InlineKeyboardMarkup], Optional[str]]] = {}
+_in_flight: set = set()
+
+stats = {"requested": 0, "sent": 0, "duplicates": 0, "coalesced": 0, "not_modified": 0, "errors": 0}
+
+
+async def edit(bot: Bot, chat_id: int, message_id: int, text: Optional[str] = None,
+               reply_markup: Optional[InlineKeyboardMarkup] = None,
+               parse_mode: Optional[str] = None) -> None:
+    """Запрашивает правку сообщения. Без text меняется только клавиатура."""
+    key = (chat_id, message_id)
+    stats["requested"] += 1
+    if key in _in_flight:
+        pending = _pending.get(key)
+        if pending is not None:
+            stats["coalesced"] += 1
+            if text is None:
+                # Правка только клавиатуры не отменяет ещё не отправленный текст
+                text, parse_mode = pending[0], pending[2]
+        # Предыдущая правка ещё в полёте — она отправит последнее желаемое состояние
+        _pending[key] = (text, reply_markup, parse_mode)
+        return
+
+    _in_flight.add(key)
+    try:
+        desired = (text, reply_markup, parse_mode)
+        while desired is not None:
+            await _send(bot, key, *desired)
+            desired = _pending.pop(key, None)
+    finally:
+        _in_flight.discard(key)
+
+
+async def _send(bot: Bot, key: Tuple[int, int], text: Optional[str],
+                reply_markup: Optional[InlineKeyboardMarkup], parse_mode: Optional[str]) -> None:
+    last = _last_sent.get(key)
+    if last is not None:
+        last_text, last_markup = last
+        if (text is None or text == last_text) and reply_markup == last_markup:
+            stats["duplicates"] += 1
+            return
+    chat_id, message_id = key
+    try:
+        if text is None:
+            await bot.edit_message_reply_markup(chat_id, message_id, reply_markup=reply_markup)
+        else:
+            await bot.edit_message_text(text, chat_id, message_id, reply_markup=reply_markup, parse_mode=parse_mode)
+        stats["sent"] += 1
+    except telegram.error.RetryAfter as e:
+        # Повторы после RetryAfter делает rate_limiter; сюда доходит, только если они исчерпаны
+        stats["errors"] += 1
+        logger.warning("Edit of message %s in chat %s dropped after flood control: %s", message_id, chat_id, e)
+        return
+    except telegram.error.BadRequest as e:
+        if "not modified" not in str(e).lower():
+            stats["errors"] += 1
+            logger.warning("Edit of message %s in chat %s failed: %s", message_id, chat_id, e)
+            return
+        stats["not_modified"] += 1
+    new_text = text if text is not None else (last[0] if last else None)
+    _last_sent.put(key, (new_text, reply_markup))
+
+
+def animation_frames(keyboard: InlineKeyboardMarkup, cell: int, size: int):
+    """Клавиатуры-кадры анимации хода в клетку cell согласно ANIMATION_MODE"""
+    row, col = divmod(cell, size)
+    for frame in ANIMATION_FRAMES.get(ANIMATION_MODE, ANIMATION_FRAMES["full"]):
+        animated_keyboard = []
+        for r_i, row_buttons in enumerate(keyboard.inline_keyboard):
+            if r_i != row:
+                animated_keyboard.append(row_buttons)
+                continue
+            new_row = list(row_buttons)
+            new_row[col] = InlineKeyboardButton(frame, callback_data="n")
+            animated_keyboard.append(new_row)
+        yield InlineKeyboardMarkup(animated_keyboard)
+
+
+async def animate_move(bot: Bot, chat_id: int, message_id: int,
+                       keyboard: InlineKeyboardMarkup, cell: int, size: int,
+                       is_current: Optional[Callable[[], bool]] = None) -> None:
+    """Проигрывает анимацию хода (см. ANIMATION_MODE).
+
+    is_current — проверка перед каждым кадром: если игра уже изменилась,
+    устаревшие кадры не отправляются.
+    """
+    frames = list(animation_frames(keyboard, cell, size))
+    for frame in frames:
+        if is_current is not None and not is_current():
+            return
+        await edit(bot, chat_id, message_id, reply_markup=frame)
+        if len(frames) > 1 and ANIMATION_FRAME_DELAY > 0:
+            await asyncio.sleep(ANIMATION_FRAME_DELAY)
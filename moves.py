@@ -0,0 +1,147 @@
+# moves.py
+"""
+Применение ходов.
+
+Ход проверяется и применяется синхронно, до любого сетевого запроса: в
+commit_player_move()/commit_ai_move() до записи хода нет await, поэтому в
+пределах процесса ходы одного чата применяются строго по очереди, даже если
+обновления обрабатываются параллельно. Между процессами порядок обеспечивает
+сравнение версий в хранилище (GameStore.save, StaleGameError): с общим
+хранилищем ход дожидается записи (GameStore.committed), и только потом
+завершённая партия попадает в статистику, журнал и рейтинги.
+
+Результат хода (MoveResult) хранит версию игры после хода и клавиатуру до него —
+отрисовка идёт потом, асинхронно, и прекращается, если игра успела измениться
+(см. render_move в handlers/game_handlers.py). Проигравшее гонку нажатие
+(клетка уже занята, чужой ход) отклоняется без запросов к Bot API, кроме ответа
+на callback.
+
+После каждого хода таймаут игры переставляется (arm_timeout): пока нет второго
+игрока — ожидание соперника GAME_TIMEOUT_SECONDS, дальше — MOVE_TIMEOUT_SECONDS
+на ход. Таймаут помнит сообщение игры и число сделанных ходов и срабатывает,
+только если с тех пор не было хода (смена темы его не сбрасывает).
+"""
+import logging
+from typing import List, Optional, Tuple, Union
+
+from telegram import InlineKeyboardMarkup
+
+from config import GAME_TIMEOUT_SECONDS, MOVE_TIMEOUT_SECONDS
+from game import Game
+from game_logic import get_keyboard
+from event_log import event_log
+from game_state import games, record_result
+from ratings import ratings
+from timing_wheel import game_timeouts
+from vip import get_symbol
+
+logger = logging.getLogger(__name__)
+
+stats = {"committed": 0, "rejected": 0, "ai_discarded": 0}
+
+
+class MoveResult:
+    """Записанный ход: что отрисовать и для какой версии игры"""
+
+    __slots__ = ("game", "cell", "symbol", "winner", "combo", "version", "message_id", "keyboard")
+
+    def __init__(self, game: Game, cell: int, symbol: str, winner: Optional[str],
+                 combo: Optional[List[int]], keyboard: InlineKeyboardMarkup) -> None:
+        self.game = game
+        self.cell = cell
+        self.symbol = symbol
+        self.winner = winner
+        self.combo = combo
+        self.version = game.version
+        self.message_id = game.message_id
+        # Клавиатура до хода — основа кадров анимации
+        self.keyboard = keyboard
+
+    @property
+    def is_current(self) -> bool:
+        """Не изменилась ли игра после этого хода"""
+        return self.game.version == self.version
+
+
+def timeout_token(game: Game) -> Tuple[Optional[int], int]:
+    """Позиция игры для проверки актуальности таймаута"""
+    return game.message_id, game.moves_made
+
+
+def arm_timeout(chat_id: int, game: Game) -> None:
+    """Ставит таймаут для текущего состояния игры (ожидание соперника или хода)"""
+    if game.game_over:
+        game_timeouts.cancel(chat_id)
+    elif len(game.players) < 2:
+        game_timeouts.arm(chat_id, GAME_TIMEOUT_SECONDS, ("join", timeout_token(game)))
+    elif MOVE_TIMEOUT_SECONDS > 0 and game.current_player != game.ai_symbol:
+        game_timeouts.arm(chat_id, MOVE_TIMEOUT_SECONDS, ("move", timeout_token(game)))
+    else:
+        # Ход ИИ делается сразу, таймаут не нужен
+        game_timeouts.cancel(chat_id)
+
+
+def _commit(chat_id: int, game: Game, cell: int, symbol: str) -> MoveResult:
+    keyboard = get_keyboard(chat_id)
+    # Проверяются только линии через эту клетку
+    winner, combo = game.apply_move(cell, symbol)
+    if winner:
+        game.game_over = True
+    else:
+        game.current_player = "O" if symbol == "X" else "X"
+    games.save(chat_id)
+    arm_timeout(chat_id, game)
+    return MoveResult(game, cell, symbol, winner, combo, keyboard)
+
+
+async def _finish(chat_id: int, move: MoveResult) -> MoveResult:
+    """Дожидается записи хода и учитывает завершённую партию"""
+    await games.committed(chat_id)
+    winner, game = move.winner, move.game
+    if winner:
+        draw = winner == "Ничья"
+        record_result(chat_id, None if draw else game.player(winner).username)
+        ratings.apply(event_log.record_game(chat_id, game, "draw" if draw else "win", None if draw else winner))
+    stats["committed"] += 1
+    return move
+
+
+def _reject(reason: str) -> str:
+    stats["rejected"] += 1
+    return reason
+
+
+async def commit_player_move(chat_id: int, user_id: int, username: str, cell: int) -> Union[MoveResult, str]:
+    """Проверяет и записывает ход игрока; при отказе возвращает текст для ответа на callback"""
+    game = games.get(chat_id)
+    if game is None:
+        return _reject("Игра не найдена.")
+    if game.game_over:
+        return _reject("Игра уже завершена.")
+    if not game.is_free(cell):
+        return _reject("Клетка уже занята")
+    symbol = game.current_player
+    player = game.player(symbol)
+    if player is None:
+        # Запрещаем одному пользователю играть за обе стороны
+        if game.symbol_of(user_id) is not None:
+            return _reject("Вы уже играете за другую сторону")
+        # Регистрация второго игрока; таймаут ожидания сменится таймаутом хода при записи
+        game.add_player(user_id, username, symbol)
+        custom = get_symbol(user_id)
+        if custom:
+            game.override_symbol(symbol, custom)
+        logger.info("Second player joined for chat %s", chat_id)
+    elif player.user_id != user_id:
+        return _reject("Сейчас не ваш ход")
+    return await _finish(chat_id, _commit(chat_id, game, cell, symbol))
+
+
+async def commit_ai_move(chat_id: int, cell: int, expected_version: int) -> Optional[MoveResult]:
+    """Записывает ход ИИ, если игра не менялась с версии expected_version (пока ИИ думал)"""
+    game = games.get(chat_id)
+    if (game is None or game.version != expected_version or game.game_over
+            or game.current_player != game.ai_symbol or not game.is_free(cell)):
+        stats["ai_discarded"] += 1
+        return None
+    return await _finish(chat_id, _commit(chat_id, game, cell, game.ai_symbol))
@@ -0,0 +1,178 @@
+# rate_limiter.py
+"""
+Центральный ограничитель исходящих запросов к Bot API.
+
+Подключается к Application через builder().rate_limiter(...), поэтому через него
+проходят все вызовы context.bot. Для запросов с chat_id действуют:
+    - глобальное ведро токенов (RATE_LIMIT_GLOBAL_PER_SECOND, ~30 сообщений/с);
+    - ведро на чат: личные чаты RATE_LIMIT_PRIVATE_PER_SECOND (~1/с) с запасом
+      RATE_LIMIT_PRIVATE_BURST (кадры анимации хода проходят без ожидания),
+      группы RATE_LIMIT_GROUP_PER_MINUTE (~20/мин).
+Запросы без chat_id (например, answerCallbackQuery) не ограничиваются.
+
+Приоритет передаётся через rate_limit_args: PRIORITY_INTERACTIVE (по умолчанию,
+ходы игр) или PRIORITY_BACKGROUND (рассылки) — фоновые запросы пропускают
+вперёд интерактивные, ожидающие то же ведро.
+
+RetryAfter обрабатывается здесь: все запросы приостанавливаются на retry_after
+(плюс растущая добавка), и запрос повторяется до RATE_LIMIT_MAX_RETRIES раз.
+"""
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Dict, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import (
+    RATE_LIMIT_GLOBAL_PER_SECOND, RATE_LIMIT_PRIVATE_PER_SECOND, RATE_LIMIT_PRIVATE_BURST,
+    RATE_LIMIT_GROUP_PER_MINUTE, RATE_LIMIT_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Сколько вёдер чатов держать, прежде чем чистить полные (неиспользуемые)
+_MAX_CHAT_BUCKETS = 1024
+
+
+def _seconds(value: Union[int, float, timedelta]) -> float:
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class TokenBucket:
+    """Ведро токенов с приоритетом: фоновые запросы ждут, пока есть интерактивные"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "waiting_interactive")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.waiting_interactive = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """Ждёт токен. Возвращает время ожидания в секундах."""
+        started = time.monotonic()
+        interactive = priority == PRIORITY_INTERACTIVE
+        if interactive:
+            self.waiting_interactive += 1
+        try:
+            while True:
+                self._refill()
+                if self.tokens >= 1 and (interactive or self.waiting_interactive == 0):
+                    self.tokens -= 1
+                    return time.monotonic() - started
+                delay = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.01
+                await asyncio.sleep(max(delay, 0.005))
+        finally:
+            if interactive:
+                self.waiting_interactive -= 1
+
+
+class BotRateLimiter(BaseRateLimiter[int]):
+    """Глобальное и початовые ведра токенов, приоритеты и обработка RetryAfter"""
+
+    def __init__(self, global_per_second: float, private_per_second: float, private_burst: float,
+                 group_per_minute: float, max_retries: int) -> None:
+        self.global_bucket = TokenBucket(global_per_second, global_per_second)
+        self.private_per_second = private_per_second
+        self.private_burst = max(1.0, private_burst)
+        self.group_per_minute = group_per_minute
+        self.max_retries = max_retries
+        self._chat_buckets: Dict[Union[int, str], TokenBucket] = {}
+        self._paused_until = 0.0
+        # Метрики
+        self.requests = 0
+        self.throttled = 0
+        self.wait_time_total = 0.0
+        self.retry_afters = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > _MAX_CHAT_BUCKETS:
+                for key in [k for k, b in self._chat_buckets.items() if b.is_full()]:
+                    del self._chat_buckets[key]
+            # Положительные id — личные чаты, отрицательные и @username — группы/каналы
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(self.private_per_second, self.private_burst)
+            else:
+                bucket = TokenBucket(self.group_per_minute / 60, self.group_per_minute)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _wait_pause(self) -> None:
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Any:
+        priority = PRIORITY_INTERACTIVE if rate_limit_args is None else rate_limit_args
+        chat_id = data.get("chat_id")
+        self.requests += 1
+        attempt = 0
+        while True:
+            await self._wait_pause()
+            if chat_id is not None:
+                waited = await self._chat_bucket(chat_id).acquire(priority)
+                waited += await self.global_bucket.acquire(priority)
+                if waited > 0.001:
+                    self.throttled += 1
+                    self.wait_time_total += waited
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_afters += 1
+                if attempt >= self.max_retries:
+                    raise
+                # Пауза для всех запросов: Telegram ограничивает бота целиком
+                pause = _seconds(e.retry_after) + 0.1 * 2 ** attempt
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+                attempt += 1
+                logger.warning("RetryAfter on %s (chat %s): pausing %.1fs, retry %s/%s",
+                               endpoint, chat_id, pause, attempt, self.max_retries)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "wait_sec_total": round(self.wait_time_total, 3),
+            "retry_afters": self.retry_afters,
+            "paused_sec_left": round(max(0.0, self._paused_until - time.monotonic()), 2),
+            "chat_buckets": len(self._chat_buckets),
+        }
+
+
+rate_limiter = BotRateLimiter(
+    RATE_LIMIT_GLOBAL_PER_SECOND, RATE_LIMIT_PRIVATE_PER_SECOND, RATE_LIMIT_PRIVATE_BURST,
+    RATE_LIMIT_GROUP_PER_MINUTE, RATE_LIMIT_MAX_RETRIES
+)
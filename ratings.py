@@ -0,0 +1,338 @@
+# ratings.py
+"""
+Рейтинг Эло.
+
+Игра человека с человеком (победа, ничья, победа по таймауту) меняет рейтинги
+двух игроков за O(1): ожидаемый результат E = 1 / (1 + 10^((Rb - Ra) / 400)),
+новый рейтинг Ra + ELO_K * (S - E). Игры с ИИ в рейтинг не входят и считаются
+отдельно (игры, победы, поражения, ничьи против ИИ).
+
+recompute() пересчитывает все рейтинги заново по журналу игр (event_log.py) —
+например, после изменения формулы. С NumPy игры считаются пачками: игра входит
+в пачку, когда посчитаны предыдущие игры обоих её игроков, поэтому в пачке
+каждый игрок встречается не больше раза, а порядок его игр сохраняется —
+результат совпадает с последовательным пересчётом. Пачек столько, сколько игр
+в самой длинной цепочке зависимостей, а не сколько игр всего. Без NumPy — тот
+же расчёт обычным циклом.
+
+Рейтинги сохраняются в RATINGS_PATH (атомарной заменой, не чаще
+RATINGS_SAVE_INTERVAL_SECONDS); если файла нет, при старте они пересчитываются
+по журналу.
+
+Несколько процессов бота (shared = True, общее хранилище состояния) пишут
+в один журнал, и каждый видит только свои игры. Поэтому в этом режиме apply()
+рейтинги не меняет: все процессы считают их по общему журналу (follow()
+применяет записи после сохранённого смещения offset, по порядку журнала) и
+приходят к одним и тем же рейтингам. В файле вместе с рейтингами хранится
+смещение, до которого они посчитаны: какой процесс ни записал бы файл
+последним, рейтинги в нём согласованы со смещением, а после загрузки follow()
+догоняет журнал.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from config import ELO_K, ELO_INITIAL, RATINGS_PATH, EVENT_LOG_PATH
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Игра для рейтинга: (id первого, id второго, очки первого: 1, 0.5 или 0)
+RatedGame = Tuple[int, int, float]
+
+
+def expected(rating: float, opponent: float) -> float:
+    return 1.0 / (1.0 + 10 ** ((opponent - rating) / 400.0))
+
+
+def rated_games(records: Iterable[dict]) -> Iterable[RatedGame]:
+    """Игры журнала, которые влияют на рейтинг: два человека и есть результат"""
+    for record in records:
+        if record.get("ai") or len(record["p"]) != 2 or record["r"] not in ("win", "draw", "timeout"):
+            continue
+        (first, _, first_symbol), (second, _, _) = record["p"]
+        winner = record["w"]
+        score = 0.5 if winner is None else (1.0 if winner == first_symbol else 0.0)
+        yield first, second, score
+
+
+def _read_log(path: str, start: int, end: int) -> Tuple[List[dict], int]:
+    """Записи журнала между смещениями start и end и смещение после последней полной строки"""
+    records = []
+    try:
+        with open(path, "rb") as f:
+            f.seek(start)
+            chunk = f.read(end - start)
+    except FileNotFoundError:
+        return records, start
+    # Неполную последнюю строку может дописывать другой процесс — её прочитаем в следующий раз
+    complete = chunk.rfind(b"\n") + 1
+    for line in chunk[:complete].splitlines():
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records, start + complete
+
+
+def _log_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def compute_sequential(games: List[RatedGame], k: float, initial: float) -> Dict[int, Tuple[float, int]]:
+    ratings: Dict[int, float] = {}
+    counts: Dict[int, int] = {}
+    for a, b, score in games:
+        ra = ratings.get(a, initial)
+        rb = ratings.get(b, initial)
+        delta = k * (score - expected(ra, rb))
+        ratings[a] = ra + delta
+        ratings[b] = rb - delta
+        counts[a] = counts.get(a, 0) + 1
+        counts[b] = counts.get(b, 0) + 1
+    return {user_id: (ratings[user_id], counts[user_id]) for user_id in ratings}
+
+
+def compute_vectorized(games: List[RatedGame], k: float, initial: float) -> Dict[int, Tuple[float, int]]:
+    """Пересчёт пачками без повторяющихся игроков (нужен NumPy)"""
+    if not games:
+        return {}
+    count = len(games)
+    scores = np.array([game[2] for game in games], dtype=np.float64)
+    players = np.array([user_id for game in games for user_id in game[:2]], dtype=np.int64)
+    # Участие игрока в игре: 2i — первый игрок игры i, 2i+1 — второй.
+    # После устойчивой сортировки по игроку соседние участия — его игры подряд
+    order = np.argsort(players, kind="stable")
+    sorted_players = players[order]
+    same = sorted_players[:-1] == sorted_players[1:]
+    user_ids = sorted_players[np.concatenate(([True], ~same))]
+    index = np.empty(2 * count, dtype=np.int64)
+    index[order] = np.concatenate(([0], np.cumsum(~same)))
+    next_game = np.full(2 * count, -1, dtype=np.int64)
+    next_game[order[:-1][same]] = order[1:][same] // 2
+    # Сколько предыдущих игр (0–2) ещё не посчитано
+    waiting = np.bincount(next_game[next_game >= 0], minlength=count)
+    index = index.reshape(-1, 2)
+    ratings = np.full(len(user_ids), initial, dtype=np.float64)
+    batch = np.flatnonzero(waiting == 0)
+    while batch.size:
+        a = index[batch, 0]
+        b = index[batch, 1]
+        delta = k * (scores[batch] - 1.0 / (1.0 + 10 ** ((ratings[b] - ratings[a]) / 400.0)))
+        ratings[a] += delta
+        ratings[b] -= delta
+        following = np.concatenate((next_game[2 * batch], next_game[2 * batch + 1]))
+        following = following[following >= 0]
+        np.subtract.at(waiting, following, 1)
+        batch = np.unique(following[waiting[following] == 0])
+    counts = np.bincount(index.ravel(), minlength=len(user_ids))
+    return {int(user_id): (float(rating), int(count))
+            for user_id, rating, count in zip(user_ids, ratings, counts)}
+
+
+class Ratings:
+    """Рейтинги игроков и статистика игр против ИИ"""
+
+    def __init__(self, path: str, k: float, initial: float) -> None:
+        self.path = path
+        self.k = k
+        self.initial = initial
+        # True — несколько процессов: рейтинги считаются только по общему журналу
+        self.shared = False
+        # До какого места журнала учтены рейтинги (в режиме shared)
+        self.offset = 0
+        # Пересчёт и догон журнала не идут одновременно
+        self._log_lock = asyncio.Lock()
+        # user_id -> [рейтинг, игр]
+        self.players: Dict[int, list] = {}
+        # user_id -> [игр, побед, поражений, ничьих] против ИИ
+        self.ai_games: Dict[int, list] = {}
+        self.names: Dict[int, str] = {}
+        self._dirty = False
+        self.updates = 0
+        self.recomputes = 0
+        self.recompute_seconds = 0.0
+
+    def rating(self, user_id: int) -> float:
+        entry = self.players.get(user_id)
+        return entry[0] if entry else self.initial
+
+    def apply(self, record: dict) -> None:
+        """Учитывает завершённую игру (запись журнала event_log)"""
+        if self.shared:
+            # Игра попадёт в рейтинги из общего журнала (follow)
+            return
+        self._take(record)
+
+    def _take(self, record: dict) -> None:
+        for user_id, name, symbol in record["p"]:
+            if symbol != record.get("ai"):
+                self.names[user_id] = name
+        self._apply(record)
+
+    def _apply(self, record: dict) -> None:
+        ai = record.get("ai")
+        if ai:
+            if record["r"] == "cancelled":
+                return
+            for user_id, _, symbol in record["p"]:
+                if symbol == ai:
+                    continue
+                entry = self.ai_games.setdefault(user_id, [0, 0, 0, 0])
+                entry[0] += 1
+                winner = record["w"]
+                entry[3 if winner is None else (1 if winner == symbol else 2)] += 1
+            self._dirty = True
+            return
+        for a, b, score in rated_games([record]):
+            entry_a = self.players.setdefault(a, [self.initial, 0])
+            entry_b = self.players.setdefault(b, [self.initial, 0])
+            delta = self.k * (score - expected(entry_a[0], entry_b[0]))
+            entry_a[0] += delta
+            entry_b[0] -= delta
+            entry_a[1] += 1
+            entry_b[1] += 1
+            self.updates += 1
+            self._dirty = True
+
+    def top(self, limit: int) -> List[Tuple[int, float, int]]:
+        """Лучшие по рейтингу: (user_id, рейтинг, игр)"""
+        best = heapq.nlargest(limit, self.players.items(), key=lambda item: item[1][0])
+        return [(user_id, rating, games) for user_id, (rating, games) in best]
+
+    # --- Пересчёт ---
+
+    def _compute(self, log_path: str, end: int) -> Tuple[Dict[int, list], Dict[int, list], Dict[int, str], int]:
+        """Пересчитывает всё по первым end байтам журнала (вне event loop)"""
+        records, end = _read_log(log_path, 0, end)
+        games = list(rated_games(records))
+        compute = compute_vectorized if np is not None else compute_sequential
+        players = {user_id: [rating, count] for user_id, (rating, count) in compute(games, self.k, self.initial).items()}
+        scratch = Ratings("", self.k, self.initial)
+        for record in records:
+            if record.get("ai"):
+                scratch._apply(record)
+            for user_id, name, symbol in record["p"]:
+                if symbol != record.get("ai"):
+                    scratch.names[user_id] = name
+        return players, scratch.ai_games, scratch.names, end
+
+    async def recompute(self, log_path: str = EVENT_LOG_PATH) -> int:
+        """Пересчитывает рейтинги по журналу игр; возвращает число игроков"""
+        async with self._log_lock:
+            return await self._recompute(log_path)
+
+    async def _recompute(self, log_path: str) -> int:
+        from event_log import event_log
+        started = time.monotonic()
+        # Пересчёт читает журнал только до end; игры, дописанные за время пересчёта,
+        # применяются потом поверх результата из хвоста журнала
+        await event_log.flush()
+        end = _log_size(log_path)
+        players, ai_games, names, end = await asyncio.to_thread(self._compute, log_path, end)
+        # Пока шла дозапись, могли завершиться новые игры — дописываем, пока буфер не опустеет
+        errors = event_log.errors
+        await event_log.flush()
+        while event_log.buffered:
+            if event_log.errors != errors:
+                raise RuntimeError("журнал игр не дописывается")
+            await event_log.flush()
+        # Дальше без await: каждая игра, учтённая в старых рейтингах, уже в журнале до tail_end
+        tail, self.offset = _read_log(log_path, end, _log_size(log_path))
+        self.players, self.ai_games = players, ai_games
+        self.names.update(names)
+        for record in tail:
+            self._take(record)
+        self._dirty = True
+        self.recomputes += 1
+        self.recompute_seconds = time.monotonic() - started
+        logger.info(f"Рейтинги пересчитаны: {len(players)} игроков за {self.recompute_seconds:.2f} сек "
+                    f"({'numpy' if np is not None else 'python'})")
+        return len(players)
+
+    async def follow(self, log_path: str = EVENT_LOG_PATH) -> int:
+        """Режим shared: применяет игры всех процессов, дописанные в журнал после offset"""
+        if not self.shared:
+            return 0
+        from event_log import event_log
+        async with self._log_lock:
+            await event_log.flush()
+            records, self.offset = await asyncio.to_thread(_read_log, log_path, self.offset, _log_size(log_path))
+            for record in records:
+                self._take(record)
+            if records:
+                self._dirty = True
+        return len(records)
+
+    # --- Сохранение ---
+
+    def load(self) -> bool:
+        """Загружает рейтинги; False — файла нет (нужен пересчёт по журналу)"""
+        if not self.path:
+            return True
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать рейтинги {self.path}: {e}")
+            return False
+        if self.shared:
+            if "offset" not in data:
+                # Файл одного процесса: неизвестно, какие игры журнала в нём учтены
+                return False
+            self.offset = data["offset"]
+        self.players = {int(k): v for k, v in data.get("players", {}).items()}
+        self.ai_games = {int(k): v for k, v in data.get("ai", {}).items()}
+        self.names = {int(k): v for k, v in data.get("names", {}).items()}
+        return True
+
+    def _write(self, data: dict) -> None:
+        # Свой временный файл у каждого процесса: файл рейтингов могут писать несколько
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    async def save(self) -> None:
+        """Сохраняет рейтинги, если они менялись"""
+        if not self.path or not self._dirty:
+            return
+        self._dirty = False
+        data = {"players": self.players, "ai": self.ai_games, "names": self.names}
+        # Снимок сериализуется в потоке: словари копируются здесь, в event loop
+        data = {key: {k: list(v) if isinstance(v, list) else v for k, v in value.items()}
+                for key, value in data.items()}
+        if self.shared:
+            data["offset"] = self.offset
+        try:
+            await asyncio.to_thread(self._write, data)
+        except Exception as e:
+            self._dirty = True
+            logger.error(f"Не удалось сохранить рейтинги: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "players": len(self.players),
+            "ai_players": len(self.ai_games),
+            "updates": self.updates,
+            "recomputes": self.recomputes,
+            "recompute_seconds": round(self.recompute_seconds, 3),
+            "numpy": np is not None,
+            "offset": self.offset,
+        }
+
+
+ratings = Ratings(RATINGS_PATH, ELO_K, ELO_INITIAL)
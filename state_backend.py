@@ -0,0 +1,456 @@
+# state_backend.py
+"""
+Хранилища состояния бота (игры, баны, статистика чатов, чаты для рассылок).
+
+Интерфейс StateBackend и реализации:
+    MemoryBackend        — только память процесса, без сохранения;
+    SQLiteStore          — локальный файл с отложенной записью (storage.py), один процесс;
+    SharedSQLiteBackend  — общий файл SQLite для нескольких процессов на одной машине;
+    RedisBackend         — сервер с протоколом Redis (redis-server, KeyDB, локальная замена),
+                           нужен пакет redis.
+
+У каждой игры есть версия. save_game(chat_id, game, version) записывает игру,
+только если в хранилище всё ещё версия version (compare-and-set), и возвращает
+новую версию; иначе бросает StaleGameError — игру уже изменил другой процесс.
+Общие хранилища (shared = True) не доверяют копии игры в памяти: GameStore
+перечитывает её перед каждым обновлением чата (см. GameStore.refresh).
+
+Запросы к общему хранилищу не выполняются в event loop: submit()/call() ставят
+их в очередь отдельного потока хранилища. Поток один, поэтому запросы
+выполняются в порядке отправки — чтение игры всегда видит записи, отправленные
+до него. У потока своё соединение SQLite (соединения не делятся между потоками).
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Set, Tuple
+
+from game import Game
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    chat_id INTEGER PRIMARY KEY,
+    game_over INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS bans (name TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS chat_stats (chat_id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS chats (chat_id INTEGER PRIMARY KEY);
+"""
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # В WAL режим NORMAL не теряет целостность, fsync только на контрольных точках
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """Создаёт таблицы (общие для SQLiteStore и SharedSQLiteBackend)"""
+    conn.executescript(_SCHEMA)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(games)")}
+    if "version" not in columns:
+        # База, созданная до появления версий игр
+        conn.execute("ALTER TABLE games ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+class StaleGameError(Exception):
+    """Игру изменил другой процесс: изменение не записано"""
+
+
+def _log_failure(future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Не удалось записать изменение в хранилище: {future.exception()}")
+
+
+def count_result(stats: dict, winner_name: Optional[str]) -> dict:
+    """Учитывает партию в статистике чата (winner_name=None — ничья)"""
+    stats["games"] += 1
+    if winner_name is None:
+        stats["draws"] += 1
+    else:
+        stats["wins"] += 1
+        stats["top_players"][winner_name] = stats["top_players"].get(winner_name, 0) + 1
+    return stats
+
+
+def new_chat_stats() -> dict:
+    return {"games": 0, "wins": 0, "draws": 0, "top_players": {}}
+
+
+def _apply_shared(banned_users: set, all_chats: set, bans: Set[str], chats: Set[int]) -> None:
+    """Переносит прочитанные баны и чаты в множества процесса"""
+    banned_users.intersection_update(bans)
+    banned_users.update(bans)
+    all_chats.update(chats)
+
+
+class StateBackend:
+    """Интерфейс хранилища состояния"""
+
+    # True — хранилище общее для нескольких процессов
+    shared = False
+    # Поток запросов к хранилищу (создаётся при первом submit)
+    _executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        return True
+
+    @property
+    def durable(self) -> bool:
+        """Можно ли убрать игру из памяти и потом поднять её из хранилища"""
+        return self.enabled
+
+    def open(self) -> None:
+        pass
+
+    def load(self, games, banned_users: set, chat_stats: dict, all_chats: set) -> None:
+        """Загружает состояние при старте и подключается к games (GameStore.attach)"""
+        games.attach(self, ())
+
+    def _read_shared(self) -> Tuple[Set[str], Set[int]]:
+        """Баны и чаты в общем хранилище (вне event loop)"""
+        return set(), set()
+
+    async def refresh(self, banned_users: set, all_chats: set) -> None:
+        """Перечитывает баны и чаты, изменённые другими процессами (в потоке хранилища)"""
+        if self.shared:
+            _apply_shared(banned_users, all_chats, *await self.call(self._read_shared))
+
+    def purge(self, finished_ttl: float, idle_ttl: float) -> None:
+        """Общее хранилище: удаляет завершённые и брошенные игры (сек. без изменений)"""
+
+    # --- Игры ---
+
+    def load_game(self, chat_id: int) -> Optional[Tuple[Game, int]]:
+        """Игра и её версия или None"""
+        raise NotImplementedError
+
+    def save_game(self, chat_id: int, game: Game, version: int) -> int:
+        """Записывает игру, если её версия в хранилище равна version; возвращает новую версию"""
+        raise NotImplementedError
+
+    def delete_game(self, chat_id: int) -> None:
+        raise NotImplementedError
+
+    # --- Баны, статистика, чаты ---
+
+    def save_ban(self, name: str, banned: bool) -> None:
+        raise NotImplementedError
+
+    def load_chat_stats(self, chat_id: int) -> Optional[dict]:
+        return None
+
+    def save_chat_stats(self, chat_id: int, stats: dict) -> None:
+        raise NotImplementedError
+
+    def add_chat_result(self, chat_id: int, winner_name: Optional[str]) -> dict:
+        """Общее хранилище: атомарно учитывает партию в статистике чата, возвращает её"""
+        raise NotImplementedError
+
+    def save_chat(self, chat_id: int) -> None:
+        raise NotImplementedError
+
+    # --- Поток хранилища ---
+
+    def submit(self, fn, *args) -> Future:
+        """Ставит запрос в очередь потока хранилища (выполняются по порядку отправки)"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state")
+        return self._executor.submit(fn, *args)
+
+    async def call(self, fn, *args):
+        """Выполняет запрос в потоке хранилища и ждёт результата"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def _background(self, fn, *args) -> None:
+        """Запрос без ожидания результата; ошибки — в лог"""
+        self.submit(fn, *args).add_done_callback(_log_failure)
+
+    async def _stop_executor(self) -> None:
+        """Дожидается отправленных запросов и останавливает поток"""
+        if self._executor is not None:
+            await asyncio.to_thread(self._executor.shutdown)
+            self._executor = None
+
+    # --- Жизненный цикл ---
+
+    def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__}
+
+
+class MemoryBackend(StateBackend):
+    """Состояние только в памяти процесса (без сохранения между перезапусками)"""
+
+    durable = False
+
+    def __init__(self) -> None:
+        self._games: Dict[int, Tuple[Game, int]] = {}
+
+    def load_game(self, chat_id: int) -> Optional[Tuple[Game, int]]:
+        return self._games.get(chat_id)
+
+    def save_game(self, chat_id: int, game: Game, version: int) -> int:
+        current = self._games.get(chat_id)
+        if (current[1] if current else 0) != version:
+            raise StaleGameError(chat_id)
+        self._games[chat_id] = (game, version + 1)
+        return version + 1
+
+    def delete_game(self, chat_id: int) -> None:
+        self._games.pop(chat_id, None)
+
+    def save_ban(self, name: str, banned: bool) -> None:
+        pass
+
+    def save_chat_stats(self, chat_id: int, stats: dict) -> None:
+        pass
+
+    def save_chat(self, chat_id: int) -> None:
+        pass
+
+
+class SharedSQLiteBackend(StateBackend):
+    """Общий файл SQLite: каждая запись — отдельная короткая транзакция, игры — через CAS"""
+
+    shared = True
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # Соединение на поток: при старте — event loop, дальше — поток хранилища
+        self._local = threading.local()
+        self._connections: list = []
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.path)
+            # Другие процессы могут держать блокировку записи — ждём, а не падаем
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            self._connections.append(conn)
+        return conn
+
+    def open(self) -> None:
+        # Схема общая с SQLiteStore, поэтому файл можно переключать между режимами
+        ensure_schema(self._conn)
+        logger.info(f"Shared SQLite state: {self.path}")
+
+    def load(self, games, banned_users: set, chat_stats: dict, all_chats: set) -> None:
+        _apply_shared(banned_users, all_chats, *self._read_shared())
+        for chat_id, data in self._conn.execute("SELECT chat_id, data FROM chat_stats"):
+            chat_stats[chat_id] = json.loads(data)
+        games.attach(self, ())
+
+    def _read_shared(self) -> Tuple[Set[str], Set[int]]:
+        bans = {name for (name,) in self._conn.execute("SELECT name FROM bans")}
+        chats = {chat_id for (chat_id,) in self._conn.execute("SELECT chat_id FROM chats")}
+        return bans, chats
+
+    def load_game(self, chat_id: int) -> Optional[Tuple[Game, int]]:
+        row = self._conn.execute("SELECT data, version FROM games WHERE chat_id = ?", (chat_id,)).fetchone()
+        if row is None:
+            return None
+        return Game.from_dict(json.loads(row[0])), row[1]
+
+    def save_game(self, chat_id: int, game: Game, version: int) -> int:
+        data = json.dumps(game.to_dict(), ensure_ascii=False)
+        if version == 0:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO games (chat_id, game_over, data, updated_at, version) "
+                "VALUES (?, ?, ?, strftime('%s','now'), 1)",
+                (chat_id, int(game.game_over), data))
+        else:
+            cursor = self._conn.execute(
+                "UPDATE games SET game_over = ?, data = ?, updated_at = strftime('%s','now'), version = version + 1 "
+                "WHERE chat_id = ? AND version = ?",
+                (int(game.game_over), data, chat_id, version))
+        if cursor.rowcount != 1:
+            raise StaleGameError(chat_id)
+        return version + 1
+
+    def delete_game(self, chat_id: int) -> None:
+        self._background(self._execute, "DELETE FROM games WHERE chat_id = ?", (chat_id,))
+
+    def _execute(self, sql: str, params: tuple) -> None:
+        self._conn.execute(sql, params)
+
+    def purge(self, finished_ttl: float, idle_ttl: float) -> None:
+        self._conn.execute(
+            "DELETE FROM games WHERE (game_over = 1 AND updated_at < strftime('%s','now') - ?) "
+            "OR updated_at < strftime('%s','now') - ?",
+            (finished_ttl, idle_ttl))
+
+    def save_ban(self, name: str, banned: bool) -> None:
+        if banned:
+            self._background(self._execute, "INSERT OR IGNORE INTO bans VALUES (?)", (name,))
+        else:
+            self._background(self._execute, "DELETE FROM bans WHERE name = ?", (name,))
+
+    def load_chat_stats(self, chat_id: int) -> Optional[dict]:
+        row = self._conn.execute("SELECT data FROM chat_stats WHERE chat_id = ?", (chat_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_chat_stats(self, chat_id: int, stats: dict) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO chat_stats VALUES (?, ?)",
+                           (chat_id, json.dumps(stats, ensure_ascii=False)))
+
+    def add_chat_result(self, chat_id: int, winner_name: Optional[str]) -> dict:
+        conn = self._conn
+        # IMMEDIATE берёт блокировку записи до чтения: другие процессы ждут, а не теряют прибавку
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            stats = count_result(self.load_chat_stats(chat_id) or new_chat_stats(), winner_name)
+            self.save_chat_stats(chat_id, stats)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return stats
+
+    def save_chat(self, chat_id: int) -> None:
+        self._background(self._execute, "INSERT OR IGNORE INTO chats VALUES (?)", (chat_id,))
+
+    async def close(self) -> None:
+        await self._stop_executor()
+        for conn in self._connections:
+            conn.close()
+        self._connections.clear()
+        self._local = threading.local()
+
+    def stats(self) -> dict:
+        return {"backend": "sqlite", "path": self.path}
+
+
+# CAS для игры: KEYS[1] — ключ игры; ARGV: ожидаемая версия, данные, TTL ключа (сек).
+# Устаревшие игры удаляет сам сервер по TTL, поэтому purge() не нужен
+_REDIS_CAS = """
+local version = tonumber(redis.call('HGET', KEYS[1], 'v') or '0')
+if version ~= tonumber(ARGV[1]) then
+    return -1
+end
+redis.call('HSET', KEYS[1], 'v', version + 1, 'd', ARGV[2])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+return version + 1
+"""
+
+
+# Партия в статистике чата: KEYS[1] — хеш статистики; ARGV: чат, "1" — ничья, победитель
+_REDIS_ADD_RESULT = """
+local data = redis.call('HGET', KEYS[1], ARGV[1])
+local stats
+if data then
+    stats = cjson.decode(data)
+else
+    stats = {games = 0, wins = 0, draws = 0, top_players = {}}
+end
+stats.games = stats.games + 1
+if ARGV[2] == '1' then
+    stats.draws = stats.draws + 1
+else
+    stats.wins = stats.wins + 1
+    stats.top_players[ARGV[3]] = (stats.top_players[ARGV[3]] or 0) + 1
+end
+data = cjson.encode(stats)
+redis.call('HSET', KEYS[1], ARGV[1], data)
+return data
+"""
+
+
+class RedisBackend(StateBackend):
+    """Состояние на сервере с протоколом Redis; CAS игр — Lua-скриптом на сервере"""
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str, finished_ttl: float, idle_ttl: float) -> None:
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("STATE_BACKEND=redis требует пакет redis: pip install redis") from e
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self.url = url
+        self.prefix = prefix
+        self.finished_ttl = max(1, int(finished_ttl))
+        self.idle_ttl = max(1, int(idle_ttl))
+        self._cas = self._client.register_script(_REDIS_CAS)
+        self._add_result = self._client.register_script(_REDIS_ADD_RESULT)
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}{name}"
+
+    def open(self) -> None:
+        self._client.ping()
+        logger.info(f"Redis state: {self.url}")
+
+    def load(self, games, banned_users: set, chat_stats: dict, all_chats: set) -> None:
+        _apply_shared(banned_users, all_chats, *self._read_shared())
+        for chat_id, data in self._client.hgetall(self._key("chat_stats")).items():
+            chat_stats[int(chat_id)] = json.loads(data)
+        games.attach(self, ())
+
+    def _read_shared(self) -> Tuple[Set[str], Set[int]]:
+        bans = self._client.smembers(self._key("bans"))
+        chats = {int(chat_id) for chat_id in self._client.smembers(self._key("chats"))}
+        return bans, chats
+
+    def load_game(self, chat_id: int) -> Optional[Tuple[Game, int]]:
+        row = self._client.hgetall(self._key(f"game:{chat_id}"))
+        if not row:
+            return None
+        return Game.from_dict(json.loads(row["d"])), int(row["v"])
+
+    def save_game(self, chat_id: int, game: Game, version: int) -> int:
+        data = json.dumps(game.to_dict(), ensure_ascii=False)
+        ttl = self.finished_ttl if game.game_over else self.idle_ttl
+        result = self._cas(keys=[self._key(f"game:{chat_id}")], args=[version, data, ttl])
+        if result == -1:
+            raise StaleGameError(chat_id)
+        return int(result)
+
+    def delete_game(self, chat_id: int) -> None:
+        self._background(self._client.delete, self._key(f"game:{chat_id}"))
+
+    def save_ban(self, name: str, banned: bool) -> None:
+        if banned:
+            self._background(self._client.sadd, self._key("bans"), name)
+        else:
+            self._background(self._client.srem, self._key("bans"), name)
+
+    def load_chat_stats(self, chat_id: int) -> Optional[dict]:
+        data = self._client.hget(self._key("chat_stats"), chat_id)
+        return json.loads(data) if data else None
+
+    def save_chat_stats(self, chat_id: int, stats: dict) -> None:
+        self._client.hset(self._key("chat_stats"), chat_id, json.dumps(stats, ensure_ascii=False))
+
+    def add_chat_result(self, chat_id: int, winner_name: Optional[str]) -> dict:
+        draw = "1" if winner_name is None else "0"
+        data = self._add_result(keys=[self._key("chat_stats")], args=[chat_id, draw, winner_name or ""])
+        return json.loads(data)
+
+    def save_chat(self, chat_id: int) -> None:
+        self._background(self._client.sadd, self._key("chats"), chat_id)
+
+    async def close(self) -> None:
+        await self._stop_executor()
+        self._client.close()
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "url": self.url}
@@ -0,0 +1,248 @@
+# storage.py
+"""
+Сохранение состояния бота в SQLite (режим WAL).
+
+Сохраняются игры, баны, статистика чатов и список чатов для рассылок.
+Изменения не пишутся сразу: save_*() только отмечают запись как изменённую
+(повторные изменения одной записи склеиваются), а фоновая задача раз в
+STORAGE_FLUSH_INTERVAL_SECONDS (или при накоплении STORAGE_BATCH_SIZE записей)
+сериализует их и пишет одной транзакцией в отдельном потоке. Поэтому ход
+не ждёт fsync, а при падении теряется не больше одного интервала.
+
+При старте загружаются баны, статистика и чаты; из игр — только список
+незавершённых, сами игры поднимаются из базы при первом обращении
+(см. GameStore в game_state.py).
+
+Пустой DB_PATH отключает сохранение.
+
+Это локальное хранилище для одного процесса (STATE_BACKEND=local). Общие
+хранилища для нескольких процессов — в state_backend.py; create_backend()
+выбирает реализацию по STATE_BACKEND.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import (
+    DB_PATH, STORAGE_FLUSH_INTERVAL_SECONDS, STORAGE_BATCH_SIZE,
+    STATE_BACKEND, STATE_SQLITE_PATH, REDIS_URL, REDIS_PREFIX, GAME_FINISHED_TTL_SECONDS, GAME_IDLE_TTL_SECONDS
+)
+from game import Game
+from state_backend import (
+    StateBackend, MemoryBackend, SharedSQLiteBackend, RedisBackend, connect, ensure_schema
+)
+
+logger = logging.getLogger(__name__)
+
+# Ключ изменённой записи: (таблица, ключ); значение None — удаление
+_Key = Tuple[str, Any]
+
+
+class SQLiteStore(StateBackend):
+    """Хранилище с отложенной пакетной записью.
+
+    Версии игр проверяет GameStore: в одном процессе копия в памяти — единственная,
+    поэтому save_game() только отмечает запись и возвращает следующую версию.
+    """
+
+    def __init__(self, path: str, flush_interval: float, batch_size: int) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # Чтение — из event loop, запись — из потока сброса; у каждого своё соединение
+        self._reader: Optional[sqlite3.Connection] = None
+        self._writer: Optional[sqlite3.Connection] = None
+        self._pending: Dict[_Key, Any] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Метрики
+        self.flushes = 0
+        self.rows_written = 0
+        self.errors = 0
+        self.flush_time_total = 0.0
+        self.flush_time_max = 0.0
+        self.games_loaded = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._writer is not None
+
+    def open(self) -> None:
+        if not self.path or self._writer is not None:
+            return
+        self._writer = connect(self.path)
+        ensure_schema(self._writer)
+        self._reader = connect(self.path)
+        logger.info(f"SQLite storage opened: {self.path}")
+
+    def load(self, games, banned_users: set, chat_stats: dict, all_chats: set) -> None:
+        """Загружает состояние при старте; игры — только список незавершённых"""
+        if not self.enabled:
+            return
+        banned_users.update(name for (name,) in self._reader.execute("SELECT name FROM bans"))
+        for chat_id, data in self._reader.execute("SELECT chat_id, data FROM chat_stats"):
+            chat_stats[chat_id] = json.loads(data)
+        all_chats.update(chat_id for (chat_id,) in self._reader.execute("SELECT chat_id FROM chats"))
+        # Завершённые игры после перезапуска не нужны
+        self._writer.execute("DELETE FROM games WHERE game_over = 1")
+        active = [chat_id for (chat_id,) in self._reader.execute("SELECT chat_id FROM games WHERE game_over = 0")]
+        games.attach(self, active)
+        logger.info(f"Loaded {len(active)} active games (lazy), {len(banned_users)} bans, "
+                     f"{len(chat_stats)} chat stats, {len(all_chats)} chats")
+
+    def load_game(self, chat_id: int) -> Optional[Tuple[Game, int]]:
+        """Читает одну игру по ключу (быстрый запрос по первичному ключу)"""
+        if not self.enabled:
+            return None
+        # Ещё не сброшенное изменение новее базы (в том числе удаление)
+        key = ("games", chat_id)
+        if key in self._pending:
+            pending = self._pending[key]
+            return None if pending is None else (pending[0], pending[1])
+        row = self._reader.execute("SELECT data, version FROM games WHERE chat_id = ?", (chat_id,)).fetchone()
+        if row is None:
+            return None
+        self.games_loaded += 1
+        return Game.from_dict(json.loads(row[0])), row[1]
+
+    # --- Отметки об изменениях ---
+
+    def _mark(self, key: _Key, value: Any) -> None:
+        if not self.enabled:
+            return
+        self._pending[key] = value
+        if len(self._pending) >= self.batch_size and self._wake is not None:
+            self._wake.set()
+
+    def save_game(self, chat_id: int, game: Game, version: int) -> int:
+        # Сериализуется при сбросе, поэтому несколько ходов подряд дают одну запись
+        self._mark(("games", chat_id), (game, version + 1))
+        return version + 1
+
+    def delete_game(self, chat_id: int) -> None:
+        self._mark(("games", chat_id), None)
+
+    def save_ban(self, name: str, banned: bool) -> None:
+        self._mark(("bans", name), True if banned else None)
+
+    def save_chat_stats(self, chat_id: int, stats: dict) -> None:
+        self._mark(("chat_stats", chat_id), stats)
+
+    def save_chat(self, chat_id: int) -> None:
+        self._mark(("chats", chat_id), True)
+
+    # --- Сброс ---
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    @staticmethod
+    def _serialize(batch: Dict[_Key, Any]) -> List[Tuple[str, tuple]]:
+        """Готовит SQL для пакета (в event loop, пока объекты не меняются)"""
+        now = time.time()
+        statements = []
+        for (table, key), value in batch.items():
+            if value is None:
+                column = "name" if table == "bans" else "chat_id"
+                statements.append((f"DELETE FROM {table} WHERE {column} = ?", (key,)))
+            elif table == "games":
+                game, version = value
+                data = json.dumps(game.to_dict(), ensure_ascii=False)
+                statements.append(("INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?)",
+                                   (key, int(game.game_over), data, now, version)))
+            elif table == "chat_stats":
+                statements.append(("INSERT OR REPLACE INTO chat_stats VALUES (?, ?)",
+                                   (key, json.dumps(value, ensure_ascii=False))))
+            else:
+                statements.append((f"INSERT OR IGNORE INTO {table} VALUES (?)", (key,)))
+        return statements
+
+    def _write(self, statements: List[Tuple[str, tuple]]) -> None:
+        conn = self._writer
+        conn.execute("BEGIN")
+        try:
+            for sql, params in statements:
+                conn.execute(sql, params)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def flush(self) -> None:
+        """Пишет накопленные изменения одной транзакцией вне event loop"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        started = time.monotonic()
+        try:
+            await asyncio.to_thread(self._write, self._serialize(batch))
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Не удалось сохранить {len(batch)} записей: {e}")
+            # Возвращаем в очередь то, что не успело измениться заново
+            for key, value in batch.items():
+                self._pending.setdefault(key, value)
+            return
+        elapsed = time.monotonic() - started
+        self.flushes += 1
+        self.rows_written += len(batch)
+        self.flush_time_total += elapsed
+        self.flush_time_max = max(self.flush_time_max, elapsed)
+
+    async def close(self) -> None:
+        """Останавливает фоновый сброс, дописывает остаток и закрывает базу"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.enabled:
+            await self.flush()
+            self._reader.close()
+            self._writer.close()
+            self._reader = self._writer = None
+
+    def stats(self) -> dict:
+        return {
+            "backend": "local",
+            "enabled": self.enabled,
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "errors": self.errors,
+            "flush_ms_avg": round(self.flush_time_total / self.flushes * 1000, 2) if self.flushes else 0.0,
+            "flush_ms_max": round(self.flush_time_max * 1000, 2),
+            "games_loaded": self.games_loaded,
+        }
+
+
+def create_backend() -> StateBackend:
+    """Хранилище по STATE_BACKEND: local, memory, sqlite (общий файл) или redis"""
+    if STATE_BACKEND == "redis":
+        return RedisBackend(REDIS_URL, REDIS_PREFIX, GAME_FINISHED_TTL_SECONDS, GAME_IDLE_TTL_SECONDS)
+    if STATE_BACKEND == "sqlite":
+        return SharedSQLiteBackend(STATE_SQLITE_PATH or DB_PATH)
+    if STATE_BACKEND == "memory" or not DB_PATH:
+        return MemoryBackend()
+    if STATE_BACKEND != "local":
+        logger.warning(f"Неизвестный STATE_BACKEND={STATE_BACKEND!r} — используется local")
+    return SQLiteStore(DB_PATH, STORAGE_FLUSH_INTERVAL_SECONDS, STORAGE_BATCH_SIZE)
+
+
+storage: StateBackend = create_backend()
@@ -0,0 +1,156 @@
+# timing_wheel.py
+"""
+Таймауты игр на хешированном колесе таймеров.
+
+Колесо — кольцо из TIMEOUT_WHEEL_SLOTS ячеек по TIMEOUT_TICK_SECONDS. Таймаут
+кладётся в ячейку (текущая + задержка в тиках) по модулю размера кольца с
+числом оставшихся полных оборотов; индекс ключ -> ячейка даёт постановку,
+перестановку и отмену за O(1). Каждый тик обрабатывается одна ячейка: истёкшие
+записи забираются пачкой и передаются в ограниченную очередь (TIMEOUT_QUEUE_MAX),
+которую разбирают TIMEOUT_WORKERS воркеров. Если очередь полна, таймаут
+переносится на следующий тик.
+
+На ключ (chat_id) приходится не больше одного таймаута: arm() заменяет прежний.
+Таймауты живут только в памяти процесса; обработчик сам проверяет, актуален ли
+таймаут (позиция игры), поэтому опоздавшее срабатывание безопасно.
+"""
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import TIMEOUT_TICK_SECONDS, TIMEOUT_WHEEL_SLOTS, TIMEOUT_WORKERS, TIMEOUT_QUEUE_MAX
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[int, Any], Awaitable[None]]
+
+
+class TimingWheel:
+    """Колесо таймеров с пакетным срабатыванием через пул воркеров"""
+
+    def __init__(self, tick: float, slots: int, workers: int, max_queue: int) -> None:
+        self.tick = tick
+        self.workers = workers
+        self.max_queue = max_queue
+        # Ячейка: {ключ: [оставшиеся обороты, данные]}
+        self._slots: List[Dict[int, list]] = [{} for _ in range(slots)]
+        self._where: Dict[int, int] = {}
+        self._cursor = 0
+        self._handler: Optional[Handler] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # Метрики
+        self.armed_total = 0
+        self.cancelled = 0
+        self.fired = 0
+        self.deferred = 0
+        self.errors = 0
+        self.largest_batch = 0
+        self.lag_max = 0.0
+
+    def arm(self, key: int, delay: float, data: Any = None) -> None:
+        """Ставит (или переставляет) таймаут ключа через delay секунд"""
+        self.cancel(key)
+        size = len(self._slots)
+        ticks = max(1, math.ceil(delay / self.tick))
+        slot = (self._cursor + ticks) % size
+        self._slots[slot][key] = [(ticks - 1) // size, data]
+        self._where[key] = slot
+        self.armed_total += 1
+
+    def cancel(self, key: int) -> bool:
+        slot = self._where.pop(key, None)
+        if slot is None:
+            return False
+        del self._slots[slot][key]
+        self.cancelled += 1
+        return True
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._where
+
+    def _advance(self) -> List[Tuple[int, Any]]:
+        """Сдвигает колесо на тик и забирает истёкшие таймауты"""
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        bucket = self._slots[self._cursor]
+        expired = []
+        for key, entry in bucket.items():
+            if entry[0] == 0:
+                expired.append((key, entry[1]))
+            else:
+                entry[0] -= 1
+        for key, _ in expired:
+            del bucket[key]
+            del self._where[key]
+        return expired
+
+    # --- Срабатывание ---
+
+    def start(self, handler: Handler) -> None:
+        """Запускает колесо; handler(key, data) вызывается для истёкших таймаутов"""
+        if self._tasks:
+            return
+        self._handler = handler
+        self._queue = asyncio.Queue(self.max_queue)
+        self._tasks = [asyncio.create_task(self._run())]
+        self._tasks += [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def shutdown(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self) -> None:
+        next_tick = time.monotonic() + self.tick
+        while True:
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            now = time.monotonic()
+            self.lag_max = max(self.lag_max, now - next_tick)
+            # После задержки event loop догоняем все пропущенные тики
+            while next_tick <= now:
+                next_tick += self.tick
+                batch = self._advance()
+                if batch:
+                    self.largest_batch = max(self.largest_batch, len(batch))
+                    self._dispatch(batch)
+
+    def _dispatch(self, batch: List[Tuple[int, Any]]) -> None:
+        for key, data in batch:
+            try:
+                self._queue.put_nowait((key, data))
+            except asyncio.QueueFull:
+                # Воркеры не успевают — попробуем на следующем тике
+                self.deferred += 1
+                self.arm(key, self.tick, data)
+
+    async def _worker(self) -> None:
+        while True:
+            key, data = await self._queue.get()
+            self.fired += 1
+            try:
+                await self._handler(key, data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Ошибка обработки таймаута {key}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "armed": len(self._where),
+            "armed_total": self.armed_total,
+            "cancelled": self.cancelled,
+            "fired": self.fired,
+            "deferred": self.deferred,
+            "errors": self.errors,
+            "queue": self._queue.qsize() if self._queue is not None else 0,
+            "largest_batch": self.largest_batch,
+            "lag_ms_max": round(self.lag_max * 1000, 2),
+        }
+
+
+# Таймауты игр по chat_id: данные — (вид таймаута, позиция игры), см. moves.arm_timeout
+game_timeouts = TimingWheel(TIMEOUT_TICK_SECONDS, TIMEOUT_WHEEL_SLOTS, TIMEOUT_WORKERS, TIMEOUT_QUEUE_MAX)
@@ -0,0 +1,157 @@
+# transport.py
+"""
+HTTP-клиент для запросов к Bot API.
+
+Два отдельных пула соединений: для запросов из обработчиков обновлений
+(BOT_API_POOL_SIZE) и для фоновых заданий — рассылок (BOT_API_BACKGROUND_POOL_SIZE),
+чтобы долгая рассылка не занимала соединения, нужные ходам игр.
+
+Настраиваются keep-alive (BOT_API_KEEPALIVE_CONNECTIONS, BOT_API_KEEPALIVE_EXPIRY),
+таймауты по умолчанию и по методам (BOT_API_METHOD_TIMEOUTS, например
+"answerCallbackQuery=2,sendMessage=10" — задаёт таймаут чтения), HTTP/2
+(BOT_API_HTTP2=1, нужен пакет h2; без него используется HTTP/1.1).
+
+Для каждого метода Bot API собираются гистограмма задержек и число ошибок
+(исключения и ответы с кодом >= 400) — см. stats() и /metrics.
+"""
+import bisect
+import importlib.util
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+from config import (
+    BOT_API_CONNECT_TIMEOUT, BOT_API_READ_TIMEOUT, BOT_API_WRITE_TIMEOUT, BOT_API_POOL_TIMEOUT,
+    BOT_API_KEEPALIVE_CONNECTIONS, BOT_API_KEEPALIVE_EXPIRY, BOT_API_HTTP2, BOT_API_METHOD_TIMEOUTS
+)
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограммы задержек (мс); последняя корзина — всё, что дольше
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _parse_method_timeouts(spec: str) -> Dict[str, float]:
+    timeouts = {}
+    for item in spec.split(","):
+        method, _, value = item.strip().partition("=")
+        if method and value:
+            try:
+                timeouts[method.strip()] = float(value)
+            except ValueError:
+                logger.warning(f"Некорректный таймаут для {method!r}: {value!r}")
+    return timeouts
+
+
+_method_timeouts = _parse_method_timeouts(BOT_API_METHOD_TIMEOUTS)
+
+
+class MethodStats:
+    """Гистограмма задержек и ошибки одного метода"""
+
+    __slots__ = ("buckets", "calls", "errors", "total", "longest")
+
+    def __init__(self) -> None:
+        self.buckets: List[int] = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.longest = 0.0
+
+    def record(self, elapsed: float, error: bool) -> None:
+        self.calls += 1
+        self.errors += error
+        self.total += elapsed
+        self.longest = max(self.longest, elapsed)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed * 1000)] += 1
+
+    def as_dict(self) -> dict:
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "ms_avg": round(self.total / self.calls * 1000, 2) if self.calls else 0.0,
+            "ms_max": round(self.longest * 1000, 2),
+            "histogram": dict(zip(labels, self.buckets)),
+        }
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest с таймаутами по методам и метриками задержек"""
+
+    def __init__(self, name: str, pool_size: int, http_version: str = "1.1") -> None:
+        super().__init__(
+            connection_pool_size=pool_size,
+            connect_timeout=BOT_API_CONNECT_TIMEOUT,
+            read_timeout=BOT_API_READ_TIMEOUT,
+            write_timeout=BOT_API_WRITE_TIMEOUT,
+            pool_timeout=BOT_API_POOL_TIMEOUT,
+            http_version=http_version,
+            httpx_kwargs={
+                "limits": httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=min(pool_size, BOT_API_KEEPALIVE_CONNECTIONS),
+                    keepalive_expiry=BOT_API_KEEPALIVE_EXPIRY,
+                ),
+            },
+        )
+        self.name = name
+        self.methods: Dict[str, MethodStats] = {}
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        # Таймаут метода действует, только если вызов не задал свой
+        if read_timeout is BaseRequest.DEFAULT_NONE and api_method in _method_timeouts:
+            read_timeout = _method_timeouts[api_method]
+        method_stats = self.methods.get(api_method)
+        if method_stats is None:
+            method_stats = self.methods[api_method] = MethodStats()
+        started = time.perf_counter()
+        error = True
+        try:
+            code, payload = await super().do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+            )
+            error = code >= 400
+            return code, payload
+        finally:
+            method_stats.record(time.perf_counter() - started, error)
+
+    def stats(self) -> dict:
+        return {method: method_stats.as_dict() for method, method_stats in sorted(self.methods.items())}
+
+
+def _http_version() -> str:
+    if not BOT_API_HTTP2:
+        return "1.1"
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("BOT_API_HTTP2=1, но пакет h2 не установлен — используется HTTP/1.1")
+        return "1.1"
+    return "2"
+
+
+_requests: Dict[str, InstrumentedRequest] = {}
+
+
+def build_request(name: str, pool_size: int) -> InstrumentedRequest:
+    """Создаёт пул соединений с именем name (имя — ключ в метриках)"""
+    request = InstrumentedRequest(name, pool_size, _http_version())
+    _requests[name] = request
+    return request
+
+
+def stats() -> dict:
+    """Метрики по пулам и методам Bot API"""
+    return {name: request.stats() for name, request in _requests.items()}
@@ -0,0 +1,150 @@
+# update_dispatcher.py
+"""
+Обработка входящих обновлений вне HTTP-запроса вебхука.
+
+Вебхук только кладёт обновление в очередь и сразу отвечает Telegram 200.
+Пул из UPDATE_WORKERS воркеров обрабатывает обновления параллельно для разных
+чатов, но строго по порядку внутри одного chat_id: у каждого чата своя очередь,
+и в любой момент её разбирает не больше одного воркера. Поэтому медленная партия
+(«раздумья» ИИ, кадры анимации) задерживает только свой чат.
+
+С общим хранилищем состояния (несколько процессов бота) перед обработкой
+обновления игра чата один раз перечитывается из хранилища (games.refresh,
+вне event loop); обработчики дальше работают с копией в памяти.
+
+Если в очереди уже UPDATE_QUEUE_MAX обновлений, submit() возвращает False —
+вебхук отвечает ошибкой, и Telegram доставит обновление повторно.
+
+При остановке (shutdown) новые обновления не принимаются (тоже False), а уже
+принятые — Telegram получил на них 200 и повторно их не пришлёт —
+дообрабатываются до UPDATE_DRAIN_TIMEOUT_SECONDS; только потом воркеры
+отменяются.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+from config import UPDATE_WORKERS, UPDATE_QUEUE_MAX, UPDATE_DRAIN_TIMEOUT_SECONDS
+from game_state import games
+
+logger = logging.getLogger(__name__)
+
+
+def _order_key(update: Update) -> int:
+    """Ключ упорядочивания: чат, иначе пользователь, иначе само обновление"""
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return update.update_id
+
+
+class UpdateDispatcher:
+    """Очереди обновлений по чатам и пул воркеров"""
+
+    def __init__(self, workers: int, max_queue: int, drain_timeout: float) -> None:
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.drain_timeout = drain_timeout
+        self.closing = False
+        self._application: Optional[Application] = None
+        # Обновления, ожидающие обработки, по ключу чата (с моментом постановки в очередь)
+        self._chat_queues: Dict[int, Deque[Tuple[Update, float]]] = {}
+        # Чаты, у которых есть обновления и которые сейчас никто не разбирает
+        self._ready: "asyncio.Queue[int]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        # Метрики
+        self.depth = 0
+        self.max_depth_seen = 0
+        self.processed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.busy = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def start(self, application: Application) -> None:
+        self._application = application
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            logger.info(f"Update dispatcher started: workers={self.workers}")
+
+    async def shutdown(self) -> None:
+        """Перестаёт принимать обновления, дообрабатывает принятые и останавливает воркеров"""
+        self.closing = True
+        deadline = time.monotonic() + self.drain_timeout
+        while (self.depth or self.busy) and self._tasks and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.depth or self.busy:
+            logger.warning(f"Остановка: не обработано обновлений в очереди: {self.depth}, в работе: {self.busy}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, update: Update) -> bool:
+        """Ставит обновление в очередь его чата. False — очередь переполнена или бот останавливается."""
+        if self.closing or self.depth >= self.max_queue:
+            self.rejected += 1
+            return False
+        key = _order_key(update)
+        chat_queue = self._chat_queues.get(key)
+        if chat_queue is None:
+            # Чата нет в словаре — значит, его никто не разбирает
+            chat_queue = self._chat_queues[key] = deque()
+            self._ready.put_nowait(key)
+        chat_queue.append((update, time.monotonic()))
+        self.depth += 1
+        self.max_depth_seen = max(self.max_depth_seen, self.depth)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            chat_queue = self._chat_queues[key]
+            update, queued_at = chat_queue.popleft()
+            self.depth -= 1
+            waited = time.monotonic() - queued_at
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+            self.busy += 1
+            try:
+                await games.refresh(key)
+                await self._application.process_update(update)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Ошибки обработчиков уходят в error_handler приложения; сюда попадает остальное
+                self.errors += 1
+                logger.error(f"Не удалось обработать обновление {update.update_id}: {e}")
+            finally:
+                self.busy -= 1
+                self.processed += 1
+                if chat_queue:
+                    # Следующее обновление этого чата — в конец общей очереди, чтобы не занимать воркер
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chat_queues[key]
+
+    def stats(self) -> dict:
+        """Глубина очереди, время ожидания и загрузка воркеров"""
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "queue_depth": self.depth,
+            "max_depth_seen": self.max_depth_seen,
+            "chats_queued": len(self._chat_queues),
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "wait_ms_avg": round(self.wait_time_total / self.processed * 1000, 2) if self.processed else 0.0,
+            "wait_ms_max": round(self.wait_time_max * 1000, 2),
+        }
+
+
+update_dispatcher = UpdateDispatcher(UPDATE_WORKERS, UPDATE_QUEUE_MAX, UPDATE_DRAIN_TIMEOUT_SECONDS)
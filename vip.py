@@ -1,7 +1,30 @@
 # vip.py
-from datetime import datetime
+"""
+VIP-пользователи: подписки, аватары, подписи и символы.
+
+Изменения применяются в памяти сразу, а на диск уходят отложенно (VipWriter):
+изменение помечает данные «грязными», и не раньше чем через
+VIP_SAVE_DELAY_SECONDS фоновая задача записывает последний снимок вне event loop —
+атомарно (временный файл, fsync, os.replace). Несколько изменений подряд дают
+одну запись.
+
+Чтобы изменения между снимками не терялись при падении, каждое из них
+дописывается одной строкой в журнал VIP_DATA_FILE.journal (VIP_JOURNAL=1):
+стоимость изменения не зависит от числа VIP. Строки журнала пронумерованы;
+снимок помнит номер последнего учтённого изменения, при загрузке поверх
+снимка применяются только более поздние строки. После записи снимка журнал
+очищается.
+"""
+import asyncio
 import json
+import logging
 import os
+from datetime import datetime
+from typing import List, Optional
+
+from config import VIP_DATA_FILE, VIP_SAVE_DELAY_SECONDS, VIP_JOURNAL
+
+logger = logging.getLogger(__name__)
 
 vip_users: set[int] = set()
 vip_usernames: set[str] = set()
@@ -16,71 +39,26 @@ subscriptions: dict[int, datetime] = {}
 # Добавление: хранение и функции пользовательских символов для VIP
 custom_symbols: dict[int, str] = {}
 
-VIP_DATA_FILE = os.path.join(os.path.dirname(__file__), 'vip_data.json')
 
-# Функции для сохранения и загрузки VIP-данных
-def load_vip_data() -> None:
-    if os.path.exists(VIP_DATA_FILE):
-        with open(VIP_DATA_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            vip_users.update(data.get('vip_users', []))
-            vip_usernames.update(data.get('vip_usernames', []))
-            avatars.update(data.get('avatars', {}))
-            signatures.update(data.get('signatures', {}))
-            custom_symbols.update(data.get('custom_symbols', {}))
-            subscriptions.update({int(k): datetime.fromisoformat(v) for k, v in data.get('subscriptions', {}).items()})
-
-def save_vip_data() -> None:
-    data = {
-        'vip_users': list(vip_users),
-        'vip_usernames': list(vip_usernames),
-        'avatars': avatars,
-        'signatures': signatures,
-        'custom_symbols': custom_symbols,
-        'subscriptions': {str(k): v.isoformat() for k, v in subscriptions.items()}
-    }
-    with open(VIP_DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+# --- Изменения (применяются и при загрузке журнала) ---
 
-# Загружаем данные при старте модуля
-load_vip_data()
-
-def is_vip(user_id: int) -> bool:
-    return user_id in vip_users
-
-
-def is_vip_by_username(username: str) -> bool:
-    return username in vip_usernames
-
-
-def add_vip(user_id: int, username: str = None) -> None:
+def _add_vip(user_id: int, username: Optional[str], subscribed_at: str) -> None:
     # Добавляем VIP и сохраняем время подписки
     vip_users.add(user_id)
-    subscriptions[user_id] = datetime.now()
+    subscriptions[user_id] = datetime.fromisoformat(subscribed_at)
     if username:
         vip_user_map[user_id] = username
         vip_usernames.add(username)
-    # Сохраняем изменения
-    save_vip_data()
 
 
-def remove_vip(user_id: int, username: str = None) -> bool:
-    """Удаляет VIP-статус у пользователя
-    
-    Args:
-        user_id: ID пользователя
-        username: Юзернейм пользователя (опционально)
-    
-    Returns:
-        bool: True если пользователь был в VIP и успешно удален, False если его не было в VIP
-    """
+def _remove_vip(user_id: int, username: Optional[str]) -> bool:
     was_vip = False
-    
+
     # Удаляем из списка VIP-пользователей по ID
     if user_id in vip_users:
         vip_users.remove(user_id)
         was_vip = True
-        
+
         # Очищаем связанные данные
         if user_id in subscriptions:
             del subscriptions[user_id]
@@ -90,29 +68,257 @@ def remove_vip(user_id: int, username: str = None) -> bool:
             del signatures[user_id]
         if user_id in custom_symbols:
             del custom_symbols[user_id]
-            
+
         # Удаляем из маппинга и username только если совпадает с переданным
         if user_id in vip_user_map:
             stored_username = vip_user_map[user_id]
             if stored_username in vip_usernames:
                 vip_usernames.remove(stored_username)
             del vip_user_map[user_id]
-    
+
     # Если передан username и он есть в списке VIP-юзернеймов
     if username and username in vip_usernames:
         vip_usernames.remove(username)
         was_vip = True
+
+    return was_vip
+
+
+def _set_avatar(user_id: int, emoji: str) -> None:
+    avatars[user_id] = emoji
+
+
+def _set_signature(user_id: int, text: str) -> None:
+    signatures[user_id] = text
+
+
+def _set_symbol(user_id: int, emoji: str) -> None:
+    custom_symbols[user_id] = emoji
+
+
+_OPS = {
+    "add_vip": _add_vip,
+    "remove_vip": _remove_vip,
+    "set_avatar": _set_avatar,
+    "set_signature": _set_signature,
+    "set_symbol": _set_symbol,
+}
+
+
+# --- Сохранение ---
+
+def _snapshot(seq: int) -> dict:
+    return {
+        'seq': seq,
+        'vip_users': list(vip_users),
+        'vip_usernames': list(vip_usernames),
+        'vip_user_map': {str(k): v for k, v in vip_user_map.items()},
+        'avatars': {str(k): v for k, v in avatars.items()},
+        'signatures': {str(k): v for k, v in signatures.items()},
+        'custom_symbols': {str(k): v for k, v in custom_symbols.items()},
+        'subscriptions': {str(k): v.isoformat() for k, v in subscriptions.items()}
+    }
+
+
+def _write_snapshot(path: str, data: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    # Переименование тоже должно пережить сбой питания
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class VipWriter:
+    """Отложенная атомарная запись VIP-данных с журналом изменений"""
+
+    def __init__(self, path: str, delay: float, journal: bool) -> None:
+        self.path = path
+        self.delay = delay
+        self.journal_path = f"{path}.journal" if journal else ""
+        self._journal = None
+        # Номер последнего изменения и последнего изменения в записанном снимке
+        self.seq = 0
+        self.saved_seq = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Метрики
+        self.changes = 0
+        self.snapshots = 0
+        self.errors = 0
+
+    @property
+    def dirty(self) -> bool:
+        return self.seq != self.saved_seq
+
+    def load(self) -> None:
+        """Загружает снимок и применяет к нему журнал"""
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Не удалось прочитать VIP-данные {self.path}: {e}")
+                data = {}
+            vip_users.update(data.get('vip_users', []))
+            vip_usernames.update(data.get('vip_usernames', []))
+            # Ключи JSON — строки, в памяти — id пользователей
+            vip_user_map.update({int(k): v for k, v in data.get('vip_user_map', {}).items()})
+            avatars.update({int(k): v for k, v in data.get('avatars', {}).items()})
+            signatures.update({int(k): v for k, v in data.get('signatures', {}).items()})
+            custom_symbols.update({int(k): v for k, v in data.get('custom_symbols', {}).items()})
+            subscriptions.update({int(k): datetime.fromisoformat(v) for k, v in data.get('subscriptions', {}).items()})
+            self.seq = self.saved_seq = data.get('seq', 0)
+        if not self.journal_path or not os.path.exists(self.journal_path):
+            return
+        replayed = 0
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Недописанная при падении строка
+                    continue
+                if entry['seq'] <= self.seq:
+                    continue
+                _OPS[entry['op']](*entry['args'])
+                self.seq = entry['seq']
+                replayed += 1
+        if replayed:
+            logger.info(f"VIP: применено {replayed} изменений из журнала")
+
+    def changed(self, op: str, args: List) -> None:
+        """Учитывает изменение: строка в журнал и отложенный снимок"""
+        self.seq += 1
+        self.changes += 1
+        if self.journal_path:
+            try:
+                if self._journal is None:
+                    self._journal = open(self.journal_path, 'a', encoding='utf-8')
+                self._journal.write(json.dumps({'seq': self.seq, 'op': op, 'args': args},
+                                               ensure_ascii=False) + "\n")
+                self._journal.flush()
+            except OSError as e:
+                self.errors += 1
+                logger.error(f"Не удалось дописать журнал VIP-данных: {e}")
+        if self._wake is not None:
+            self._wake.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wake = asyncio.Event()
+            if self.dirty:
+                self._wake.set()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await self._wake.wait()
+            # Изменения за время задержки попадут в тот же снимок
+            await asyncio.sleep(self.delay)
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Записывает текущий снимок, если были изменения"""
+        if not self.dirty:
+            return
+        seq = self.seq
+        data = _snapshot(seq)
+        try:
+            await asyncio.to_thread(_write_snapshot, self.path, data)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Не удалось сохранить VIP-данные: {e}")
+            # Повторим после задержки
+            if self._wake is not None:
+                self._wake.set()
+            return
+        self.saved_seq = max(self.saved_seq, seq)
+        self.snapshots += 1
+        # Журнал больше не нужен, если за время записи не было новых изменений
+        if self._journal is not None and self.seq == seq:
+            self._journal.truncate(0)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def stats(self) -> dict:
+        return {
+            "vip_users": len(vip_users),
+            "changes": self.changes,
+            "pending": self.seq - self.saved_seq,
+            "snapshots": self.snapshots,
+            "errors": self.errors,
+            "journal": bool(self.journal_path),
+        }
+
+
+vip_writer = VipWriter(VIP_DATA_FILE, VIP_SAVE_DELAY_SECONDS, VIP_JOURNAL)
+
+
+def _mutate(op: str, *args):
+    result = _OPS[op](*args)
+    if result is not False:
+        vip_writer.changed(op, list(args))
+    return result
+
+
+def load_vip_data() -> None:
+    vip_writer.load()
+
+
+async def save_vip_data() -> None:
+    """Сохраняет VIP-данные сразу, не дожидаясь задержки"""
+    await vip_writer.flush()
+
+# Загружаем данные при старте модуля
+load_vip_data()
+
+def is_vip(user_id: int) -> bool:
+    return user_id in vip_users
+
+
+def is_vip_by_username(username: str) -> bool:
+    return username in vip_usernames
+
+
+def add_vip(user_id: int, username: str = None) -> None:
+    _mutate("add_vip", user_id, username, datetime.now().isoformat())
+
+
+def remove_vip(user_id: int, username: str = None) -> bool:
+    """Удаляет VIP-статус у пользователя
     
-    # Сохраняем изменения если были изменения
-    if was_vip:
-        save_vip_data()
+    Args:
+        user_id: ID пользователя
+        username: Юзернейм пользователя (опционально)
     
-    return was_vip
+    Returns:
+        bool: True если пользователь был в VIP и успешно удален, False если его не было в VIP
+    """
+    return _mutate("remove_vip", user_id, username)
 
 
 def set_avatar(user_id: int, emoji: str) -> None:
-    avatars[user_id] = emoji
-    save_vip_data()
+    _mutate("set_avatar", user_id, emoji)
 
 
 def get_avatar(user_id: int) -> str:
@@ -121,8 +327,7 @@ def get_avatar(user_id: int) -> str:
 
 def set_signature(user_id: int, text: str) -> None:
     """Устанавливает персональную подпись для пользователя"""
-    signatures[user_id] = text
-    save_vip_data()
+    _mutate("set_signature", user_id, text)
 
 
 def get_signature(user_id: int) -> str:
@@ -137,8 +342,7 @@ def get_subscription_time(user_id: int) -> datetime | None:
 
 def set_symbol(user_id: int, emoji: str) -> None:
     """Устанавливает пользовательский символ для VIP-пользователя"""
-    custom_symbols[user_id] = emoji
-    save_vip_data()
+    _mutate("set_symbol", user_id, emoji)
 
 
 def get_symbol(user_id: int) -> str | None: